@@ -2,39 +2,1386 @@
 # PRODUCTION BACKEND v3.1 
 # Real Gemini AI Generation with Improved Parsing
 # ============================================================================
-
-print("📦 Installing packages...")
-!pip install -q flask flask-cors openai-whisper yt-dlp google-generativeai torch pyngrok
-print("✅ Installation complete!\n")
-
-from flask import Flask, request, jsonify
+# In Colab, install the dependencies in a cell of their own first:
+#   !pip install -q -r Backend/requirements.txt
+# (or: flask flask-cors openai-whisper yt-dlp google-generativeai torch pyngrok numpy)
+# Importing this module defines the app without starting it; running it as a
+# script or notebook cell serves it.
+
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+import uuid
+import wave
+import zlib
+from collections import deque, Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from types import SimpleNamespace
+from typing import NamedTuple
+
+import numpy as np
+import torch
+import whisper
+import yt_dlp
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import whisper, yt_dlp, torch, uuid, threading, json, os
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
 from pyngrok import ngrok
-from pathlib import Path
-import traceback
 
 app = Flask(__name__)
 CORS(app)
 
-jobs = {}
-whisper_model = None
+job_changed = threading.Condition()
+WHISPER_MODEL_NAME = "tiny"
+WHISPER_LANGUAGE = "en"
+
+# ============================================================================
+# TRANSCRIPTION ENGINES - Plain PyTorch or int8-Quantized CPU Inference
+# ============================================================================
+
+TRANSCRIBE_ENGINE = os.environ.get('LECTURE_TRANSCRIBE_ENGINE', 'pytorch')
+TORCH_THREADS = int(os.environ.get('LECTURE_TORCH_THREADS', os.cpu_count() or 1))
+# Model copies that decode chunks of one lecture side by side; they share TORCH_THREADS
+TRANSCRIBE_REPLICAS = int(os.environ.get('LECTURE_TRANSCRIBE_REPLICAS', min(4, os.cpu_count() or 1)))
+DECODE_THREADS = max(1, TORCH_THREADS // TRANSCRIBE_REPLICAS)
+
+class TranscriptionEngine:
+    """Runs a loaded Whisper model; subclasses change how the model executes
+
+    transcribe() takes 16 kHz float32 audio (or a path) plus whisper
+    decoding options and returns whisper's {'text', 'segments'} result.
+    """
+    name = 'pytorch'
+
+    def __init__(self, model):
+        self.model = model
+
+    @classmethod
+    def load(cls, model_name):
+        return cls(whisper.load_model(model_name))
+
+    def transcribe(self, audio, **options):
+        return self.model.transcribe(audio, language=WHISPER_LANGUAGE, fp16=False, **options)
+
+    def memory_bytes(self):
+        # Quantized layers keep packed (weight, bias) tuples in the state dict
+        total = 0
+        for value in self.model.state_dict().values():
+            for tensor in (value if isinstance(value, tuple) else (value,)):
+                if torch.is_tensor(tensor):
+                    total += tensor.numel() * tensor.element_size()
+        return total
+
+def tune_cpu_threads(threads=DECODE_THREADS):
+    """Intra-op threads per decode, no inter-op pool (whisper runs ops sequentially)
+
+    Process-wide, so it is called once at startup - never per engine or per
+    job. Each decode gets its replica's share of TORCH_THREADS, so chunked
+    transcription on every replica at once fills the cores without
+    oversubscribing them.
+    """
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # only settable before the first parallel op; keep whatever is there
+
+class QuantizedCPUEngine(TranscriptionEngine):
+    """Whisper with its Linear layers dynamically quantized to int8 on CPU
+
+    Attention and MLP projections dominate CPU time; int8 weights roughly
+    quarter their memory traffic. Convolutions and embeddings stay float32.
+    """
+    name = 'cpu-int8'
+
+    @classmethod
+    def load(cls, model_name):
+        return cls(whisper.load_model(model_name, device='cpu'))
+
+    def __init__(self, model):
+        model = model.cpu().float()
+        for module in model.modules():
+            # whisper's Linear only adds a dtype cast, so plain nn.Linear is
+            # equivalent and lets quantize_dynamic recognise it
+            if type(module) is whisper.model.Linear:
+                module.__class__ = torch.nn.Linear
+        super().__init__(torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+TRANSCRIBE_ENGINES = {engine.name: engine for engine in (TranscriptionEngine, QuantizedCPUEngine)}
+
+# ============================================================================
+# WHISPER MODEL POOL - Lazy Loading, LRU Unloading, Per-Job Model Choice
+# ============================================================================
+
+WHISPER_MAX_RESIDENT = int(os.environ.get('LECTURE_WHISPER_MAX_MODELS', 2))
+WHISPER_CHOICES = ('auto',) + tuple(whisper.available_models())
+
+def load_engine(name, engine=TRANSCRIBE_ENGINE):
+    return TRANSCRIBE_ENGINES[engine].load(name)
+
+class WhisperModelPool:
+    """Whisper engines loaded on first use, at most `max_resident` kept in memory
+
+    Entries are keyed "model/engine". Loading a model only blocks requests
+    for that same model; the least recently used one is dropped when the
+    pool is full. A job still holding a dropped model keeps using it until
+    it finishes.
+
+    Chunked transcription needs several copies of a model, since one
+    Whisper model can't run two decodes at once (decoding hooks its
+    kv-cache onto the model's own layers). Up to `max_replicas - 1` extra
+    copies per resident model are loaded on first use, kept until the model
+    is dropped, and counted in its stats.
+    """
+
+    def __init__(self, max_resident, max_replicas=1):
+        self.max_resident = max_resident
+        self.max_replicas = max(1, max_replicas)
+        self.lock = threading.Lock()
+        self.models = {}
+        self.loading = {}
+        self.extra_copies = {}
+        self.replica_locks = {}
+        self.stats_by_name = {}
+
+    def get(self, model_name, engine=TRANSCRIBE_ENGINE):
+        name = f"{model_name}/{engine}"
+        with self.lock:
+            if name in self.models:
+                self.models[name] = self.models.pop(name)  # most recently used
+                self.stats_by_name[name]['uses'] += 1
+                return self.models[name]
+            name_lock = self.loading.setdefault(name, threading.Lock())
+
+        with name_lock:
+            with self.lock:
+                if name in self.models:
+                    self.stats_by_name[name]['uses'] += 1
+                    return self.models[name]
+
+            print(f"🎙️ Loading Whisper model '{name}'...")
+            t0 = time.perf_counter()
+            model = load_engine(model_name, engine)
+            load_seconds = time.perf_counter() - t0
+            memory = model.memory_bytes()
+            print(f"✅ Whisper '{name}' loaded in {load_seconds:.1f}s ({memory / 1e6:.0f} MB)")
+
+            with self.lock:
+                self.models[name] = model
+                self.stats_by_name[name] = {
+                    'load_seconds': round(load_seconds, 2),
+                    'memory_mb': round(memory / 1e6, 1),
+                    'uses': 1,
+                    'resident': True,
+                    'replicas': 0,
+                    'replica_memory_mb': 0
+                }
+                while len(self.models) > self.max_resident:
+                    evicted = next(iter(self.models))
+                    del self.models[evicted]
+                    self.extra_copies.pop(evicted, None)
+                    self.stats_by_name[evicted].update({'resident': False, 'replicas': 0, 'replica_memory_mb': 0})
+                    print(f"♻️ Unloaded Whisper '{evicted}'")
+            return model
+
+    @contextmanager
+    def replicas(self, model_name, count, engine=TRANSCRIBE_ENGINE):
+        """Check out up to `count` copies of a model (the resident one first) for parallel decoding
+
+        One job at a time holds a model's copies; another chunked job on the
+        same model waits for them.
+        """
+        name = f"{model_name}/{engine}"
+        count = min(count, self.max_replicas)
+        with self.lock:
+            replica_lock = self.replica_locks.setdefault(name, threading.Lock())
+        with replica_lock:
+            model = self.get(model_name, engine)
+            with self.lock:
+                extra = list(self.extra_copies.get(name, []))
+            while len(extra) < count - 1:
+                print(f"🎙️ Loading replica {len(extra) + 1} of Whisper '{name}'...")
+                extra.append(load_engine(model_name, engine))
+            with self.lock:
+                if name in self.models:
+                    self.extra_copies[name] = extra
+                    self.stats_by_name[name].update({
+                        'replicas': len(extra),
+                        'replica_memory_mb': round(sum(replica.memory_bytes() for replica in extra) / 1e6, 1)
+                    })
+            yield [model] + extra[:count - 1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_resident': self.max_resident,
+                'max_replicas': self.max_replicas,
+                'resident': list(self.models),
+                'models': {name: dict(stats) for name, stats in self.stats_by_name.items()}
+            }
+
+whisper_models = WhisperModelPool(WHISPER_MAX_RESIDENT, TRANSCRIBE_REPLICAS)
+
+def choose_whisper_model(requested, duration):
+    """Model for a job: the requested one, or for 'auto' a size that fits the load
+
+    Short lectures on an idle server get a more accurate model; long
+    lectures or a backed-up queue fall back to the fastest one.
+    """
+    if requested != 'auto':
+        return requested
+    queue_depth = scheduler.stats()['queue_depth']
+    if queue_depth >= scheduler.workers or duration > 3600:
+        return 'tiny'
+    if duration <= 600 and queue_depth == 0:
+        return 'small'
+    if duration <= 1800:
+        return 'base'
+    return 'tiny'
+
+# ============================================================================
+# JOB RECORDS - Change Notifications for Long-Poll and SSE Clients
+# ============================================================================
+
+class JobRecord(dict):
+    """Job state dict that wakes long-poll/SSE waiters whenever it changes
+
+    Every top-level write bumps `version`, so a client can ask "anything
+    newer than version N?" and block until the answer is yes. Nested dicts
+    and lists (stages, timings, spans...) must be changed through merge()
+    and append(), which replace them with one top-level write - mutating
+    them in place is neither saved nor notified.
+    """
+
+    nested_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def touch(self):
+        with job_changed:
+            self.version += 1
+        jobs.save(self)
+        with job_changed:
+            job_changed.notify_all()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.touch()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.touch()
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self.touch()
+        return value
+
+    def merge(self, key, changes):
+        """Merge `changes` into the dict at job[key]"""
+        with JobRecord.nested_lock:
+            self.update({key: {**(self.get(key) or {}), **changes}})
+
+    def append(self, key, value):
+        """Append `value` to the list at job[key]"""
+        with JobRecord.nested_lock:
+            self.update({key: (self.get(key) or []) + [value]})
+
+def wait_for_job_change(job_id, version, timeout):
+    """Block until the job moves past `version` (True) or `timeout` passes (False)"""
+    with job_changed:
+        return job_changed.wait_for(lambda: jobs.version_of(job_id) != version, timeout)
+
+# ============================================================================
+# JOB STORE - In-Memory or SQLite, With TTL Eviction and Restart Recovery
+# ============================================================================
+
+JOB_STORE = os.environ.get('LECTURE_JOB_STORE', 'sqlite')
+JOB_DB_PATH = Path('lecture_jobs.db')
+JOB_TTL_SECONDS = 7 * 24 * 3600
+JOB_FLUSH_SECONDS = float(os.environ.get('LECTURE_JOB_FLUSH_SECONDS', 1.0))
+FINAL_STATUSES = ('completed', 'failed')
+
+class MemoryJobStore(dict):
+    """Jobs in a plain dict - nothing survives a restart
+
+    Every job store speaks the mapping protocol plus a small interface:
+    save() after a job changes, save_params() for what it takes to rerun a
+    job, version_of() for cheap change checks, recover() for jobs cut off by
+    a restart, finished_results() to walk completed results and
+    evict_expired() to drop finished jobs past their TTL.
+    """
+
+    def save(self, record):
+        if record.get('status') in FINAL_STATUSES:
+            dict.setdefault(record, 'finished_at', time.time())
+
+    def save_params(self, job_id, params):
+        pass
+
+    def version_of(self, job_id):
+        record = dict.get(self, job_id)
+        return getattr(record, 'version', 0) if record is not None else None
+
+    def recover(self):
+        return []
+
+    def finished_results(self):
+        return [(job_id, record['result']) for job_id, record in list(self.items())
+                if record.get('status') == 'completed' and 'result' in record]
+
+    def evict_expired(self, ttl=JOB_TTL_SECONDS):
+        cutoff = time.time() - ttl
+        expired = [job_id for job_id, record in list(self.items())
+                   if record.get('finished_at', cutoff) < cutoff]
+        for job_id in expired:
+            dict.pop(self, job_id, None)
+        return len(expired)
+
+class SQLiteJobStore:
+    """Jobs persisted to SQLite; only unfinished jobs are kept in memory
+
+    New jobs are written straight away; later changes only mark the job
+    dirty and a flusher thread writes all dirty jobs in one transaction every
+    JOB_FLUSH_SECONDS, so a burst of progress updates costs one commit. When
+    a job finishes it is written at once: its result (full transcript
+    included) goes zlib-compressed into a separate table and the in-memory
+    record is dropped, so memory stays flat however long the server runs.
+    Finished jobs are read back from disk on demand. The rerun parameters
+    are stored without the API key and kept only until the job finishes.
+    """
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.lock = threading.RLock()
+        self.live = {}
+        self.dirty = {}
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT,
+                state TEXT,
+                version INTEGER,
+                params TEXT,
+                updated_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+            CREATE TABLE IF NOT EXISTS results (
+                job_id TEXT PRIMARY KEY,
+                blob BLOB
+            );
+        """)
+        threading.Thread(target=self.flush_forever, name='job-store-flush', daemon=True).start()
+
+    def __contains__(self, job_id):
+        return self.version_of(job_id) is not None
+
+    def __getitem__(self, job_id):
+        record = self.live.get(job_id)
+        if record is not None:
+            return record
+        with self.lock:
+            row = self.db.execute('SELECT state, version FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            blob = self.db.execute('SELECT blob FROM results WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        record = JobRecord(json.loads(row[0]))
+        record.version = row[1]
+        if blob:
+            dict.__setitem__(record, 'result', json.loads(zlib.decompress(blob[0])))
+        return record
+
+    def __setitem__(self, job_id, record):
+        self.live[job_id] = record
+        with self.lock:
+            self.write(record)
+            self.db.commit()
+
+    def get(self, job_id, default=None):
+        try:
+            return self[job_id]
+        except KeyError:
+            return default
+
+    def pop(self, job_id, default=None):
+        record = self.get(job_id, default)
+        self.live.pop(job_id, None)
+        with self.lock:
+            self.dirty.pop(job_id, None)
+            self.db.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+            self.db.execute('DELETE FROM results WHERE job_id = ?', (job_id,))
+            self.db.commit()
+        return record
+
+    def values(self):
+        # Only unfinished jobs live in memory; finished ones are on disk
+        return list(self.live.values())
+
+    def version_of(self, job_id):
+        record = self.live.get(job_id)
+        if record is not None:
+            return getattr(record, 'version', 0)
+        with self.lock:
+            row = self.db.execute('SELECT version FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, record):
+        job_id = record['job_id']
+        with self.lock:
+            if record.get('status') not in FINAL_STATUSES:
+                self.dirty[job_id] = record
+                return
+            self.dirty.pop(job_id, None)
+            self.write(record)
+            self.db.commit()
+        self.live.pop(job_id, None)
+
+    def write(self, record):
+        """Upsert one job row (and its result once finished); the caller holds the lock and commits"""
+        job_id = record['job_id']
+        status = record.get('status')
+        finished = status in FINAL_STATUSES
+        now = time.time()
+        state = json.dumps({k: v for k, v in record.items() if k != 'result'}, default=str)
+
+        self.db.execute("""
+            INSERT INTO jobs (job_id, status, state, version, updated_at, finished_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (job_id) DO UPDATE SET
+                status = excluded.status, state = excluded.state, version = excluded.version,
+                updated_at = excluded.updated_at, finished_at = excluded.finished_at
+        """, (job_id, status, state, getattr(record, 'version', 0), now, now if finished else None))
+        if finished:
+            if 'result' in record:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO results (job_id, blob) VALUES (?, ?)',
+                    (job_id, zlib.compress(json.dumps(record['result']).encode('utf-8'), 6))
+                )
+            self.db.execute('UPDATE jobs SET params = NULL WHERE job_id = ?', (job_id,))
+
+    def flush(self):
+        """Write every job changed since the last flush in one transaction"""
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            for job_id, record in dirty.items():
+                try:
+                    self.write(record)
+                except RuntimeError:
+                    self.dirty[job_id] = record  # changed mid-serialisation - next flush
+            self.db.commit()
+
+    def flush_forever(self):
+        while True:
+            time.sleep(JOB_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Job store flush failed: {e}")
+
+    def save_params(self, job_id, params):
+        # The API key is never written to disk: a resumed job asks for it again
+        stored = {k: v for k, v in params.items() if k != 'api_key'}
+        with self.lock:
+            self.db.execute('UPDATE jobs SET params = ? WHERE job_id = ?', (json.dumps(stored), job_id))
+            self.db.commit()
+
+    def recover(self):
+        """(job_id, params) for every job that was unfinished when the server stopped"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT job_id, state, version, params FROM jobs WHERE finished_at IS NULL'
+            ).fetchall()
+        recovered = []
+        for job_id, state, version, params in rows:
+            record = JobRecord(json.loads(state))
+            record.version = version
+            self.live[job_id] = record
+            recovered.append((job_id, json.loads(params) if params else None))
+        return recovered
+
+    def finished_results(self):
+        """(job_id, result) for every stored result, read one at a time"""
+        with self.lock:
+            ids = [row[0] for row in self.db.execute('SELECT job_id FROM results')]
+        for job_id in ids:
+            with self.lock:
+                row = self.db.execute('SELECT blob FROM results WHERE job_id = ?', (job_id,)).fetchone()
+            if row:
+                yield job_id, json.loads(zlib.decompress(row[0]))
+
+    def evict_expired(self, ttl=JOB_TTL_SECONDS):
+        cutoff = time.time() - ttl
+        with self.lock:
+            expired = [(row[0],) for row in self.db.execute(
+                'SELECT job_id FROM jobs WHERE finished_at < ?', (cutoff,)
+            )]
+            self.db.executemany('DELETE FROM results WHERE job_id = ?', expired)
+            self.db.executemany('DELETE FROM jobs WHERE job_id = ?', expired)
+            self.db.commit()
+        return len(expired)
+
+jobs = SQLiteJobStore() if JOB_STORE == 'sqlite' else MemoryJobStore()
+
+def evict_expired_jobs_forever(interval=3600):
+    while True:
+        removed = jobs.evict_expired()
+        if removed:
+            print(f"🧹 Evicted {removed} expired jobs")
+        search_index.evict_expired()
+        time.sleep(interval)
+
+# ============================================================================
+# METRICS - Stage Spans and Prometheus-Style Histograms
+# ============================================================================
+
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+SIZE_BUCKETS = (500, 1000, 2500, 5000, 10_000, 25_000, 50_000, 100_000, 250_000, 500_000)
+RATIO_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.5, 2.0)
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format"""
+
+    def __init__(self, name, help_text, buckets=SECONDS_BUCKETS, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.setdefault(label_values, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {values: list(counts) for values, counts in self.series.items()}
+        for values, counts in sorted(series.items()):
+            labels = ','.join(f'{key}="{value}"' for key, value in zip(self.labels, values))
+            prefix = labels + ',' if labels else ''
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {counts[-2]}')
+            suffix = f"{{{labels}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {round(counts[-1], 6)}")
+            lines.append(f"{self.name}_count{suffix} {counts[-2]}")
+        return lines
+
+class CounterMetric:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = dict(self.values)
+        for label_values, value in sorted(values.items()):
+            labels = ','.join(f'{key}="{v}"' for key, v in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+METRICS = {
+    'stage_seconds': Histogram('lecture_stage_seconds', 'Time spent in each pipeline stage', labels=('stage', 'status')),
+    'job_seconds': Histogram('lecture_job_seconds', 'End-to-end job time', labels=('status',)),
+    'audio_seconds': Histogram('lecture_audio_seconds', 'Lecture audio duration',
+                               buckets=(60, 300, 600, 1200, 1800, 3600, 5400, 7200, 10800)),
+    'real_time_factor': Histogram('lecture_transcribe_real_time_factor', 'Transcription seconds per second of audio',
+                                  buckets=RATIO_BUCKETS, labels=('model',)),
+    'llm_seconds': Histogram('lecture_llm_call_seconds', 'LLM call latency including streaming'),
+    'prompt_chars': Histogram('lecture_llm_prompt_chars', 'Prompt size in characters', buckets=SIZE_BUCKETS),
+    'response_chars': Histogram('lecture_llm_response_chars', 'Response size in characters', buckets=SIZE_BUCKETS),
+    'parse_success': Histogram('lecture_parse_success_ratio', 'Items parsed / items requested per LLM call',
+                               buckets=RATIO_BUCKETS, labels=('kind',)),
+    'items_requested': CounterMetric('lecture_items_requested_total', 'Items asked of the LLM', labels=('kind',)),
+    'items_parsed': CounterMetric('lecture_items_parsed_total', 'Items parsed from LLM replies', labels=('kind',)),
+    'cache_hits': CounterMetric('lecture_job_cache_hits_total', 'Pipeline stages served from cache', labels=('stage',)),
+}
+
+
+def observe_metric(name, value, *labels):
+    METRICS[name].observe(value, *labels)
+
+def count_metric(name, amount=1, *labels):
+    METRICS[name].inc(amount, *labels)
+
+def record_cache_hit(job_id, stage):
+    jobs[job_id].append('cache_hits', stage)
+    count_metric('cache_hits', 1, stage)
+
+def timing_breakdown(job):
+    """Seconds per stage and each stage's share of the job's wall time
+
+    Generation stages run side by side, so shares can add up to more than 1.
+    """
+    total = job.get('total_seconds') or time.time() - job.get('started_at', time.time())
+    stages = {}
+    for span in job.get('spans') or []:
+        stages[span['stage']] = stages.get(span['stage'], 0) + span['seconds']
+    return {
+        'total_seconds': round(total, 2),
+        'stages': {stage: {'seconds': round(seconds, 2), 'share': round(seconds / total, 3) if total else None}
+                   for stage, seconds in stages.items()}
+    }
+
+class Span:
+    """Times one stage of a job: a histogram sample plus an entry in job['spans']
+
+    Each span records its offset from the job's start, its duration, whether
+    it raised, and any attributes set on it - enough to see where a slow
+    job spent its time. The duration also lands in job['timings'].
+    """
+
+    def __init__(self, job_id, stage, **attrs):
+        self.job_id = job_id
+        self.stage = stage
+        self.attrs = attrs
+        self.seconds = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started_wall = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.seconds = round(time.perf_counter() - self.t0, 3)
+        status = 'failed' if exc_type else 'ok'
+        observe_metric('stage_seconds', self.seconds, self.stage, status)
+        job = jobs.get(self.job_id) if self.job_id else None
+        if job is not None:
+            started_at = job.get('started_at', self.started_wall)
+            entry = {'stage': self.stage, 'start': round(self.started_wall - started_at, 3),
+                     'seconds': self.seconds, 'status': status, **self.attrs}
+            job.merge('timings', {self.stage: round(self.seconds, 2)})
+            job.append('spans', entry)
+        return False
+
+# ============================================================================
+# RESPONSE PARSING - Single-Pass Line Parsers for Gemini Text Replies
+# ============================================================================
+
+class QuizQuestion(NamedTuple):
+    question: str
+    options: dict
+    correct: str
+    explanation: str
+
+class Flashcard(NamedTuple):
+    front: str
+    back: str
+
+class LectureNotes(NamedTuple):
+    summary: str
+    key_concepts: list
+    examples: list
+    study_tips: list
+
+MARKDOWN_NOISE = re.compile(r'\*\*|^[ \t]*#{1,6}[ \t]+', re.M)
+# One pattern per quiz line; the named group that matched says what the line is
+QUIZ_LINE = re.compile(r"""
+    (?P<question> ^(?i:Q(?:uestion)?) \s*\#?\s*\d* \s*[:.)]\s* )
+  | (?P<numbered> ^\d+ \s*[.)]\s+ )
+  | (?P<option> ^\(? (?P<letter>[A-Da-d]) \s*[).:\]]\s* )
+  | (?P<correct> ^(?i:CORRECT(?:\s+ANSWER)?|ANSWER) \s*[:\-]\s*\(? (?P<answer>[A-Da-d])\b )
+  | (?P<explanation> ^(?i:EXPLANATION) \s*[:\-]\s* )
+""", re.X)
+CARD_LINE = re.compile(r'^(?:FLASH)?CARD\s*#?\s*\d+\s*[:.)]?\s*(.*)$', re.I)
+SIDE_LINE = re.compile(r'^(FRONT|BACK)\s*:\s*(.*)$', re.I)
+SECTION_LINE = re.compile(r'^(SUMMARY|KEY[_ ]CONCEPTS|EXAMPLES|STUDY[_ ]TIPS)\s*(?::\s*(.*)|$)', re.I)
+BULLET_LINE = re.compile(r'^(?:[•●▪*+\-]|\d+[.)])\s+(.*)$')
+# Whole replies in exactly the prompted format, matched block by block
+EXACT_LINE = r'[^\S\n]* (\S(?:[^\n]*\S)?) [^\S\n]*'
+QUIZ_EXACT = re.compile(rf"""\s*
+    Q\d+:        {EXACT_LINE} \n [^\S\n]*
+    A\)          {EXACT_LINE} \n [^\S\n]*
+    B\)          {EXACT_LINE} \n [^\S\n]*
+    C\)          {EXACT_LINE} \n [^\S\n]*
+    D\)          {EXACT_LINE} \n [^\S\n]*
+    CORRECT:     [^\S\n]* ([A-D]) [^\S\n]* \n [^\S\n]*
+    EXPLANATION: {EXACT_LINE} (?:\n|\Z)
+""", re.X)
+CARD_EXACT = re.compile(rf"""\s*
+    CARD [^\S\n]+ \d+ [^\S\n]* \n [^\S\n]*
+    FRONT: {EXACT_LINE} \n [^\S\n]*
+    BACK:  {EXACT_LINE} (?:\n|\Z)
+""", re.X)
+NOTES_EXACT_LIST = r'(?: [^\S\n]* (?:•[^\S\n]+\S[^\n]*)? \n )*'
+NOTES_EXACT = re.compile(rf"""\s*
+    SUMMARY:      [^\S\n]*\n ((?:[^\n]*\n)*?)
+    [^\S\n]* KEY_CONCEPTS: [^\S\n]*\n ({NOTES_EXACT_LIST})
+    [^\S\n]* EXAMPLES:     [^\S\n]*\n ({NOTES_EXACT_LIST})
+    [^\S\n]* STUDY_TIPS:   [^\S\n]*\n ({NOTES_EXACT_LIST} [^\S\n]* (?:•[^\S\n]+\S[^\n]*)?) \s*\Z
+""", re.X)
+
+def join_text(text, more):
+    return f"{text} {more}" if text else more
+
+class ResponseParser:
+    """Parses a reply line by line, in one pass, as text arrives
+
+    feed() accepts any slice of the reply (a streamed chunk or the whole
+    thing) and returns the records completed by it; close() flushes the
+    last one and returns everything parsed.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.partial_line = ''
+
+    def feed(self, text):
+        complete, newline, self.partial_line = (self.partial_line + text).rpartition('\n')
+        before = len(self.records)
+        if newline:
+            for line in MARKDOWN_NOISE.sub('', complete).split('\n'):
+                self.line(line.strip())
+        return self.records[before:]
+
+    def close(self):
+        self.feed('\n')
+        self.finish()
+        return self.records
+
+    def exact(self, text):
+        """Parse a whole reply that is exactly in the prompted format, or None
+
+        Matches complete blocks with one regex each instead of dispatching
+        every line; returns the same records feed()/close() would. None
+        means the reply strays from the format and needs the line scanner.
+        """
+        return None
+
+    def match_blocks(self, pattern, text, build):
+        if '**' in text or '#' in text:
+            return None  # markdown the scanner would strip first
+        records, pos, end = [], 0, len(text.rstrip())
+        while pos < end:
+            m = pattern.match(text, pos)
+            if not m:
+                return None
+            records.append(build(*m.groups()))
+            pos = m.end()
+        self.records = records
+        return records
+
+    def line(self, line):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+class QuizParser(ResponseParser):
+    """Q1:/Question 1./1) headers, A)-D) options, CORRECT and EXPLANATION lines
+
+    Unlabelled lines continue whatever came before them, so questions,
+    options and explanations may wrap over several lines.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.current = None
+        self.field = None
+
+    def line(self, line):
+        if not line:
+            return
+        m = QUIZ_LINE.match(line)
+        kind = m.lastgroup if m else None
+        if kind == 'numbered' and self.field not in (None, 'correct', 'explanation'):
+            kind = None  # "1. ..." inside a question or option is just text
+        elif kind == 'option' and self.field not in ('question', 'option'):
+            kind = None
+        if kind == 'question' or kind == 'numbered':
+            self.finish()
+            self.current = {'question': line[m.end():], 'options': {}, 'correct': None, 'explanation': ''}
+            self.field = 'question'
+        elif self.current is None:
+            return  # preamble before the first question
+        elif kind == 'option':
+            self.option = m.group('letter').upper()
+            self.current['options'][self.option] = line[m.end():]
+            self.field = 'option'
+        elif kind == 'correct':
+            self.current['correct'] = m.group('answer').upper()
+            self.field = 'correct'
+        elif kind == 'explanation':
+            self.current['explanation'] = line[m.end():]
+            self.field = 'explanation'
+        elif self.field == 'question':
+            self.current['question'] = join_text(self.current['question'], line)
+        elif self.field == 'option':
+            self.current['options'][self.option] = join_text(self.current['options'][self.option], line)
+        elif self.field == 'explanation':
+            self.current['explanation'] = join_text(self.current['explanation'], line)
+
+    def exact(self, text):
+        return self.match_blocks(QUIZ_EXACT, text, lambda question, a, b, c, d, correct, explanation: QuizQuestion(
+            question, {'A': a, 'B': b, 'C': c, 'D': d}, correct, explanation))
+
+    def finish(self):
+        q, self.current, self.field = self.current, None, None
+        if not q:
+            return
+        opts = {k: v for k, v in q['options'].items() if v}
+        if q['question'] and len(opts) == 4 and q['correct'] in opts:
+            self.records.append(QuizQuestion(
+                q['question'], {k: opts[k] for k in 'ABCD'}, q['correct'],
+                q['explanation'] or "No explanation provided."
+            ))
+
+class FlashcardParser(ResponseParser):
+    """CARD n headers (optional) with FRONT:/BACK: sides that may wrap"""
+
+    def __init__(self):
+        super().__init__()
+        self.current = None
+        self.side = None
+
+    def line(self, line):
+        if not line:
+            return
+        header = CARD_LINE.match(line)
+        if header:
+            self.finish()
+            self.current = {'front': '', 'back': ''}
+            if header.group(1):
+                self.line(header.group(1))
+            return
+        side = SIDE_LINE.match(line)
+        if side:
+            name = side.group(1).lower()
+            if name == 'front' and self.current and self.current['front']:
+                self.finish()  # a new FRONT without a CARD header starts the next card
+            if self.current is None:
+                self.current = {'front': '', 'back': ''}
+            self.side = name
+            self.current[name] = side.group(2).strip()
+        elif self.current is not None and self.side:
+            self.current[self.side] = join_text(self.current[self.side], line)
+
+    def exact(self, text):
+        return self.match_blocks(CARD_EXACT, text, Flashcard)
+
+    def finish(self):
+        card, self.current, self.side = self.current, None, None
+        if card and card['front'] and card['back']:
+            self.records.append(Flashcard(card['front'], card['back']))
+
+class NotesParser(ResponseParser):
+    """SUMMARY text followed by KEY_CONCEPTS / EXAMPLES / STUDY_TIPS bullet lists
+
+    Text before any header counts as summary. In a list, a line without a
+    bullet continues the previous item once the list has used bullets;
+    otherwise every line is its own item.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.section = 'summary'
+        self.summary = []
+        self.lists = {'key_concepts': [], 'examples': [], 'study_tips': []}
+        self.bulleted = False
+
+    def line(self, line):
+        header = SECTION_LINE.match(line)
+        if header:
+            self.section = header.group(1).lower().replace(' ', '_')
+            self.bulleted = False
+            line = (header.group(2) or '').strip()
+            if not line:
+                return
+        if self.section == 'summary':
+            self.summary.append(line)
+            return
+        if not line:
+            return
+        items = self.lists[self.section]
+        bullet = BULLET_LINE.match(line)
+        if bullet:
+            self.bulleted = True
+            if bullet.group(1).strip():
+                items.append(bullet.group(1).strip())
+        elif self.bulleted and items:
+            items[-1] = join_text(items[-1], line)
+        else:
+            items.append(line)
+
+    def exact(self, text):
+        if '**' in text or '#' in text:
+            return None
+        m = NOTES_EXACT.match(text)
+        if not m:
+            return None
+        summary = list(map(str.strip, m.group(1).split('\n')))
+        if any(SECTION_LINE.match(line) for line in summary):
+            return None  # a header-like line inside the summary
+        summary = '\n'.join(summary)
+        if '\n\n\n' in summary:
+            summary = re.sub(r'\n{3,}', '\n\n', summary)
+        # Every list line is "• item" here, so the item is the line minus its bullet
+        lists = ([line[1:].lstrip() for line in map(str.strip, section.split('\n')) if line] for section in m.groups()[1:])
+        return LectureNotes(summary.strip(), *lists)
+
+    def finish(self):
+        pass
+
+    def close(self):
+        super().close()
+        return LectureNotes(re.sub(r'\n{3,}', '\n\n', '\n'.join(self.summary)).strip(), **self.lists)
+
+def parse_reply(parser, text):
+    """Parse a complete reply: whole-block matching when it is exactly in the
+    prompted format, otherwise the line scanner, which recovers what it can"""
+    parsed = parser.exact(text)
+    if parsed is not None:
+        return parsed
+    parser.feed(text)
+    return parser.close()
+
+def numbered(records):
+    """Records as the API's dicts, numbered from 1"""
+    return [{"num": i, **record._asdict()} for i, record in enumerate(records, 1)]
+
+def stream_records(response, parser, num, on_item=None):
+    """Feed a streamed reply into `parser`, reporting records as they complete
+
+    `on_item` gets each of the first `num` records the moment its block
+    closes; reading stops once `num` are in. Returns the characters received.
+    """
+    received = 0
+    emitted = 0
+
+    def emit():
+        nonlocal emitted
+        for record in parser.records[emitted:num]:
+            if on_item:
+                on_item(record)
+            emitted += 1
+
+    for chunk in response:
+        if not chunk.parts:
+            continue  # e.g. a final chunk carrying only the finish reason
+        received += len(chunk.text)
+        parser.feed(chunk.text)
+        emit()
+        if emitted >= num:
+            break
+    parser.close()
+    emit()
+    return received
+
+# ============================================================================
+# LLM CLIENT - Shared Per-Key Clients, Rate Limits, Retries, Circuit Breaker
+# ============================================================================
+
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
+LLM_BACKEND = os.environ.get('LECTURE_LLM_BACKEND', 'gemini')
+LLM_URL = os.environ.get('LECTURE_LLM_URL', 'http://127.0.0.1:8765')
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get('LECTURE_LLM_RPM', 15))
+LLM_BURST = int(os.environ.get('LECTURE_LLM_BURST', 4))
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LECTURE_LLM_TIMEOUT', 120))
+LLM_MAX_ATTEMPTS = 4
+LLM_BACKOFF_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 30.0
+BREAKER_FAILURES = 5
+BREAKER_RESET_SECONDS = 60
+
+RATE_LIMIT_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+RETRYABLE_ERRORS = RATE_LIMIT_ERRORS + (
+    google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded, TimeoutError, ConnectionError, urllib.error.URLError
+)
+
+class TextResponse:
+    """Minimal generate_content() reply: .text, .parts and optional usage"""
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.parts = [text] if text else []
+        self.usage_metadata = SimpleNamespace(**usage) if usage else None
+
+class CircuitOpenError(Exception):
+    pass
+
+class TokenBucket:
+    """`rate` calls per second on average, bursts of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a call may go out; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds):
+        """The server said slow down: hold back every caller for `seconds`"""
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class CircuitBreaker:
+    """Fails calls fast after `failures` errors in a row, for `reset_seconds`
+
+    Then one trial call is let through: success closes the circuit again,
+    failure re-opens it.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.trial = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.failures, self.opened_at, self.trial = 0, None, False
+                return
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at, self.trial = time.monotonic(), False
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if self.trial else 'open'
+
+class LLMMetrics:
+    """Call counts, latency and token totals across every LLM client"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.counts = {'calls': 0, 'failures': 0, 'retries': 0, 'rate_limited': 0, 'circuit_rejected': 0}
+        self.tokens = {'prompt': 0, 'response': 0}
+        self.latencies = deque(maxlen=window)
+        self.throttled_seconds = 0.0
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def throttled(self, seconds):
+        with self.lock:
+            self.throttled_seconds += seconds
+
+    def observe(self, seconds, prompt_tokens, response_tokens):
+        with self.lock:
+            self.counts['calls'] += 1
+            self.latencies.append(seconds)
+            self.tokens['prompt'] += prompt_tokens
+            self.tokens['response'] += response_tokens
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            percentile = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+            return {
+                **self.counts,
+                'tokens': dict(self.tokens),
+                'latency_p50': percentile(0.5),
+                'latency_p95': percentile(0.95),
+                'throttled_seconds': round(self.throttled_seconds, 1)
+            }
+
+llm_metrics = LLMMetrics()
+
+def gemini_backend(api_key):
+    """Gemini models for one key, all sharing one API client and its connections
+
+    The client is set on each model directly instead of through
+    genai.configure(), which is process-wide and races between jobs that
+    use different keys.
+    """
+    client = glm.GenerativeServiceClient(client_options={'api_key': api_key})
+
+    def make_model(generation_config):
+        model = genai.GenerativeModel(GEMINI_MODEL, generation_config=generation_config)
+        model._client = client
+        return model
+    return make_model
+
+class HTTPGenerativeModel:
+    """A local stand-in for Gemini spoken to over plain HTTP (LECTURE_LLM_URL)
+
+    POST {url}/generate with {"model", "prompt", "generation_config", "stream"}.
+    The reply is {"text", "usage"}, or one such object per line when
+    streaming; error statuses map onto the same exceptions Gemini raises.
+    """
+
+    def __init__(self, url, generation_config=None):
+        self.url = url.rstrip('/')
+        self.generation_config = generation_config
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        body = json.dumps({
+            'model': GEMINI_MODEL, 'prompt': prompt,
+            'generation_config': self.generation_config, 'stream': stream
+        }).encode('utf-8')
+        req = urllib.request.Request(f"{self.url}/generate", data=body, headers={'Content-Type': 'application/json'})
+        try:
+            reply = urllib.request.urlopen(req, timeout=(request_options or {}).get('timeout', LLM_TIMEOUT_SECONDS))
+        except urllib.error.HTTPError as e:
+            raise google_exceptions.from_http_status(e.code, e.read().decode('utf-8', 'replace')) from None
+        if not stream:
+            with reply:
+                data = json.load(reply)
+            return TextResponse(data.get('text', ''), data.get('usage'))
+        return self.read_stream(reply)
+
+    def read_stream(self, reply):
+        with reply:
+            for line in reply:
+                if line.strip():
+                    data = json.loads(line)
+                    yield TextResponse(data.get('text', ''), data.get('usage'))
+
+LLM_BACKENDS = {
+    'gemini': gemini_backend,
+    'http': lambda api_key: lambda generation_config: HTTPGenerativeModel(LLM_URL, generation_config)
+}
+
+def usage_dict(response):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return {'prompt_token_count': getattr(usage, 'prompt_token_count', None),
+            'candidates_token_count': getattr(usage, 'candidates_token_count', None)}
+
+class ManagedModel:
+    """What the generators call: a model whose generate_content goes through its LLMClient
+
+    Replies are served from and saved to the prompt cache unless `cache` is
+    off. A streamed reply is only saved if it was read to the end.
+    """
+
+    def __init__(self, client, model, generation_config=None, cache=True):
+        self.client = client
+        self.model = model
+        self.generation_config = generation_config
+        self.cache = cache
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        key = None
+        if self.cache and prompt_cache.enabled:
+            key = prompt_cache.key(self.client.backend, GEMINI_MODEL, prompt, self.generation_config)
+            entry = prompt_cache.get(key)
+            if entry is not None:
+                response = TextResponse(entry['text'], entry.get('usage'))
+                return iter([response]) if stream else response
+        else:
+            prompt_cache.count('bypassed')
+
+        if stream:
+            return self.save_stream(key, prompt, self.client.call_streaming(self.model, prompt))
+        response = self.client.call(self.model, prompt)
+        if key:
+            prompt_cache.put(key, prompt, response.text, usage_dict(response))
+        return response
+
+    def save_stream(self, key, prompt, chunks):
+        received = []
+        chunk = None
+        try:
+            for chunk in chunks:
+                if chunk.parts:
+                    received.append(chunk.text)
+                yield chunk
+        finally:
+            chunks.close()
+        if key:
+            prompt_cache.put(key, prompt, ''.join(received), usage_dict(chunk))
+
+class LLMClient:
+    """Everything that talks to the LLM for one API key
+
+    Models are built once per generation config and reused. Each call waits
+    for the key's token bucket, is retried with jittered exponential backoff
+    on 429s, 5xx and timeouts, and is refused outright while the key's
+    circuit breaker is open. A streamed call is only retried if it failed
+    before its first chunk.
+    """
+
+    def __init__(self, api_key, backend=None, requests_per_minute=LLM_REQUESTS_PER_MINUTE):
+        self.backend = backend or LLM_BACKEND
+        self.make_model = LLM_BACKENDS[self.backend](api_key)
+        self.bucket = TokenBucket(requests_per_minute / 60, LLM_BURST)
+        self.breaker = CircuitBreaker()
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def model(self, generation_config=None, cache=True):
+        key = (json.dumps(generation_config, sort_keys=True), cache)
+        with self.lock:
+            if key not in self.models:
+                self.models[key] = ManagedModel(self, self.make_model(generation_config), generation_config, cache)
+            return self.models[key]
+
+    def before_call(self):
+        if not self.breaker.allow():
+            llm_metrics.count('circuit_rejected')
+            raise CircuitOpenError(f"LLM circuit open after {self.breaker.failures} failures")
+        waited = self.bucket.acquire()
+        if waited:
+            llm_metrics.throttled(waited)
+
+    def failed(self, error, attempt, retry=True):
+        """Record a failed attempt; True if it's worth trying again"""
+        llm_metrics.count('failures')
+        if not isinstance(error, RETRYABLE_ERRORS):
+            self.breaker.record(True)  # the service answered; the request itself was bad
+            return False
+        self.breaker.record(False)
+        delay = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_SECONDS * 2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if isinstance(error, RATE_LIMIT_ERRORS):
+            llm_metrics.count('rate_limited')
+            self.bucket.pause(delay)
+        if not retry or attempt + 1 >= LLM_MAX_ATTEMPTS:
+            return False
+        llm_metrics.count('retries')
+        print(f"  🔁 LLM call failed ({type(error).__name__}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+        return True
+
+    def succeeded(self, prompt, response, text, started):
+        self.breaker.record(True)
+        usage = getattr(response, 'usage_metadata', None)
+        observe_metric('llm_seconds', time.perf_counter() - started)
+        observe_metric('prompt_chars', len(prompt))
+        observe_metric('response_chars', len(text))
+        llm_metrics.observe(
+            time.perf_counter() - started,
+            getattr(usage, 'prompt_token_count', None) or estimate_tokens(prompt),
+            getattr(usage, 'candidates_token_count', None) or estimate_tokens(text)
+        )
+
+    def call(self, model, prompt):
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            self.before_call()
+            started = time.perf_counter()
+            try:
+                response = model.generate_content(prompt, request_options={'timeout': LLM_TIMEOUT_SECONDS})
+                text = response.text
+            except Exception as e:
+                if self.failed(e, attempt):
+                    continue
+                raise
+            self.succeeded(prompt, response, text, started)
+            return response
+
+    def call_streaming(self, model, prompt):
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            self.before_call()
+            started = time.perf_counter()
+            received = []
+            chunk = None
+            try:
+                for chunk in model.generate_content(prompt, stream=True, request_options={'timeout': LLM_TIMEOUT_SECONDS}):
+                    if chunk.parts:
+                        received.append(chunk.text)
+                    yield chunk
+            except GeneratorExit:
+                self.succeeded(prompt, chunk, ''.join(received), started)  # caller had enough
+                raise
+            except Exception as e:
+                if self.failed(e, attempt, retry=not received):
+                    continue
+                raise
+            self.succeeded(prompt, chunk, ''.join(received), started)
+            return
+
+llm_clients = {}
+llm_clients_lock = threading.Lock()
+
+def llm_client(api_key):
+    with llm_clients_lock:
+        if api_key not in llm_clients:
+            llm_clients[api_key] = LLMClient(api_key)
+        return llm_clients[api_key]
 
-# Load Whisper
-print("🎙️ Loading Whisper model...")
-whisper_model = whisper.load_model("tiny")
-print("✅ Whisper loaded!\n")
+def make_gemini_model(api_key, generation_config=None, cache=True):
+    """The shared, rate-limited model for this API key and config
+
+    cache=False skips the prompt cache, for callers that want a fresh reply.
+    """
+    return llm_client(api_key).model(generation_config, cache)
 
 # ============================================================================
 # IMPROVED GEMINI AI FUNCTIONS - Filters Empty Items
 # ============================================================================
 
-def generate_notes_real(transcript, title, api_key):
+def generate_notes_real(transcript, title, api_key, model=None):
     """Generate notes using Gemini - REAL AI with improved parsing"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        model = model or make_gemini_model(api_key)
 
         prompt = f"""Analyze this lecture:
 TITLE: {title}
@@ -58,42 +1405,12 @@ STUDY_TIPS:
         text = response.text
         print(f"  ✅ Got Gemini response ({len(text)} chars)")
 
-        # Parse response with improved filtering
-        summary = text.split("KEY_CONCEPTS:")[0].replace("SUMMARY:", "").strip()
-
-        # Extract and filter key concepts (remove empty items)
-        kc_section = text.split("KEY_CONCEPTS:")[1].split("EXAMPLES:")[0].strip() if "KEY_CONCEPTS:" in text else ""
-        key_concepts = [
-            k.strip().lstrip('•-*').strip()
-            for k in kc_section.split('\n')
-            if k.strip() and k.strip().lstrip('•-*').strip()  # Double check to remove empty
-        ]
-
-        # Extract and filter examples
-        ex_section = text.split("EXAMPLES:")[1].split("STUDY_TIPS:")[0].strip() if "EXAMPLES:" in text else ""
-        examples = [
-            e.strip().lstrip('•-*').strip()
-            for e in ex_section.split('\n')
-            if e.strip() and e.strip().lstrip('•-*').strip()
-        ]
-
-        # Extract and filter study tips
-        st_section = text.split("STUDY_TIPS:")[1].strip() if "STUDY_TIPS:" in text else ""
-        study_tips = [
-            s.strip().lstrip('•-*').strip()
-            for s in st_section.split('\n')
-            if s.strip() and s.strip().lstrip('•-*').strip()
-        ]
-
-        # Debug output
-        print(f"  📊 Parsed: {len(key_concepts)} concepts, {len(examples)} examples, {len(study_tips)} tips")
-
-        return {
-            "summary": summary,
-            "key_concepts": key_concepts,
-            "examples": examples,
-            "study_tips": study_tips
-        }
+        notes = parse_reply(NotesParser(), text)
+        count_metric('items_requested', 1, 'notes')
+        count_metric('items_parsed', int(bool(notes.key_concepts)), 'notes')
+        observe_metric('parse_success', float(bool(notes.key_concepts)), 'notes')
+        print(f"  📊 Parsed: {len(notes.key_concepts)} concepts, {len(notes.examples)} examples, {len(notes.study_tips)} tips")
+        return notes._asdict()
     except Exception as e:
         print(f"  ❌ Notes generation failed: {e}")
         traceback.print_exc()
@@ -104,13 +1421,67 @@ STUDY_TIPS:
             "study_tips": []
         }
 
-def generate_quiz_real(transcript, title, num, api_key):
-    """Generate quiz using Gemini - REAL AI with improved parsing"""
+TOP_UP_ATTEMPTS = 2
+NEAR_DUPLICATE_SIMILARITY = 0.8
+
+def is_near_duplicate(text, others, threshold=NEAR_DUPLICATE_SIMILARITY):
+    """True if `text` shares most of its words with any of `others` (Jaccard)"""
+    words = set(re.findall(r'\w+', text.lower()))
+    for other in others:
+        other_words = set(re.findall(r'\w+', other.lower()))
+        if words and len(words & other_words) / len(words | other_words) >= threshold:
+            return True
+    return False
+
+def generate_items(kind, build_prompt, parser_class, key, num, model, on_item=None):
+    """Ask for `num` items, then top up whatever failed to parse or was a repeat
+
+    Each follow-up asks only for the missing count and lists the accepted
+    items so the model doesn't repeat them; at most TOP_UP_ATTEMPTS
+    follow-ups. `key` picks the text that near-duplicates are judged on.
+    """
+    accepted = []
+
+    def accept(record):
+        if len(accepted) < num and not is_near_duplicate(key(record), [key(r) for r in accepted]):
+            accepted.append(record)
+            if on_item:
+                on_item(record)
+
+    for attempt in range(TOP_UP_ATTEMPTS + 1):
+        missing = num - len(accepted)
+        if missing <= 0:
+            break
+        if attempt:
+            print(f"  🔁 Topping up {kind}: {missing} missing (attempt {attempt}/{TOP_UP_ATTEMPTS})")
+        try:
+            response = model.generate_content(build_prompt(missing, accepted), stream=True)
+            received = stream_records(response, parser_class(), missing, accept)
+        except Exception as e:
+            if not accepted:
+                raise
+            print(f"  ⚠️ {kind} top-up failed, keeping {len(accepted)}: {e}")
+            break
+        parsed = len(accepted) - (num - missing)
+        count_metric('items_requested', missing, kind)
+        count_metric('items_parsed', parsed, kind)
+        observe_metric('parse_success', parsed / missing, kind)
+        print(f"  ✅ Got Gemini response ({received} chars)")
+    return accepted
+
+def already_have(label, texts):
+    """Prompt lines listing accepted items for a top-up request"""
+    if not texts:
+        return ""
+    return f"\n\nThese {label} already exist - do NOT repeat or rephrase them:\n" + "\n".join(f"- {t}" for t in texts)
+
+def generate_quiz_real(transcript, title, num, api_key, model=None, on_item=None):
+    """Generate quiz using Gemini - streamed, each question passed to `on_item` as it's parsed"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        model = model or make_gemini_model(api_key)
 
-        prompt = f"""Create {num} multiple choice questions based on this lecture:
+        def build_prompt(missing, accepted):
+            return f"""Create {missing} multiple choice questions based on this lecture:
 TITLE: {title}
 TRANSCRIPT: {transcript}
 
@@ -124,64 +1495,12 @@ CORRECT: [Letter]
 EXPLANATION: [2-3 sentences explaining why]
 
 Q2: [Next complete question]
-...
+...{already_have('questions', [q.question for q in accepted])}
 
 Make sure every question has meaningful content, not just placeholder text."""
 
         print(f"  🧠 Calling Gemini for quiz...")
-        response = model.generate_content(prompt)
-        text = response.text
-        print(f"  ✅ Got Gemini response ({len(text)} chars)")
-
-        questions = []
-        blocks = text.split('Q')[1:]
-
-        for i, block in enumerate(blocks[:num], 1):
-            try:
-                lines = [l.strip() for l in block.strip().split('\n') if l.strip()]
-                if len(lines) < 6:  # Need Q, A, B, C, D, CORRECT at minimum
-                    continue
-
-                # Extract question
-                q_line = lines[0]
-                question = q_line.split(':', 1)[1].strip() if ':' in q_line else q_line.strip()
-                question = question.lstrip('0123456789. ').strip()  # Remove leading numbers
-
-                if not question:
-                    continue
-
-                opts = {}
-                correct = None
-                expl = ""
-
-                for line in lines[1:]:
-                    line = line.strip()
-                    if line.startswith('A)'):
-                        opts['A'] = line[2:].strip()
-                    elif line.startswith('B)'):
-                        opts['B'] = line[2:].strip()
-                    elif line.startswith('C)'):
-                        opts['C'] = line[2:].strip()
-                    elif line.startswith('D)'):
-                        opts['D'] = line[2:].strip()
-                    elif line.startswith('CORRECT:'):
-                        correct = line.split(':')[1].strip().upper()
-                    elif line.startswith('EXPLANATION:'):
-                        expl = line.split(':', 1)[1].strip()
-
-                # Only add if we have complete data
-                if len(opts) == 4 and correct in ['A', 'B', 'C', 'D'] and question:
-                    questions.append({
-                        "num": len(questions) + 1,  # Use actual count for proper numbering
-                        "question": question,
-                        "options": opts,
-                        "correct": correct,
-                        "explanation": expl if expl else "No explanation provided."
-                    })
-            except Exception as parse_error:
-                print(f"  ⚠️ Failed to parse question {i}: {parse_error}")
-                continue
-
+        questions = numbered(generate_items('quiz', build_prompt, QuizParser, lambda q: q.question, num, model, on_item))
         print(f"  ✅ Generated {len(questions)} quiz questions")
         return questions
 
@@ -190,13 +1509,13 @@ Make sure every question has meaningful content, not just placeholder text."""
         traceback.print_exc()
         return []
 
-def generate_flashcards_real(transcript, title, num, api_key):
-    """Generate flashcards using Gemini - REAL AI with improved parsing"""
+def generate_flashcards_real(transcript, title, num, api_key, model=None, on_item=None):
+    """Generate flashcards using Gemini - streamed, each card passed to `on_item` as it's parsed"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        model = model or make_gemini_model(api_key)
 
-        prompt = f"""Create {num} flashcards for this lecture:
+        def build_prompt(missing, accepted):
+            return f"""Create {missing} flashcards for this lecture:
 TITLE: {title}
 TRANSCRIPT: {transcript}
 
@@ -207,147 +1526,2001 @@ BACK: [Write complete answer here with 2-4 sentences]
 
 CARD 2
 FRONT: [Complete question]
-BACK: [Complete answer]
+BACK: [Complete answer]{already_have('cards', [c.front for c in accepted])}
 
 Make sure every card has meaningful content on both front and back."""
 
         print(f"  🧠 Calling Gemini for flashcards...")
+        cards = numbered(generate_items('flashcards', build_prompt, FlashcardParser, lambda c: c.front, num, model, on_item))
+        print(f"  ✅ Generated {len(cards)} flashcards")
+        return cards
+
+    except Exception as e:
+        print(f"  ❌ Flashcard generation failed: {e}")
+        traceback.print_exc()
+        return []
+
+# ============================================================================
+# COMBINED GENERATION - One Gemini Call, One Structured JSON Response
+# ============================================================================
+
+COMBINED_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "notes": {
+            "type": "OBJECT",
+            "properties": {
+                "summary": {"type": "STRING"},
+                "key_concepts": {"type": "ARRAY", "items": {"type": "STRING"}},
+                "examples": {"type": "ARRAY", "items": {"type": "STRING"}},
+                "study_tips": {"type": "ARRAY", "items": {"type": "STRING"}}
+            },
+            "required": ["summary", "key_concepts", "examples", "study_tips"]
+        },
+        "quiz": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "question": {"type": "STRING"},
+                    "options": {
+                        "type": "OBJECT",
+                        "properties": {
+                            "A": {"type": "STRING"},
+                            "B": {"type": "STRING"},
+                            "C": {"type": "STRING"},
+                            "D": {"type": "STRING"}
+                        },
+                        "required": ["A", "B", "C", "D"]
+                    },
+                    "correct": {"type": "STRING", "enum": ["A", "B", "C", "D"]},
+                    "explanation": {"type": "STRING"}
+                },
+                "required": ["question", "options", "correct", "explanation"]
+            }
+        },
+        "flashcards": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "front": {"type": "STRING"},
+                    "back": {"type": "STRING"}
+                },
+                "required": ["front", "back"]
+            }
+        }
+    },
+    "required": ["notes", "quiz", "flashcards"]
+}
+
+GENERATION_MODES = ('parallel', 'combined', 'grounded')
+
+def parse_combined_response(text, num_q, num_c):
+    """Turn the combined JSON reply into the usual notes/quiz/flashcards shape"""
+    data = json.loads(text)
+
+    raw_notes = data.get('notes') or {}
+    notes = {
+        "summary": str(raw_notes.get('summary', '')).strip(),
+        "key_concepts": [str(k).strip() for k in raw_notes.get('key_concepts', []) if str(k).strip()],
+        "examples": [str(e).strip() for e in raw_notes.get('examples', []) if str(e).strip()],
+        "study_tips": [str(t).strip() for t in raw_notes.get('study_tips', []) if str(t).strip()]
+    }
+
+    quiz = []
+    for q in (data.get('quiz') or [])[:num_q]:
+        question = str(q.get('question', '')).strip()
+        opts = {k: str(v).strip() for k, v in (q.get('options') or {}).items() if k in 'ABCD' and str(v).strip()}
+        correct = str(q.get('correct', '')).strip().upper()
+        if question and len(opts) == 4 and correct in ['A', 'B', 'C', 'D']:
+            quiz.append({
+                "num": len(quiz) + 1,
+                "question": question,
+                "options": {k: opts[k] for k in 'ABCD'},
+                "correct": correct,
+                "explanation": str(q.get('explanation', '')).strip() or "No explanation provided."
+            })
+
+    flashcards = []
+    for c in (data.get('flashcards') or [])[:num_c]:
+        front = str(c.get('front', '')).strip()
+        back = str(c.get('back', '')).strip()
+        if front and back:
+            flashcards.append({"num": len(flashcards) + 1, "front": front, "back": back})
+
+    return {"notes": notes, "quiz": quiz, "flashcards": flashcards}
+
+def generate_all_combined(transcript, title, num_q, num_c, api_key, model=None):
+    """Generate notes, quiz and flashcards in ONE Gemini call
+
+    The transcript is uploaded once instead of three times. Returns None if
+    the call or the JSON parse fails, so the caller can fall back to the
+    three-call path.
+    """
+    try:
+        model = model or make_gemini_model(api_key, generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": COMBINED_SCHEMA
+        })
+
+        prompt = f"""Analyze this lecture and build study materials from it:
+TITLE: {title}
+TRANSCRIPT: {transcript}
+
+Return JSON with:
+- notes.summary: 3-5 paragraphs
+- notes.key_concepts: 10-15 concepts with detailed explanations
+- notes.examples: 3-5 real-world examples
+- notes.study_tips: 3 actionable study tips
+- quiz: exactly {num_q} multiple choice questions, each with options A-D, the correct letter and a 2-3 sentence explanation
+- flashcards: exactly {num_c} cards, each with a complete question on the front and a 2-4 sentence answer on the back
+
+Make sure every item has meaningful content, not just placeholder text."""
+
+        print(f"  🧠 Calling Gemini for combined notes/quiz/flashcards...")
         response = model.generate_content(prompt)
         text = response.text
         print(f"  ✅ Got Gemini response ({len(text)} chars)")
 
-        cards = []
-        blocks = text.split('CARD ')[1:]
+        generated = parse_combined_response(text, num_q, num_c)
+        print(f"  📊 Parsed: {len(generated['notes']['key_concepts'])} concepts, "
+              f"{len(generated['quiz'])} questions, {len(generated['flashcards'])} cards")
+        return generated
+
+    except Exception as e:
+        print(f"  ❌ Combined generation failed: {e}")
+        traceback.print_exc()
+        return None
+
+# ============================================================================
+# PARALLEL GENERATION - Notes, Quiz and Flashcards Fan-Out
+# ============================================================================
 
-        for i, block in enumerate(blocks[:num], 1):
+partial_lock = threading.Lock()
+
+def append_partial(job_id, name, started=None):
+    """on_item callback: publish each streamed record on job['partial'][name]
+
+    The first one also records `<name>_first_item` in the job's timings,
+    measured from `started` (a perf_counter value).
+    """
+    def on_item(record):
+        job = jobs[job_id]
+        with partial_lock:
+            partial = dict(job.get('partial') or {})
+            items = partial.get(name, [])
+            if not items and started is not None:
+                job.merge('timings', {f"{name}_first_item": round(time.perf_counter() - started, 2)})
+            partial[name] = items + [{"num": len(items) + 1, **record._asdict()}]
+            job.update({'partial': partial})
+    return on_item
+
+def run_generation_stages(job_id, stages, progress_from=50, progress_to=95):
+    """Run generation stages at the same time and track each one on the job
+
+    `stages` maps a stage name to a (callable, fallback) pair. Each stage gets
+    its own worker thread, so the phase costs roughly the slowest Gemini call
+    instead of the sum of all of them. A stage that raises is marked failed
+    and its fallback is used - one bad call never sinks the whole job.
+    """
+    job = jobs[job_id]
+    job.merge('stages', {name: {'status': 'running', 'seconds': None} for name in stages})
+    seconds = {}
+    results = {}
+
+    def run_stage(name, fn):
+        with stage_limits['llm'], Span(job_id, name) as span:
             try:
-                front = ""
-                back = ""
-
-                lines = block.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith('FRONT:'):
-                        front = line.split(':', 1)[1].strip()
-                    elif line.startswith('BACK:'):
-                        back = line.split(':', 1)[1].strip()
-
-                # Only add if both front and back have content
-                if front and back:
-                    cards.append({
-                        "num": len(cards) + 1,  # Use actual count for proper numbering
-                        "front": front,
-                        "back": back
-                    })
-            except Exception as parse_error:
-                print(f"  ⚠️ Failed to parse card {i}: {parse_error}")
+                return fn()
+            finally:
+                seconds[name] = round(time.perf_counter() - span.t0, 2)
+
+    phase_start = time.perf_counter()
+    step = (progress_to - progress_from) / max(len(stages), 1)
+
+    with ThreadPoolExecutor(max_workers=max(len(stages), 1)) as pool:
+        futures = {
+            pool.submit(run_stage, name, fn): name
+            for name, (fn, _) in stages.items()
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                job.merge('stages', {name: {'status': 'completed', 'seconds': seconds[name]}})
+                print(f"  ✅ Stage {name} finished in {seconds[name]}s")
+            except Exception as e:
+                results[name] = stages[name][1]
+                job.merge('stages', {name: {
+                    'status': 'failed',
+                    'seconds': seconds[name],
+                    'error': f"{type(e).__name__}: {str(e)}"
+                }})
+                print(f"  ⚠️ Stage {name} failed after {seconds[name]}s: {e}")
+            job.update({'progress': int(progress_from + step * done)})
+
+    generation_seconds = round(time.perf_counter() - phase_start, 2)
+    job.merge('timings', {'generation': generation_seconds})
+    print(f"  ⏱️ Generation phase: {generation_seconds}s")
+    return results
+
+# ============================================================================
+# MAP-REDUCE CONDENSING - Long Transcripts Summarised Chunk by Chunk
+# ============================================================================
+
+MAP_REDUCE_MIN_TOKENS = 24000
+MAP_CHUNK_TOKENS = 6000
+MAP_WORKERS = 4
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+def estimate_tokens(text):
+    # ~4 characters per token for English prose
+    return len(text) // 4
+
+def chunk_transcript(transcript, max_tokens=MAP_CHUNK_TOKENS):
+    """Split at sentence ends into chunks of at most `max_tokens` (estimated)
+
+    A single sentence longer than the budget - Whisper sometimes emits
+    unpunctuated runs - is split on whitespace instead.
+    """
+    max_chars = max_tokens * 4
+    pieces = []
+    for sentence in SENTENCE_END.split(transcript.strip()):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        if current and size + len(piece) + 1 > max_chars:
+            chunks.append(' '.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 1
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+def summarise_chunk(chunk, index, total, title, api_key, model=None):
+    """Map step: dense notes for one slice of the transcript"""
+    model = model or make_gemini_model(api_key)
+
+    prompt = f"""Summarise part {index} of {total} of a lecture transcript:
+TITLE: {title}
+TRANSCRIPT PART: {chunk}
+
+Write dense study notes for this part only:
+SUMMARY:
+[1 paragraph]
+
+KEY_POINTS:
+• [every concept, definition, formula and example mentioned, one per line]"""
+
+    response = model.generate_content(prompt)
+    return response.text.strip()
+
+def condense_transcript(transcript, title, api_key, model=None, max_tokens=MAP_REDUCE_MIN_TOKENS):
+    """Reduce a transcript to section notes that fit in one prompt
+
+    Chunks are summarised in parallel; if the joined summaries are still
+    over budget they are chunked and summarised again, level by level. The
+    result stands in for the transcript in the notes, quiz and flashcard
+    prompts, so all three share one condensing pass.
+
+    A part whose summary fails is kept verbatim, so nothing is lost - the
+    context just comes out longer. Returns (text, number of failed parts).
+    """
+    text = transcript
+    level = 0
+    failed = []
+    while estimate_tokens(text) > max_tokens:
+        level += 1
+        chunks = chunk_transcript(text)
+        print(f"  🗜️ Condensing level {level}: {len(chunks)} chunks")
+
+        def summarise(args):
+            index, chunk = args
+            with stage_limits['llm']:
+                try:
+                    return summarise_chunk(chunk, index, len(chunks), title, api_key, model=model)
+                except Exception as e:
+                    print(f"  ⚠️ Summary of part {index}/{len(chunks)} failed, keeping it verbatim: {e}")
+                    failed.append(index)
+                    return chunk
+
+        with ThreadPoolExecutor(max_workers=MAP_WORKERS) as pool:
+            summaries = list(pool.map(summarise, enumerate(chunks, 1)))
+        condensed = "\n\n".join(f"[Part {i} of {len(chunks)}]\n{summary}" for i, summary in enumerate(summaries, 1))
+        if len(condensed) >= len(text):
+            break  # summaries aren't shrinking - stop rather than loop forever
+        text = condensed
+    return text, len(failed)
+
+# ============================================================================
+# RESULT CACHE - Audio, Transcripts and Generated Artifacts on Disk
+# ============================================================================
+
+CACHE_DIR = Path(os.environ.get('LECTURE_CACHE_DIR', 'lecture_cache'))
+PROMPT_VERSION = '3.1'
+
+class DiskLRUCache:
+    """One persistent cache layer: files on disk, evicted least-recently-used
+
+    Keys are hashed into file names, so entries are content-addressed by
+    whatever the key is built from. Recency is the file mtime, touched on
+    every hit, so LRU order survives a restart. Once the layer grows past
+    `max_bytes` the oldest entries are deleted until it fits again.
+    """
+
+    def __init__(self, name, max_bytes, root=CACHE_DIR):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.dir = Path(root) / name
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = sum(p.stat().st_size for p in self.entries())
+
+    def entries(self):
+        return [p for p in self.dir.iterdir() if p.is_file() and not p.name.startswith('.')]
+
+    def path_for(self, key, suffix=''):
+        return self.dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}{suffix}"
+
+    def get_path(self, key, suffix=''):
+        path = self.path_for(key, suffix)
+        with self.lock:
+            if path.exists():
+                os.utime(path)  # mark as most recently used
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def put_file(self, key, src, suffix='', keep=()):
+        """Move `src` into the cache and return its new path
+
+        Eviction spares the new entry and any paths in `keep` - the other
+        files of an entry written in several parts.
+        """
+        path = self.path_for(key, suffix)
+        with self.lock:
+            if path.exists():
+                self.size -= path.stat().st_size
+            shutil.move(str(src), str(path))
+            self.size += path.stat().st_size
+            self.evict(keep={path, *keep})
+        return path
+
+    def get_json(self, key):
+        path = self.get_path(key, '.json')
+        if path is None:
+            return None
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, key, value, keep=()):
+        tmp = self.dir / f".{uuid.uuid4().hex}.tmp"
+        tmp.write_text(json.dumps(value), encoding='utf-8')
+        return self.put_file(key, tmp, '.json', keep)
+
+    def delete(self, key, suffix=''):
+        path = self.path_for(key, suffix)
+        with self.lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except OSError:
+                return
+            self.size -= size
+
+    def evict(self, keep=()):
+        """Drop least-recently-used entries until the layer fits (lock held)"""
+        if self.size <= self.max_bytes:
+            return
+        for path in sorted(self.entries(), key=lambda p: p.stat().st_mtime):
+            if self.size <= self.max_bytes:
+                break
+            if path in keep:
                 continue
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
 
-        print(f"  ✅ Generated {len(cards)} flashcards")
-        return cards
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'bytes': self.size,
+            'max_bytes': self.max_bytes
+        }
 
-    except Exception as e:
-        print(f"  ❌ Flashcard generation failed: {e}")
-        traceback.print_exc()
-        return []
+audio_cache = DiskLRUCache('audio', 2 * 1024**3)
+metadata_cache = DiskLRUCache('metadata', 16 * 1024**2)
+transcript_cache = DiskLRUCache('transcripts', 256 * 1024**2)
+artifact_cache = DiskLRUCache('artifacts', 256 * 1024**2)
+
+prompt_layer = DiskLRUCache('prompts', int(os.environ.get('LECTURE_PROMPT_CACHE_MB', 256)) * 1024**2)
+vector_cache = DiskLRUCache('vectors', 512 * 1024**2)
+
+CACHE_LAYERS = {
+    'audio': audio_cache,
+    'metadata': metadata_cache,
+    'transcripts': transcript_cache,
+    'artifacts': artifact_cache,
+    'prompts': prompt_layer,
+    'vectors': vector_cache
+}
+
+class PromptCache:
+    """Raw LLM replies keyed by backend, model, normalised prompt and generation config
+
+    Sits under the generators, so re-runs, retried jobs and mirrored uploads
+    with the same transcript never pay for the same prompt twice. Entries
+    keep the reply text as received, so improved parsers can be replayed
+    over them offline. Entries older than `ttl_seconds` count as misses.
+    """
+
+    def __init__(self, layer, ttl_seconds, enabled=True):
+        self.layer = layer
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'expired': 0, 'stored': 0, 'bypassed': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    @staticmethod
+    def key(backend, model_name, prompt, generation_config):
+        normalised = ' '.join(prompt.split())
+        prompt_hash = hashlib.sha256(normalised.encode('utf-8')).hexdigest()
+        return f"{backend}|{model_name}|{prompt_hash}|{json.dumps(generation_config, sort_keys=True)}"
+
+    def get(self, key):
+        entry = self.layer.get_json(key)
+        if entry is None:
+            self.count('misses')
+            return None
+        if time.time() - entry['created'] > self.ttl_seconds:
+            self.layer.delete(key, '.json')
+            self.count('expired')
+            return None
+        self.count('hits')
+        return entry
+
+    def put(self, key, prompt, text, usage=None):
+        if not text:
+            return
+        self.layer.put_json(key, {
+            'created': time.time(),
+            'key': key,
+            'prompt_head': prompt[:200],
+            'text': text,
+            'usage': usage
+        })
+        self.count('stored')
+
+    def entries(self):
+        """Every stored reply, for replaying parsers over them"""
+        for path in self.layer.entries():
+            try:
+                yield json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses'] + self.counts['expired']
+            return {
+                **self.counts,
+                'enabled': self.enabled,
+                'hit_rate': round(self.counts['hits'] / lookups, 3) if lookups else None,
+                'ttl_seconds': self.ttl_seconds
+            }
+
+prompt_cache = PromptCache(
+    prompt_layer,
+    ttl_seconds=float(os.environ.get('LECTURE_PROMPT_CACHE_TTL', 7 * 24 * 3600)),
+    enabled=os.environ.get('LECTURE_PROMPT_CACHE', 'on') != 'off'
+)
+
+YOUTUBE_ID_PATTERN = re.compile(r'(?:v=|youtu\.be/|shorts/|embed/|live/)([A-Za-z0-9_-]{11})')
+
+def resolve_video_id(youtube_url):
+    """Video ID from the URL itself, or from yt-dlp metadata (no download)"""
+    match = YOUTUBE_ID_PATTERN.search(youtube_url)
+    if match:
+        return match.group(1)
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        return ydl.extract_info(youtube_url, download=False)['id']
+
+def transcript_cache_key(video_id, model_name=WHISPER_MODEL_NAME, vad=False, engine=TRANSCRIBE_ENGINE):
+    # Engines give slightly different text (int8 weights on cpu-int8), so each gets its own entry
+    return f"{video_id}|{model_name}|{engine}|{WHISPER_LANGUAGE}" + ("|vad" if vad else "")
+
+def artifact_cache_key(transcript, artifact, num=None, grounded=False):
+    # Grounded quiz and flashcards are written from retrieved passages, not the whole transcript
+    transcript_hash = hashlib.sha256(transcript.encode('utf-8')).hexdigest()
+    return f"{transcript_hash}|{PROMPT_VERSION}|{artifact}|{num}" + ("|grounded" if grounded else "")
 
 # ============================================================================
-# BACKGROUND PROCESSING
+# TRANSCRIPT SEARCH - Timestamped Segments and a Full-Text Index
 # ============================================================================
 
-def process_lecture_job(job_id, youtube_url, api_key, num_q, num_c):
-    """Process lecture in background thread"""
-    try:
-        print(f"\n🔄 Job {job_id} started")
+SEARCH_DB_PATH = Path('lecture_search.db')
+PASSAGE_SECONDS = 30
+SEARCH_MAX_HITS = 50
+SNIPPET_TOKENS = 16
+PASSAGE_ROWID_SPAN = 1 << 20  # passage rowids are lecture id * span + passage number
+
+def segment_columns(segments, transcript):
+    """Whisper segments as parallel start/end/offset lists
+
+    Offsets are character positions of each segment in `transcript`, so the
+    text itself is stored once. A segment whose text can't be located (the
+    whole-file decode can differ slightly from the joined segments) is
+    folded into the one before it.
+    """
+    columns = {'start': [], 'end': [], 'offset': []}
+    pos = 0
+    for seg in segments:
+        text = seg['text'].strip()
+        found = transcript.find(text, pos) if text else -1
+        if found < 0:
+            if columns['end']:
+                columns['end'][-1] = round(seg['end'], 2)
+            continue
+        columns['start'].append(round(seg['start'], 2))
+        columns['end'].append(round(seg['end'], 2))
+        columns['offset'].append(found)
+        pos = found + len(text)
+    return columns
+
+def segment_texts(columns, transcript):
+    bounds = columns['offset'] + [len(transcript)]
+    return [transcript[a:b].strip() for a, b in zip(bounds, bounds[1:])]
+
+def transcript_passages(transcript, columns=None, seconds=PASSAGE_SECONDS):
+    """(start, text) for runs of consecutive segments about `seconds` long
+
+    Whisper segments are a sentence or so - too short to rank well on their
+    own. Without segments the whole transcript is one passage with no time.
+    """
+    if not columns or not columns['start']:
+        return [(None, transcript)] if transcript.strip() else []
+    passages = []
+    run_start, run_texts = None, []
+    for start, text in zip(columns['start'], segment_texts(columns, transcript)):
+        if run_texts and start - run_start >= seconds:
+            passages.append((run_start, ' '.join(run_texts)))
+            run_texts = []
+        if not run_texts:
+            run_start = start
+        run_texts.append(text)
+    if run_texts:
+        passages.append((run_start, ' '.join(run_texts)))
+    return passages
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+def fts_query(text):
+    """Free text as an FTS5 query: every word must appear, in any order"""
+    return ' '.join(f'"{word}"' for word in re.findall(r'\w+', text.lower()))
+
+class TranscriptIndex:
+    """SQLite FTS5 index over the transcript passages of completed lectures
+
+    One row per passage, ranked by BM25 with Porter stemming. Lectures are
+    keyed by video, so reprocessing a video replaces its passages instead
+    of duplicating every hit. Each lecture owns a block of passage rowids,
+    so replacing or evicting one is a range delete rather than a scan.
+    Entries expire with the jobs they point at.
+    """
+
+    def __init__(self, path=SEARCH_DB_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        if str(path) != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS lectures (
+                id INTEGER PRIMARY KEY,
+                video_id TEXT UNIQUE,
+                job_id TEXT,
+                title TEXT,
+                indexed_at REAL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+                text, start UNINDEXED,
+                tokenize = 'porter unicode61'
+            );
+        """)
+        # Early backfills stored the job ID where the video ID was unknown
+        self.db.execute('UPDATE lectures SET video_id = NULL WHERE video_id = job_id')
+        self.db.commit()
+
+    def drop_passages(self, lecture_id):
+        first = lecture_id * PASSAGE_ROWID_SPAN
+        self.db.execute('DELETE FROM passages WHERE rowid BETWEEN ? AND ?', (first, first + PASSAGE_ROWID_SPAN - 1))
+
+    def add(self, video_id, job_id, title, transcript, columns=None, commit=True):
+        passages = transcript_passages(transcript, columns)[:PASSAGE_ROWID_SPAN]
+        with self.lock:
+            row = self.db.execute('SELECT id FROM lectures WHERE video_id = ?', (video_id,)).fetchone()
+            if row:
+                lecture_id = row[0]
+                self.drop_passages(lecture_id)
+                self.db.execute(
+                    'UPDATE lectures SET job_id = ?, title = ?, indexed_at = ? WHERE id = ?',
+                    (job_id, title, time.time(), lecture_id)
+                )
+            else:
+                lecture_id = self.db.execute(
+                    'INSERT INTO lectures (video_id, job_id, title, indexed_at) VALUES (?, ?, ?, ?)',
+                    (video_id, job_id, title, time.time())
+                ).lastrowid
+            first = lecture_id * PASSAGE_ROWID_SPAN
+            self.db.executemany(
+                'INSERT INTO passages (rowid, text, start) VALUES (?, ?, ?)',
+                [(first + i, text, start) for i, (start, text) in enumerate(passages)]
+            )
+            if commit:
+                self.db.commit()
+        return len(passages)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def indexed_jobs(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute('SELECT job_id FROM lectures')}
+
+    def search(self, text, limit=10):
+        """Best-ranked passages as {job_id, title, video_id, start, timestamp, snippet, score}"""
+        query = fts_query(text)
+        if not query:
+            return []
+        with self.lock:
+            rows = self.db.execute(f"""
+                SELECT lectures.video_id, lectures.job_id, lectures.title, hits.start, hits.snippet, hits.rank
+                FROM (
+                    SELECT rowid, start, rank,
+                           snippet(passages, 0, '**', '**', '…', {SNIPPET_TOKENS}) AS snippet
+                    FROM passages WHERE passages MATCH ? ORDER BY rank LIMIT ?
+                ) AS hits JOIN lectures ON lectures.id = hits.rowid / {PASSAGE_ROWID_SPAN}
+                ORDER BY hits.rank
+            """, (query, limit)).fetchall()
+        return [{
+            'job_id': job_id,
+            'title': title,
+            'video_id': video_id,
+            'start': start,
+            'timestamp': format_timestamp(start) if start is not None else None,
+            'snippet': snippet,
+            'score': round(-rank, 3)
+        } for video_id, job_id, title, start, snippet, rank in rows]
+
+    def evict_expired(self, ttl=JOB_TTL_SECONDS):
+        cutoff = time.time() - ttl
+        with self.lock:
+            expired = [row[0] for row in self.db.execute(
+                'SELECT id FROM lectures WHERE indexed_at < ?', (cutoff,)
+            )]
+            for lecture_id in expired:
+                self.drop_passages(lecture_id)
+            self.db.executemany('DELETE FROM lectures WHERE id = ?', [(lecture_id,) for lecture_id in expired])
+            self.db.commit()
+        return len(expired)
+
+    def stats(self):
+        with self.lock:
+            lectures = self.db.execute('SELECT COUNT(*) FROM lectures').fetchone()[0]
+            passages = self.db.execute('SELECT COUNT(*) FROM passages').fetchone()[0]
+        return {'lectures': lectures, 'passages': passages}
+
+# In-memory jobs don't survive a restart, so neither does their index
+search_index = TranscriptIndex(SEARCH_DB_PATH if JOB_STORE == 'sqlite' else ':memory:')
+
+def index_completed_jobs():
+    """Add finished lectures the index doesn't know yet (e.g. from before it existed)
+
+    Older results don't carry their video ID; it comes from the job record
+    instead, or stays empty so search hits for it get no YouTube link.
+    """
+    indexed = search_index.indexed_jobs()
+    added = 0
+    for job_id, result in jobs.finished_results():
+        if job_id in indexed or 'transcript' not in result:
+            continue
+        video_id = result.get('video_id') or jobs[job_id].get('video_id')
+        search_index.add(video_id, job_id, result['title'],
+                         result['transcript'], result.get('segments'), commit=False)
+        added += 1
+    search_index.commit()
+    if added:
+        print(f"🔎 Indexed {added} completed lectures for search")
+
+# ============================================================================
+# RETRIEVAL - Chunk Embeddings and a Per-Lecture Vector Index
+# ============================================================================
+
+EMBEDDER = os.environ.get('LECTURE_EMBEDDER', 'hashing')
+HASH_DIMENSIONS = 4096
+RETRIEVAL_CHUNK_SECONDS = 45
+RETRIEVAL_CHUNK_WORDS = 110
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_MAX_CHUNKS = 24
+STOPWORDS = frozenset("""a an and are as at be been but by can do does for from has have he her his how i if in
+into is it its just like me more my no not of on or our really right she so some that the their them then
+there these they this those to um uh us was we were what when where which who why will with would you your
+going okay yeah know get got let thing things""".split())
+
+class HashingEmbedder:
+    """TF-IDF over hashed words and word pairs - no model download, no extra package
+
+    IDF comes from the lecture's own chunks, so the fitted state is stored
+    with its vectors and reused for every query against them.
+    """
+
+    name = f'hashing-{HASH_DIMENSIONS}'
+
+    def features(self, text):
+        words = [w for w in re.findall(r'[a-z0-9]+', text.lower()) if w not in STOPWORDS]
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return Counter(zlib.crc32(gram.encode('utf-8')) % HASH_DIMENSIONS for gram in grams)
+
+    def fit(self, texts):
+        df = Counter()
+        for text in texts:
+            df.update(self.features(text).keys())
+        buckets = sorted(df)
+        return {'n': len(texts), 'buckets': buckets, 'df': [df[b] for b in buckets]}
+
+    def embed(self, texts, state):
+        idf = np.full(HASH_DIMENSIONS, np.log(1 + state['n']) + 1, dtype=np.float32)
+        idf[state['buckets']] = np.log((1 + state['n']) / (1 + np.array(state['df'], dtype=np.float32))) + 1
+        vectors = np.zeros((len(texts), HASH_DIMENSIONS), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = self.features(text)
+            if counts:
+                vectors[row, list(counts)] = 1 + np.log(np.fromiter(counts.values(), dtype=np.float32))
+        vectors *= idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+class SentenceEmbedder:
+    """A small sentence-transformers model (e.g. all-MiniLM-L6-v2) on CPU"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    def fit(self, texts):
+        return {}
+
+    def embed(self, texts, state):
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+embedder_lock = threading.Lock()
+embedders = {}
+
+def get_embedder(name=EMBEDDER):
+    """The configured embedder, loaded once; falls back to hashing TF-IDF"""
+    with embedder_lock:
+        if name not in embedders:
+            if name == 'hashing':
+                embedders[name] = HashingEmbedder()
+            else:
+                try:
+                    embedders[name] = SentenceEmbedder(name)
+                except ImportError:
+                    print(f"⚠️ sentence-transformers not installed - using hashing TF-IDF embeddings")
+                    embedders[name] = HashingEmbedder()
+        return embedders[name]
+
+def retrieval_chunks(transcript, segments=None):
+    """(start, text) chunks to embed: ~45 s of segments, or fixed word windows without timings"""
+    if segments and segments['start']:
+        return transcript_passages(transcript, segments, RETRIEVAL_CHUNK_SECONDS)
+    words = transcript.split()
+    return [(None, ' '.join(words[i:i + RETRIEVAL_CHUNK_WORDS]))
+            for i in range(0, len(words), RETRIEVAL_CHUNK_WORDS)]
+
+class LectureVectors:
+    """One lecture's chunk vectors (memory-mapped) plus what's needed to query them"""
+
+    def __init__(self, chunks, vectors, state, embedder):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.state = state
+        self.embedder = embedder
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        """[(score, chunk_index)] of the `k` chunks closest to `query`, best first (no zero matches)"""
+        if not self.chunks:
+            return []
+        scores = self.vectors @ self.embedder.embed([query], self.state)[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), int(i)) for i in top[np.argsort(-scores[top])] if scores[i] > 0]
+
+def lecture_vectors(transcript, segments=None):
+    """The vector index for a transcript, built once and kept in the vector cache"""
+    embedder = get_embedder()
+    transcript_hash = hashlib.sha256(transcript.encode('utf-8')).hexdigest()
+    key = f"{transcript_hash}|{embedder.name}|{RETRIEVAL_CHUNK_SECONDS}|{bool(segments)}"
+
+    meta = vector_cache.get_json(key)
+    path = vector_cache.get_path(key, '.npy') if meta else None
+    if path is None:
+        chunks = retrieval_chunks(transcript, segments)
+        texts = [text for _, text in chunks]
+        state = embedder.fit(texts)
+        vectors = embedder.embed(texts, state) if texts else np.zeros((0, 1), dtype=np.float32)
+        tmp = vector_cache.dir / f".{uuid.uuid4().hex}.npy"
+        np.save(tmp, vectors)
+        path = vector_cache.put_file(key, tmp, '.npy')
+        meta = {'chunks': chunks, 'state': state}
+        vector_cache.put_json(key, meta, keep=[path])
+    return LectureVectors([tuple(chunk) for chunk in meta['chunks']], np.load(path, mmap_mode='r'),
+                          meta['state'], embedder)
+
+def render_chunk(chunk):
+    start, text = chunk
+    return f"[{format_timestamp(start)}] {text}" if start is not None else text
+
+def grounded_context(vectors, concepts, k=RETRIEVAL_TOP_K, max_chunks=RETRIEVAL_MAX_CHUNKS):
+    """The top-k chunks for each key concept, in lecture order - a compact stand-in for the transcript"""
+    best = {}
+    for concept in concepts:
+        for score, i in vectors.search(concept, k):
+            best[i] = max(score, best.get(i, 0.0))
+    chosen = sorted(sorted(best, key=best.get, reverse=True)[:max_chunks])
+    return "\n\n".join(render_chunk(vectors.chunks[i]) for i in chosen)
+
+def ask_lecture(lecture, question, api_key, k=RETRIEVAL_TOP_K * 2):
+    """Answer a question from the lecture's most relevant chunks; returns (answer, passages, retrieval_ms)"""
+    t0 = time.perf_counter()
+    vectors = lecture_vectors(lecture['transcript'], lecture.get('segments'))
+    hits = sorted(vectors.search(question, k), key=lambda hit: hit[1])
+    retrieval_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    passages = [{
+        'start': vectors.chunks[i][0],
+        'timestamp': format_timestamp(vectors.chunks[i][0]) if vectors.chunks[i][0] is not None else None,
+        'text': vectors.chunks[i][1],
+        'score': round(score, 3)
+    } for score, i in hits]
+    excerpts = "\n\n".join(render_chunk(vectors.chunks[i]) for _, i in hits)
+
+    prompt = f"""Answer the student's question using only these excerpts from the lecture.
+TITLE: {lecture['title']}
+EXCERPTS:
+{excerpts}
+
+QUESTION: {question}
+
+Answer in 2-5 sentences and cite the timestamps you relied on. If the excerpts
+don't cover the question, say so."""
+    answer = make_gemini_model(api_key).generate_content(prompt).text.strip()
+    return answer, passages, retrieval_ms
+
+# ============================================================================
+# JOB SCHEDULER - Bounded Queue, Fixed Workers, Per-Stage Concurrency Limits
+# ============================================================================
 
-        # Step 1: Download audio
-        jobs[job_id].update({'status': 'downloading', 'progress': 10})
-        print(f"📥 Downloading from YouTube...")
-
-        uid = str(uuid.uuid4())[:8]
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': uid,
-            'quiet': True,
-            'no_warnings': True,
-            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}]
+JOB_WORKERS = int(os.environ.get('LECTURE_JOB_WORKERS', 4))
+JOB_QUEUE_SIZE = int(os.environ.get('LECTURE_JOB_QUEUE_SIZE', 20))
+DEFAULT_JOB_SECONDS = 120
+
+class StageLimiter:
+    """Caps how many jobs can be inside one pipeline stage at the same time"""
+
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.semaphore = threading.BoundedSemaphore(slots)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.waiting += 1
+        self.semaphore.acquire()
+        with self.lock:
+            self.waiting -= 1
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.active -= 1
+        self.semaphore.release()
+
+    def stats(self):
+        return {
+            'slots': self.slots,
+            'active': self.active,
+            'waiting': self.waiting,
+            'utilization': round(self.active / self.slots, 2)
+        }
+
+# Download and Gemini calls are I/O-bound and can overlap freely; Whisper is
+# CPU-bound and shares one model, so it gets its own (small) pool.
+stage_limits = {
+    'download': StageLimiter('download', int(os.environ.get('LECTURE_DOWNLOAD_SLOTS', 3))),
+    'transcribe': StageLimiter('transcribe', int(os.environ.get('LECTURE_TRANSCRIBE_WORKERS', 1))),
+    'llm': StageLimiter('llm', int(os.environ.get('LECTURE_LLM_SLOTS', 6)))
+}
+
+class QueueFullError(Exception):
+    def __init__(self, position, eta):
+        super().__init__(f"Job queue is full (position {position}, ~{eta}s)")
+        self.position = position
+        self.eta = eta
+
+class JobScheduler:
+    """Bounded FIFO of jobs drained by a fixed pool of worker threads
+
+    Replaces thread-per-request: at most `workers` jobs run at once and at
+    most `max_queue` wait behind them. submit() raises QueueFullError when
+    the queue is full so the API can push back with a 429.
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.busy = 0
+        self.completed = 0
+        self.durations = deque(maxlen=20)
+        for i in range(workers):
+            threading.Thread(target=self.work, name=f"job-worker-{i}", daemon=True).start()
+
+    def submit(self, job_id, fn, *args):
+        """Queue `fn(*args)` and return the job's 1-based queue position"""
+        with self.cond:
+            if len(self.pending) >= self.max_queue:
+                position = len(self.pending) + 1
+                raise QueueFullError(position, self.eta(position))
+            self.pending.append((job_id, fn, args))
+            self.cond.notify()
+            return len(self.pending)
+
+    def position(self, job_id):
+        with self.cond:
+            for i, (pending_id, _, _) in enumerate(self.pending, 1):
+                if pending_id == job_id:
+                    return i
+        return None
+
+    def eta(self, position):
+        """Rough seconds until a job at `position` finishes"""
+        avg = sum(self.durations) / len(self.durations) if self.durations else DEFAULT_JOB_SECONDS
+        rounds = (position + self.busy + self.workers - 1) // self.workers
+        return int(avg * max(rounds, 1))
+
+    def work(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                job_id, fn, args = self.pending.popleft()
+                self.busy += 1
+            t0 = time.perf_counter()
+            try:
+                fn(job_id, *args)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self.cond:
+                    self.busy -= 1
+                    self.completed += 1
+                    self.durations.append(time.perf_counter() - t0)
+
+    def stats(self):
+        return {
+            'queue_depth': len(self.pending),
+            'max_queue': self.max_queue,
+            'workers': self.workers,
+            'busy_workers': self.busy,
+            'utilization': round(self.busy / self.workers, 2),
+            'completed': self.completed,
+            'avg_job_seconds': round(sum(self.durations) / len(self.durations), 1) if self.durations else None
         }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(youtube_url, download=True)
-            title = info.get('title', 'Unknown Video')
-            duration = info.get('duration', 0)
+scheduler = JobScheduler(JOB_WORKERS, JOB_QUEUE_SIZE)
+
+# ============================================================================
+# AUDIO INGEST - Native Download, One Decode to 16 kHz PCM, Memory-Mapped Reads
+# ============================================================================
+
+SAMPLE_RATE = 16000
+
+def download_audio(youtube_url, workdir):
+    """Fetch the best audio stream as-is into `workdir` - no MP3 re-encode"""
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'outtmpl': str(Path(workdir) / 'source.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(youtube_url, download=True)
+        path = ydl.prepare_filename(info)
+    return path, {'title': info.get('title', 'Unknown Video'), 'duration': info.get('duration', 0)}
+
+def decode_to_pcm(src, dest):
+    """Decode once to 16 kHz mono 16-bit PCM - the only decode the audio ever gets
+
+    Stored as int16 rather than float32 to halve the cache footprint;
+    load_pcm() converts each slice on read.
+    """
+    if str(src).endswith('.wav'):
+        with wave.open(str(src), 'rb') as wav:
+            if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) == (SAMPLE_RATE, 1, 2):
+                # Already 16 kHz mono s16 - copy the samples, no ffmpeg process
+                with open(dest, 'wb') as out:
+                    while True:
+                        frames = wav.readframes(1 << 16)
+                        if not frames:
+                            break
+                        out.write(frames)
+                return dest
+    cmd = [
+        "ffmpeg", "-nostdin", "-y", "-threads", "0", "-i", str(src), "-vn",
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), str(dest)
+    ]
+    subprocess.run(cmd, capture_output=True, check=True)
+    return dest
+
+def load_pcm(path, start=0.0, length=None):
+    """float32 samples from a PCM file, read through a memory map
+
+    Only the requested slice is paged in, so chunked and streaming
+    transcription never hold the whole lecture in memory.
+    """
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, np.float32)
+    pcm = np.memmap(path, dtype=np.int16, mode='r')
+    first = int(start * SAMPLE_RATE)
+    last = len(pcm) if length is None else min(len(pcm), first + int(length * SAMPLE_RATE))
+    return pcm[first:last].astype(np.float32) / 32768.0
+
+def pcm_duration(path):
+    return os.path.getsize(path) / 2 / SAMPLE_RATE
+
+# ============================================================================
+# CHUNKED TRANSCRIPTION - Overlapping Windows Across Model Replicas
+# ============================================================================
 
-        audio_file = f"{uid}.mp3"
-        jobs[job_id].update({'progress': 20})
-        print(f"✅ Downloaded: {title} ({duration}s)")
+CHUNKED_MIN_SECONDS = 600
+CHUNK_SECONDS = 300
+CHUNK_OVERLAP_SECONDS = 10
+
+def load_audio_slice(path, start, length):
+    """Decode [start, start + length) seconds of `path` to 16 kHz mono float32"""
+    if str(path).endswith('.pcm'):
+        return load_pcm(path, start, length)
+    cmd = [
+        "ffmpeg", "-nostdin", "-threads", "0",
+        "-ss", f"{start:.3f}", "-t", f"{length:.3f}", "-i", str(path),
+        "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"
+    ]
+    out = subprocess.run(cmd, capture_output=True, check=True).stdout
+    return np.frombuffer(out, np.int16).astype(np.float32) / 32768.0
+
+def plan_windows(duration, window=CHUNK_SECONDS, overlap=CHUNK_OVERLAP_SECONDS):
+    """Split [0, duration) into overlapping windows
+
+    Returns (start, length, keep_from, keep_to) per window. The keep range
+    ends halfway through each overlap, so every instant of audio belongs to
+    exactly one window when the results are stitched back together.
+    """
+    windows = []
+    start = 0.0
+    while True:
+        end = min(start + window, duration)
+        windows.append([start, end - start, 0.0, float('inf')])
+        if end >= duration:
+            break
+        start = end - overlap
+    for prev, nxt in zip(windows, windows[1:]):
+        boundary = nxt[0] + overlap / 2
+        prev[3] = boundary
+        nxt[2] = boundary
+    return [tuple(w) for w in windows]
+
+def transcribe_window(model, path, start, length):
+    """Decode one window and transcribe it"""
+    audio = load_audio_slice(path, start, length)
+    result = model.transcribe(audio, verbose=None)
+    return [
+        {'start': seg['start'] + start, 'end': seg['end'] + start, 'text': seg['text']}
+        for seg in result['segments']
+    ]
+
+def stitch_segments(windows, results):
+    """Merge per-window segments on the absolute timeline, dropping overlap repeats"""
+    segments = []
+    for (_, _, keep_from, keep_to), window_segments in zip(windows, results):
+        for seg in window_segments:
+            mid = (seg['start'] + seg['end']) / 2
+            if not keep_from <= mid < keep_to:
+                continue
+            if segments and seg['text'].strip() == segments[-1]['text'].strip() and seg['start'] < segments[-1]['end']:
+                continue
+            segments.append(seg)
+    segments.sort(key=lambda seg: seg['start'])
+    return segments
+
+def transcribe_chunked(path, duration, model_name=WHISPER_MODEL_NAME, replicas=None, on_progress=None):
+    """Transcribe a long file as overlapping windows on parallel threads
+
+    Each window decodes only its own slice, so the whole lecture is never
+    held as PCM. Every thread checks a model copy out of the pool's
+    replicas for each window; torch releases the GIL inside its kernels.
+    Returns the same {'text', 'segments'} shape as whisper's transcribe().
+    """
+    windows = plan_windows(duration)
+    results = [None] * len(windows)
+
+    with whisper_models.replicas(model_name, min(replicas or TRANSCRIBE_REPLICAS, len(windows))) as models:
+        free = queue.Queue()
+        for model in models:
+            free.put(model)
+
+        def run(start, length):
+            model = free.get()
+            try:
+                return transcribe_window(model, str(path), start, length)
+            finally:
+                free.put(model)
 
-        # Step 2: Transcribe with Whisper
-        jobs[job_id].update({'status': 'transcribing', 'progress': 30})
-        print(f"🎙️ Transcribing audio...")
+        with ThreadPoolExecutor(max_workers=len(models), thread_name_prefix='transcribe') as pool:
+            futures = {pool.submit(run, start, length): i for i, (start, length, _, _) in enumerate(windows)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if on_progress:
+                    on_progress(done, len(windows))
 
-        result = whisper_model.transcribe(audio_file, language="en", verbose=False, fp16=False)
-        transcript = result['text']
+    segments = stitch_segments(windows, results)
+    return {'text': ''.join(seg['text'] for seg in segments), 'segments': segments}
 
-        jobs[job_id].update({'progress': 50})
-        print(f"✅ Transcribed: {len(transcript)} characters")
+# ============================================================================
+# STREAMING TRANSCRIPTION - Partial Transcripts While Whisper Runs
+# ============================================================================
 
-        # Step 3: Generate notes with REAL Gemini
-        jobs[job_id].update({'status': 'generating_notes', 'progress': 60})
-        print(f"📝 Generating AI notes...")
+TRANSCRIPTION_MODES = ('auto', 'streaming')
+STREAM_WINDOW_SECONDS = 60
+STREAM_OVERLAP_SECONDS = 4
+STREAM_PREVIEW_SECONDS = 300
+
+def stream_transcription(path, duration, model, window=STREAM_WINDOW_SECONDS, overlap=STREAM_OVERLAP_SECONDS):
+    """Yield (seconds_done, new_segments) as each window is decoded, in order
+
+    Windows run one after another on the calling thread. The tail of the
+    text so far is passed as Whisper's initial_prompt so wording and casing
+    stay consistent across window edges.
+    """
+    context = ''
+    last = None
+    for start, length, keep_from, keep_to in plan_windows(duration, window, overlap):
+        audio = load_audio_slice(path, start, length)
+        result = model.transcribe(
+            audio, verbose=None,
+            initial_prompt=context[-200:] or None
+        )
+        shifted = [
+            {'start': seg['start'] + start, 'end': seg['end'] + start, 'text': seg['text']}
+            for seg in result['segments']
+        ]
+        new = stitch_segments([(start, length, keep_from, keep_to)], [shifted])
+        if new and last and new[0]['text'].strip() == last['text'].strip() and new[0]['start'] < last['end']:
+            new = new[1:]
+        if new:
+            last = new[-1]
+            context += ''.join(seg['text'] for seg in new)
+        yield min(start + length, duration), new
+
+def start_preview_notes(job_id, partial_transcript, title, api_key):
+    """Generate notes from the first minutes while the rest is still transcribing
+
+    An extra Gemini call on top of the final notes, so only made for jobs
+    that ask for it with `preview_notes`.
+    """
+    def run():
+        with stage_limits['llm']:
+            print(f"  👀 Generating preview notes from partial transcript...")
+            jobs[job_id]['preview_notes'] = generate_notes_real(partial_transcript, title, api_key)
+
+    threading.Thread(target=run, name=f"preview-{job_id[:8]}", daemon=True).start()
 
-        notes = generate_notes_real(transcript, title, api_key)
-        jobs[job_id].update({'progress': 70})
-        print(f"✅ Notes: {len(notes['key_concepts'])} concepts")
+# ============================================================================
+# VOICE ACTIVITY DETECTION - Skip Silence, Music Intros and Dead Air
+# ============================================================================
 
-        # Step 4: Generate quiz with REAL Gemini
-        jobs[job_id].update({'status': 'generating_quiz', 'progress': 80})
-        print(f"❓ Creating quiz...")
+VAD_FRAME_SECONDS = 0.03
+VAD_MARGIN_DB = 12          # speech must sit this far above the noise floor...
+VAD_FLOOR_DB = -50          # ...and above this absolute level
+VAD_MIN_SPEECH_SECONDS = 0.25
+VAD_MIN_SILENCE_SECONDS = 0.8
+VAD_PAD_SECONDS = 0.2
+VAD_BLOCK_SECONDS = 600
+
+def frame_energy_db(path, frame_seconds=VAD_FRAME_SECONDS):
+    """Per-frame energy in dB, computed block by block to keep memory flat"""
+    if not os.path.getsize(path):
+        return np.zeros(0)
+    frame = int(frame_seconds * SAMPLE_RATE)
+    pcm = np.memmap(path, dtype=np.int16, mode='r')
+    usable = len(pcm) // frame * frame
+    block = int(VAD_BLOCK_SECONDS / frame_seconds) * frame
+    energy = []
+    for first in range(0, usable, block):
+        frames = pcm[first:min(first + block, usable)].astype(np.float32).reshape(-1, frame) / 32768.0
+        energy.append(10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10))
+    return np.concatenate(energy)
+
+def detect_speech(energy_db, frame_seconds=VAD_FRAME_SECONDS):
+    """(start, end) seconds of every speech region, as an (n, 2) array
+
+    A frame is speech when it is VAD_MARGIN_DB above the 10th-percentile
+    noise floor. Pauses shorter than VAD_MIN_SILENCE_SECONDS are bridged,
+    blips shorter than VAD_MIN_SPEECH_SECONDS dropped, and every region is
+    padded so word onsets and tails survive.
+    """
+    if not len(energy_db):
+        return np.zeros((0, 2))
+    threshold = max(np.percentile(energy_db, 10) + VAD_MARGIN_DB, VAD_FLOOR_DB)
+    speech = (energy_db > threshold).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], speech, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return np.zeros((0, 2))
+
+    keep = (starts[1:] - ends[:-1]) * frame_seconds >= VAD_MIN_SILENCE_SECONDS
+    starts = np.concatenate(([starts[0]], starts[1:][keep]))
+    ends = np.concatenate((ends[:-1][keep], [ends[-1]]))
+    long_enough = (ends - starts) * frame_seconds >= VAD_MIN_SPEECH_SECONDS
+
+    regions = np.stack([starts[long_enough], ends[long_enough]], axis=1) * frame_seconds
+    regions[:, 0] -= VAD_PAD_SECONDS
+    regions[:, 1] += VAD_PAD_SECONDS
+    return np.clip(regions, 0, len(energy_db) * frame_seconds)
+
+def trim_silence(path, dest):
+    """Write only the speech regions of `path` to `dest`
+
+    Returns (speech_seconds, timemap, stats). Each timemap row is
+    (trimmed_start, original_start) for one region, so times measured on
+    the trimmed audio can be mapped back with to_original_time().
+    """
+    total = pcm_duration(path)
+    regions = detect_speech(frame_energy_db(path))
+    pcm = np.memmap(path, dtype=np.int16, mode='r') if total else np.zeros(0, np.int16)
+    timemap = []
+    position = 0.0
+    with open(dest, 'wb') as out:
+        for start, end in regions:
+            first, last = int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)
+            out.write(pcm[first:last].tobytes())
+            timemap.append((position, start))
+            position += (last - first) / SAMPLE_RATE
+
+    stats = {
+        'regions': len(regions),
+        'speech_seconds': round(position, 1),
+        'skipped_seconds': round(total - position, 1),
+        'skipped_fraction': round(1 - position / total, 3) if total else 0.0
+    }
+    return position, np.array(timemap).reshape(-1, 2), stats
+
+def to_original_time(t, timemap):
+    i = max(int(np.searchsorted(timemap[:, 0], t, side='right')) - 1, 0)
+    return float(timemap[i, 1] + (t - timemap[i, 0]))
 
-        quiz = generate_quiz_real(transcript, title, num_q, api_key)
-        jobs[job_id].update({'progress': 90})
-        print(f"✅ Quiz: {len(quiz)} questions")
+# ============================================================================
+# BACKGROUND PROCESSING
+# ============================================================================
 
-        # Step 5: Generate flashcards with REAL Gemini
-        jobs[job_id].update({'status': 'generating_flashcards', 'progress': 95})
-        print(f"📇 Creating flashcards...")
+def transcribe_lecture(job_id, audio_file, duration, title, api_key, transcription='auto', vad=False,
+                       model_name=WHISPER_MODEL_NAME, preview=False):
+    """Transcribe cached PCM audio, picking streaming, chunked or whole-file Whisper
+
+    With `vad` the silence is cut out first and segment times are mapped
+    back onto the original audio afterwards. With `preview` a streaming job
+    also gets notes from its first minutes while the rest transcribes.
+    """
+    with stage_limits['transcribe'], tempfile.TemporaryDirectory(prefix='lecture-vad-') as workdir:
+        timemap = None
+        if vad:
+            t0 = time.perf_counter()
+            speech_file = Path(workdir) / 'speech.pcm'
+            speech_seconds, timemap, vad_stats = trim_silence(audio_file, speech_file)
+            if vad_stats['regions']:
+                audio_file, duration = speech_file, speech_seconds
+                vad_stats['seconds'] = round(time.perf_counter() - t0, 2)
+                jobs[job_id]['vad'] = vad_stats
+                print(f"🔇 VAD: skipping {vad_stats['skipped_fraction']:.0%} of the audio")
+            else:
+                timemap = None  # nothing detected - transcribe everything
+
+        t0 = time.perf_counter()
+        if transcription == 'streaming' and duration:
+            print(f"🎙️ Streaming transcription...")
+            segments = []
+            preview_started = False
+            for seconds_done, new in stream_transcription(audio_file, duration, whisper_models.get(model_name)):
+                segments.extend(new)
+                partial = ''.join(seg['text'] for seg in segments)
+                jobs[job_id].update({
+                    'partial_transcript': partial,
+                    'transcribed_seconds': round(seconds_done, 1),
+                    'progress_fraction': round(seconds_done / duration, 3),
+                    'progress': 30 + int(20 * seconds_done / duration)
+                })
+                if preview and not preview_started and STREAM_PREVIEW_SECONDS <= seconds_done < duration:
+                    start_preview_notes(job_id, partial, title, api_key)
+                    preview_started = True
+            result = {'text': ''.join(seg['text'] for seg in segments), 'segments': segments}
+        elif TRANSCRIBE_REPLICAS > 1 and duration >= CHUNKED_MIN_SECONDS:
+            print(f"🎙️ Transcribing audio in chunks on {TRANSCRIBE_REPLICAS} model replicas...")
+            result = transcribe_chunked(
+                audio_file, duration, model_name,
+                on_progress=lambda done, total: jobs[job_id].update({'progress': 30 + int(20 * done / total)})
+            )
+        else:
+            print(f"🎙️ Transcribing audio...")
+            model = whisper_models.get(model_name)
+            result = model.transcribe(load_pcm(audio_file), verbose=False)
+
+    if timemap is not None:
+        for seg in result['segments']:
+            seg['start'] = to_original_time(seg['start'], timemap)
+            seg['end'] = to_original_time(seg['end'], timemap)
+        # Whisper time scales ~linearly with audio length
+        stats = dict(jobs[job_id]['vad'])
+        elapsed = time.perf_counter() - t0
+        stats['estimated_seconds_saved'] = round(elapsed * stats['skipped_seconds'] / max(stats['speech_seconds'], 1), 1)
+        jobs[job_id]['vad'] = stats
+    return result
+
+def generation_context(job_id, transcript, title, api_key):
+    """The text the generators work from
+
+    Lectures too long for one prompt are condensed map-reduce style first
+    (cached per transcript); the same section notes then feed every generator.
+    """
+    if estimate_tokens(transcript) <= MAP_REDUCE_MIN_TOKENS:
+        return transcript
+    condensed_key = artifact_cache_key(transcript, 'condensed', MAP_CHUNK_TOKENS)
+    context = artifact_cache.get_json(condensed_key)
+    if context is None:
+        jobs[job_id].update({'status': 'condensing'})
+        print(f"🗜️ Condensing long transcript ({estimate_tokens(transcript)} tokens)...")
+        with Span(job_id, 'condense', transcript_tokens=estimate_tokens(transcript)):
+            context, failed = condense_transcript(transcript, title, api_key)
+        if failed:
+            # Degraded, not cached: the next run gets another go at those parts
+            jobs[job_id].merge('stages', {'condense': {'status': 'degraded', 'failed_parts': failed}})
+        else:
+            artifact_cache.put_json(condensed_key, context)
+    jobs[job_id].update({'status': 'generating', 'condensed_tokens': estimate_tokens(context)})
+    return context
+
+def process_lecture_job(job_id, youtube_url, api_key, num_q, num_c, mode='parallel', transcription='auto', vad=False,
+                        whisper_model_name=WHISPER_MODEL_NAME, preview=False):
+    """Process lecture in background thread"""
+    try:
+        print(f"\n🔄 Job {job_id} started")
 
-        flashcards = generate_flashcards_real(transcript, title, num_c, api_key)
+        jobs[job_id].update({'started_at': time.time(), 'timings': {}, 'spans': [], 'cache_hits': []})
+        video_id = resolve_video_id(youtube_url)
+        jobs[job_id].update({'video_id': video_id})
+
+        # 'auto' needs the duration; without cached metadata it's picked after download
+        info = metadata_cache.get_json(video_id)
+        model_name = None
+        if whisper_model_name != 'auto' or info:
+            model_name = choose_whisper_model(whisper_model_name, info['duration'] if info else 0)
+            jobs[job_id].update({'whisper_model': model_name})
+        cached = transcript_cache.get_json(transcript_cache_key(video_id, model_name, vad)) if model_name else None
+
+        if cached:
+            title, duration, transcript = cached['title'], cached['duration'], cached['text']
+            segments = cached.get('segments')
+            record_cache_hit(job_id, 'transcript')
+            jobs[job_id].update({'progress': 50})
+            print(f"⚡ Transcript cache hit: {title}")
+        else:
+            # Step 1: Download audio (skipped when the audio is already cached)
+            jobs[job_id].update({'status': 'downloading', 'progress': 10})
+
+            with Span(job_id, 'download') as span:
+                # Cached audio is only usable with its metadata; without it the audio is fetched again
+                audio_file = audio_cache.get_path(video_id, '.pcm') if info else None
+                if audio_file:
+                    record_cache_hit(job_id, 'audio')
+                    span.set(cache_hit=True)
+                    print(f"⚡ Audio cache hit")
+                else:
+                    with stage_limits['download']:
+                        print(f"📥 Downloading from YouTube...")
+                        # Everything intermediate lives in a temp dir that is removed
+                        # whether the download/decode succeeds or not
+                        with tempfile.TemporaryDirectory(prefix='lecture-') as workdir:
+                            source, info = download_audio(youtube_url, workdir)
+                            pcm = decode_to_pcm(source, Path(workdir) / 'audio.pcm')
+                            info['duration'] = info['duration'] or int(pcm_duration(pcm))
+                            audio_file = audio_cache.put_file(video_id, pcm, '.pcm')
+                    metadata_cache.put_json(video_id, info)
+                span.set(audio_bytes=audio_file.stat().st_size)
+
+            title, duration = info['title'], info['duration']
+            jobs[job_id].update({'progress': 20})
+            print(f"✅ Downloaded: {title} ({duration}s)")
+
+            # Step 2: Transcribe with Whisper
+            if model_name is None:
+                model_name = choose_whisper_model(whisper_model_name, duration)
+                jobs[job_id].update({'whisper_model': model_name})
+            jobs[job_id].update({'status': 'transcribing', 'progress': 30})
+            with Span(job_id, 'transcribe', model=model_name, audio_seconds=duration, vad=vad) as span:
+                result = transcribe_lecture(job_id, audio_file, duration, title, api_key, transcription, vad, model_name,
+                                            preview)
+                transcript = result['text']
+                segments = segment_columns(result['segments'], transcript)
+                transcript_cache.put_json(transcript_cache_key(video_id, model_name, vad), {
+                    'title': title, 'duration': duration, 'text': transcript, 'segments': segments
+                })
+                span.set(transcript_chars=len(transcript))
+
+            if duration:
+                rtf = span.seconds / duration
+                observe_metric('real_time_factor', rtf, model_name)
+                jobs[job_id].update({'real_time_factor': round(rtf, 3)})
+            jobs[job_id].pop('partial_transcript', None)
+            jobs[job_id].update({'progress': 50})
+            print(f"✅ Transcribed: {len(transcript)} characters")
+
+        # Steps 3-5: Generate notes, quiz and flashcards with REAL Gemini,
+        # reusing any artifact already generated for this transcript
+        keys = {
+            'notes': artifact_cache_key(transcript, 'notes'),
+            'quiz': artifact_cache_key(transcript, 'quiz', num_q, grounded=mode == 'grounded'),
+            'flashcards': artifact_cache_key(transcript, 'flashcards', num_c, grounded=mode == 'grounded')
+        }
+        generated = {}
+        for name, key in keys.items():
+            hit = artifact_cache.get_json(key)
+            if hit is not None:
+                generated[name] = hit
+                record_cache_hit(job_id, name)
+
+        jobs[job_id].update({'status': 'generating'})
+        missing = [name for name in keys if name not in generated]
+
+        context = generation_context(job_id, transcript, title, api_key) if missing else transcript
+
+        if mode == 'combined' and len(missing) == len(keys):
+            print(f"📝 Generating AI notes, quiz and flashcards in one call...")
+            combined = run_generation_stages(job_id, {
+                'combined': (lambda: generate_all_combined(context, title, num_q, num_c, api_key), None)
+            }, progress_to=70)['combined']
+            if combined is None:
+                jobs[job_id].merge('stages', {'combined': {**jobs[job_id]['stages']['combined'], 'status': 'fallback'}})
+                print(f"⚠️ Combined generation failed, falling back to parallel calls")
+            else:
+                generated.update(combined)
+                missing = []
+
+        notes_stage = (
+            lambda: generate_notes_real(context, title, api_key),
+            {"summary": transcript[:500], "key_concepts": [], "examples": [], "study_tips": []}
+        )
+        item_context = context
+        if mode == 'grounded' and ('quiz' in missing or 'flashcards' in missing):
+            # Notes first: their key concepts pick the passages quiz and flashcards see
+            if 'notes' in missing:
+                print(f"📝 Generating AI notes to pick key concepts...")
+                generated.update(run_generation_stages(job_id, {'notes': notes_stage}, progress_to=70))
+                missing.remove('notes')
+            concepts = generated['notes']['key_concepts']
+            if concepts:
+                t0 = time.perf_counter()
+                item_context = grounded_context(lecture_vectors(transcript, segments), concepts)
+                jobs[job_id]['retrieval'] = {
+                    'concepts': len(concepts),
+                    'context_chars': len(item_context),
+                    'transcript_chars': len(transcript),
+                    'seconds': round(time.perf_counter() - t0, 3)
+                }
+                print(f"🔎 Grounded prompts: {len(item_context)} of {len(transcript)} transcript chars")
+
+        if missing:
+            print(f"📝 Generating AI {', '.join(missing)}...")
+            started = time.perf_counter()
+            stages = {
+                'notes': notes_stage,
+                'quiz': (lambda: generate_quiz_real(
+                    item_context, title, num_q, api_key, on_item=append_partial(job_id, 'quiz', started)), []),
+                'flashcards': (lambda: generate_flashcards_real(
+                    item_context, title, num_c, api_key, on_item=append_partial(job_id, 'flashcards', started)), []),
+            }
+            generated.update(run_generation_stages(
+                job_id, {name: stages[name] for name in missing}, progress_from=jobs[job_id]['progress']
+            ))
+
+        # Only cache real output - never the empty fallbacks of a failed call
+        for name in keys:
+            value = generated[name]
+            if name not in jobs[job_id]['cache_hits'] and (value['key_concepts'] if name == 'notes' else value):
+                artifact_cache.put_json(keys[name], value)
+
+        notes = generated['notes']
+        quiz = generated['quiz']
+        flashcards = generated['flashcards']
+        print(f"✅ Notes: {len(notes['key_concepts'])} concepts")
+        print(f"✅ Quiz: {len(quiz)} questions")
         print(f"✅ Flashcards: {len(flashcards)} cards")
 
         # Step 6: Save results
+        jobs[job_id].pop('partial', None)
         jobs[job_id].update({
             'status': 'completed',
             'progress': 100,
+            'total_seconds': round(time.time() - jobs[job_id]['started_at'], 2),
             'result': {
                 'id': job_id,
                 'title': title,
-                'duration': f"{duration//60}:{duration%60:02d}",
+                'duration': f"{int(duration) // 60}:{int(duration) % 60:02d}",
                 'notes': notes,
                 'quiz': quiz,
                 'flashcards': flashcards,
-                'transcript': transcript
+                'transcript': transcript,
+                'segments': segments,
+                'video_id': video_id
             }
         })
+        try:
+            search_index.add(video_id, job_id, title, transcript, segments)
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not index {job_id} for search: {e}")
+        observe_metric('audio_seconds', duration)
+        observe_metric('job_seconds', jobs[job_id]['total_seconds'], 'completed')
 
         print(f"✅ Job {job_id} completed successfully!")
 
-        # Cleanup
-        try:
-            os.remove(audio_file)
-        except:
-            pass
-
     except Exception as e:
         error_msg = f"{type(e).__name__}: {str(e)}"
         print(f"❌ Job {job_id} failed: {error_msg}")
         traceback.print_exc()
+        observe_metric('job_seconds', time.time() - jobs[job_id].get('started_at', time.time()), 'failed')
         jobs[job_id].update({
             'status': 'failed',
             'error': error_msg,
             'progress': 0
         })
 
+def submit_lecture_job(job_id, params):
+    """Queue process_lecture_job with the parameters saved for this job"""
+    return scheduler.submit(
+        job_id,
+        process_lecture_job,
+        params['youtube_url'],
+        params['api_key'],
+        params['num_q'],
+        params['num_c'],
+        params['mode'],
+        params['transcription'],
+        params.get('vad', False),
+        params.get('whisper_model', WHISPER_MODEL_NAME),
+        params.get('preview_notes', False)
+    )
+
+# Parameters of recovered jobs (per item for batches) until their API key is resent
+awaiting_api_key = {}
+
+def resume_interrupted_jobs():
+    """Park jobs that were running when the server stopped until their API key is resent
+
+    API keys are never stored, so a recovered job waits as 'interrupted'
+    until the client posts the key to /api/resume-job/<job_id>. Audio,
+    transcripts and artifacts are cached as soon as each stage finishes, so
+    a resumed job skips straight past its completed stages. Batch items are
+    resumed by their batch.
+    """
+    recovered = jobs.recover()
+    params_by_id = dict(recovered)
+    interrupted = {'status': 'failed', 'error': 'Interrupted by a server restart', 'progress': 0}
+
+    for job_id, params in recovered:
+        job = jobs[job_id]
+        interrupted_at = job.get('status')
+
+        if job.get('type') == 'batch' and interrupted_at == 'expanding':
+            job.update(interrupted)  # its URLs weren't kept - submit the batch again
+            continue
+        if job.get('type') == 'batch':
+            resumable = {}
+            for item in job['items']:
+                if item['job_id'] not in params_by_id:
+                    continue  # already finished
+                if params_by_id[item['job_id']]:
+                    jobs[item['job_id']].update({'status': 'waiting'})
+                    resumable[item['job_id']] = params_by_id[item['job_id']]
+                else:
+                    jobs[item['job_id']].update(interrupted)
+            awaiting_api_key[job_id] = resumable
+        elif job.get('batch_id'):
+            continue  # resumed with its batch
+        elif params:
+            awaiting_api_key[job_id] = params
+        else:
+            job.update(interrupted)
+            continue
+        job.update({'status': 'interrupted', 'resumed_from': interrupted_at})
+        print(f"♻️ Job {job_id} was interrupted while {interrupted_at} - waiting for its API key to resume")
+
+def resume_job(job_id, api_key):
+    """Requeue an interrupted job or batch with its API key
+
+    Returns the queue position, or None if the job isn't waiting to resume.
+    Raises QueueFullError (and keeps waiting) when the queue is full.
+    """
+    params = awaiting_api_key.pop(job_id, None)
+    if params is None:
+        return None
+    job = jobs[job_id]
+    if job.get('type') == 'batch':
+        job.update({'status': 'queued'})
+        start_batch_feeder(job_id, {item_id: {**item_params, 'api_key': api_key}
+                                    for item_id, item_params in params.items()})
+        print(f"♻️ Resuming batch {job_id} ({len(params)} items left)")
+        return 0
+    try:
+        job.update({'status': 'queued'})
+        resubmit = submit_regeneration if job.get('type') == 'regenerate' else submit_lecture_job
+        position = resubmit(job_id, {**params, 'api_key': api_key})
+    except QueueFullError:
+        job.update({'status': 'interrupted'})
+        awaiting_api_key[job_id] = params
+        raise
+    print(f"♻️ Resuming job {job_id} (interrupted while {job.get('resumed_from')})")
+    return position
+
+# ============================================================================
+# REGENERATION - New Notes, Quiz or Flashcards From a Stored Transcript
+# ============================================================================
+
+REGENERABLE_ARTIFACTS = ('notes', 'quiz', 'flashcards')
+regenerate_lock = threading.Lock()
+
+def regenerate_artifact(job_id, source_id, artifact, num, api_key, fresh=True):
+    """Rebuild one artifact of a completed lecture and swap it into that lecture's result
+
+    Skips download and transcription entirely. With `fresh` the artifact
+    and prompt caches are bypassed so the user gets a new set rather than
+    the one they already have. A failed or empty generation leaves the
+    lecture's current artifact untouched.
+    """
+    try:
+        source = jobs[source_id]['result']
+        transcript, title = source['transcript'], source['title']
+        jobs[job_id].update({'status': 'generating', 'progress': 10, 'started_at': time.time(),
+                             'timings': {}, 'spans': [], 'cache_hits': []})
+        print(f"\n🔁 Regenerating {artifact} for {source_id}")
+
+        key = artifact_cache_key(transcript, artifact, None if artifact == 'notes' else num)
+        value = None if fresh else artifact_cache.get_json(key)
+        if value is not None:
+            record_cache_hit(job_id, artifact)
+        else:
+            context = generation_context(job_id, transcript, title, api_key)
+            model = make_gemini_model(api_key, cache=not fresh)
+            started = time.perf_counter()
+            stage = {
+                'notes': (lambda: generate_notes_real(context, title, api_key, model=model), None),
+                'quiz': (lambda: generate_quiz_real(
+                    context, title, num, api_key, model=model, on_item=append_partial(job_id, 'quiz', started)), []),
+                'flashcards': (lambda: generate_flashcards_real(
+                    context, title, num, api_key, model=model, on_item=append_partial(job_id, 'flashcards', started)), []),
+            }[artifact]
+            value = run_generation_stages(job_id, {artifact: stage}, progress_from=10)[artifact]
+            if not value or (artifact == 'notes' and not value['key_concepts']):
+                raise RuntimeError(f"Gemini returned no usable {artifact}")
+            artifact_cache.put_json(key, value)
+
+        with regenerate_lock:
+            result = dict(jobs[source_id]['result'], **{artifact: value})
+            jobs[source_id].update({'result': result})
+
+        jobs[job_id].pop('partial', None)
+        jobs[job_id].update({
+            'status': 'completed',
+            'progress': 100,
+            'result': {'source_job': source_id, 'artifact': artifact, artifact: value}
+        })
+        print(f"✅ Regenerated {artifact} for {source_id}")
+
+    except Exception as e:
+        error_msg = f"{type(e).__name__}: {str(e)}"
+        print(f"❌ Regeneration {job_id} failed: {error_msg}")
+        traceback.print_exc()
+        jobs[job_id].update({'status': 'failed', 'error': error_msg, 'progress': 0})
+
+def submit_regeneration(job_id, params):
+    return scheduler.submit(
+        job_id,
+        regenerate_artifact,
+        params['source_job'],
+        params['artifact'],
+        params['num'],
+        params['api_key'],
+        params.get('fresh', True)
+    )
+
+# ============================================================================
+# COURSE DECK - Near-Duplicate Cards and Questions Across Lectures
+# ============================================================================
+
+DEDUP_SHINGLE_CHARS = 5
+DEDUP_PERMUTATIONS = 100
+DEDUP_BANDS = 20
+DEDUP_SIMILARITY = 0.6
+DECK_MAX_LECTURES = 500
+MINHASH_PRIME = (1 << 32) + 15
+DECK_FIELDS = {'flashcards': 'front', 'quiz': 'question'}
+
+def shingles(text, k=DEDUP_SHINGLE_CHARS):
+    """Character k-grams of the text with case, punctuation and spacing normalised away"""
+    norm = ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+    if len(norm) <= k:
+        return {norm} if norm else set()
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+class MinHashLSH:
+    """MinHash signatures bucketed by band, so only likely matches are ever compared
+
+    Items sharing any band of `permutations // bands` rows become candidate
+    pairs; with the defaults a pair at 0.6 Jaccard collides ~80% of the
+    time, at 0.8 almost always and at 0.3 under 5%. Each add() costs the same however many items
+    came before, so indexing is linear in the number of items.
+    """
+
+    def __init__(self, permutations=DEDUP_PERMUTATIONS, bands=DEDUP_BANDS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 31, permutations, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, 1 << 32, permutations, dtype=np.uint64)[:, None]
+        self.bands = bands
+        self.rows = permutations // bands
+        self.buckets = {}
+
+    def signature(self, shingle_set):
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingle_set),
+                             dtype=np.uint64, count=len(shingle_set))
+        return ((self.a * hashes + self.b) % MINHASH_PRIME).min(axis=1)
+
+    def add(self, key, signature):
+        """Index `key` and return the keys already sharing a band with it"""
+        candidates = set()
+        for band in range(self.bands):
+            bucket = self.buckets.setdefault(
+                (band, signature[band * self.rows:(band + 1) * self.rows].tobytes()), []
+            )
+            candidates.update(bucket)
+            bucket.append(key)
+        return candidates
+
+def near_duplicate_groups(texts, threshold=DEDUP_SIMILARITY):
+    """Group index per text - the index of the first text it near-duplicates, else its own
+
+    LSH proposes the candidates; each is confirmed with the exact shingle
+    Jaccard before two texts are merged.
+    """
+    lsh = MinHashLSH()
+    sets = [shingles(text) for text in texts]
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, shingle_set in enumerate(sets):
+        if not shingle_set:
+            continue
+        for j in lsh.add(i, lsh.signature(shingle_set)):
+            a, b = find(i), find(j)
+            if a != b and len(shingle_set & sets[j]) / len(shingle_set | sets[j]) >= threshold:
+                parent[max(a, b)] = min(a, b)
+    return [find(i) for i in range(len(texts))]
+
+def course_deck(lectures, merge=True, threshold=DEDUP_SIMILARITY):
+    """One deck of flashcards and quiz questions from [(job_id, result)] in course order
+
+    Near-duplicates (by card front / question text) are merged into the
+    first occurrence, which lists where the others came from. With
+    merge=False every item is kept and repeats carry `duplicate_of`.
+    """
+    deck = {'stats': {}}
+    for kind, field in DECK_FIELDS.items():
+        items = [dict(item, job_id=job_id, lecture=result['title'])
+                 for job_id, result in lectures for item in result.get(kind) or []]
+        groups = near_duplicate_groups([item[field] for item in items], threshold)
+
+        kept = []
+        for i, (item, root) in enumerate(zip(items, groups)):
+            if root == i:
+                item['duplicates'] = []
+                kept.append(item)
+            else:
+                items[root]['duplicates'].append({'job_id': item['job_id'], 'num': item.get('num')})
+                if not merge:
+                    item['duplicate_of'] = {'job_id': items[root]['job_id'], 'num': items[root].get('num')}
+                    kept.append(item)
+
+        deck[kind] = kept
+        deck['stats'][kind] = {'total': len(items), 'unique': sum(1 for i, root in enumerate(groups) if root == i)}
+    return deck
+
+# ============================================================================
+# BATCH PROCESSING - Many URLs or Playlists as One Pipelined Batch
+# ============================================================================
+
+BATCH_MAX_ITEMS = 200
+# Enough items in flight that the next lecture downloads while the current
+# one transcribes, without one batch filling the whole queue
+BATCH_MAX_IN_FLIGHT = JOB_WORKERS + 1
+BATCH_POLL_SECONDS = 2
+
+def expand_urls(urls):
+    """[(video_id, url, title)] for a mix of video and playlist URLs
+
+    Playlists (any URL with `list=`) are expanded from yt-dlp's flat
+    metadata - nothing is downloaded. Duplicates are dropped by video ID,
+    keeping the first occurrence.
+    """
+    items = {}
+    for url in urls:
+        if 'list=' in url:
+            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist'}) as ydl:
+                info = ydl.extract_info(url, download=False)
+            entries = [
+                (e['id'], f"https://www.youtube.com/watch?v={e['id']}", e.get('title'))
+                for e in info.get('entries') or [] if e and e.get('id')
+            ]
+        else:
+            entries = [(resolve_video_id(url), url, None)]
+        for video_id, video_url, title in entries:
+            items.setdefault(video_id, (video_id, video_url, title))
+    return list(items.values())
+
+def feed_batch(batch_id, params_by_item):
+    """Submit a batch's items a few at a time and keep its aggregate progress
+
+    Items wait outside the scheduler until one of the batch's in-flight
+    slots frees up, so the scheduler's stage limits keep the pipeline full
+    (downloading ahead while Whisper runs) without crowding out other users.
+    """
+    batch = jobs[batch_id]
+    item_ids = [item['job_id'] for item in batch['items']]
+    pending = deque(job_id for job_id in item_ids if job_id in params_by_item)
+    in_flight = set()
+    finished = {}
+
+    while True:
+        for job_id in item_ids:
+            if job_id in finished or (job_id in pending and job_id not in in_flight):
+                continue
+            item = jobs.get(job_id)
+            if item is not None and item.get('status') in FINAL_STATUSES:
+                finished[job_id] = item.get('status')
+                in_flight.discard(job_id)
+
+        while pending and len(in_flight) < BATCH_MAX_IN_FLIGHT:
+            job_id = pending[0]
+            try:
+                jobs[job_id].update({'status': 'queued'})
+                submit_lecture_job(job_id, params_by_item[job_id])
+            except QueueFullError:
+                jobs[job_id].update({'status': 'waiting'})
+                break
+            pending.popleft()
+            in_flight.add(job_id)
+
+        active = [jobs[job_id] for job_id in in_flight]
+        progress = (100 * len(finished) + sum(job.get('progress', 0) for job in active)) / max(len(item_ids), 1)
+        counts = {
+            'completed': sum(1 for status in finished.values() if status == 'completed'),
+            'failed': sum(1 for status in finished.values() if status == 'failed'),
+            'running': len(in_flight),
+            'waiting': len(pending)
+        }
+
+        if len(finished) == len(item_ids):
+            jobs[batch_id].update({'status': 'completed', 'progress': 100, 'counts': counts, 'result': {
+                'id': batch_id,
+                'items': [dict(item, status=finished.get(item['job_id'])) for item in batch['items']]
+            }})
+            print(f"✅ Batch {batch_id} finished: {counts['completed']} completed, {counts['failed']} failed")
+            return
+
+        state = {'status': 'running', 'progress': int(progress), 'counts': counts}
+        if any(batch.get(key) != value for key, value in state.items()):
+            batch.update(state)
+        time.sleep(BATCH_POLL_SECONDS)
+
+def expand_and_feed_batch(batch_id, urls, params):
+    """Feeder thread for a new batch: expand its URLs, create its item jobs, then feed them
+
+    Playlist lookups go to YouTube and can take a while, so they happen
+    here rather than in the request; the batch shows as 'expanding' until
+    its items exist.
+    """
+    try:
+        items = expand_urls(urls)
+    except Exception as e:
+        jobs[batch_id].update({'status': 'failed', 'error': f"Could not expand the URLs: {e}"})
+        return
+    if len(items) > BATCH_MAX_ITEMS:
+        jobs[batch_id].update({'status': 'failed', 'error': f"Batch has {len(items)} videos, the limit is {BATCH_MAX_ITEMS}"})
+        return
+
+    params_by_item = {}
+    batch_items = []
+    for video_id, url, title in items:
+        job_id = str(uuid.uuid4())
+        item_params = {**params, 'youtube_url': url}
+        jobs[job_id] = JobRecord({
+            'job_id': job_id,
+            'batch_id': batch_id,
+            'status': 'waiting',
+            'progress': 0,
+            'generation_mode': params['mode'],
+            'transcription_mode': params['transcription']
+        })
+        jobs.save_params(job_id, item_params)
+        params_by_item[job_id] = item_params
+        batch_items.append({'job_id': job_id, 'video_id': video_id, 'url': url, 'title': title})
+
+    jobs[batch_id].update({'status': 'queued', 'total': len(batch_items), 'items': batch_items})
+    print(f"📚 Batch {batch_id}: {len(batch_items)} videos")
+    feed_batch(batch_id, params_by_item)
+
+def start_batch_feeder(batch_id, params_by_item):
+    threading.Thread(
+        target=feed_batch, args=(batch_id, params_by_item), name=f"batch-{batch_id[:8]}", daemon=True
+    ).start()
+
 # ============================================================================
 # API ROUTES
 # ============================================================================
@@ -358,7 +3531,7 @@ def home():
         'message': 'Lecture Intelligence API',
         'status': 'running',
         'version': '3.1',
-        'features': ['transcription', 'real_gemini_ai', 'quiz', 'flashcards'],
+        'features': ['transcription', 'real_gemini_ai', 'quiz', 'flashcards', 'parallel_generation', 'combined_generation', 'result_cache', 'job_queue', 'chunked_transcription', 'streaming_transcription', 'job_events', 'persistent_jobs', 'map_reduce_notes', 'pcm_audio_ingest', 'batch_processing', 'vad_silence_trimming', 'whisper_model_pool', 'transcription_engines', 'line_response_parser', 'streaming_generation', 'llm_client_layer', 'top_up_regeneration', 'artifact_regeneration', 'prompt_cache', 'transcript_search', 'grounded_generation', 'lecture_qa', 'course_deck', 'stage_metrics'],
         'improvements': ['fixed_empty_items', 'improved_parsing', 'better_error_handling']
     })
 
@@ -366,12 +3539,56 @@ def home():
 def health():
     return jsonify({
         'status': 'healthy',
-        'whisper': 'loaded',
-        'model': 'tiny',
+        'whisper': 'lazy',
+        'model': WHISPER_MODEL_NAME,
+        'transcribe_engine': TRANSCRIBE_ENGINE,
+        'whisper_models': whisper_models.stats(),
         'gemini': 'real_api_calls',
-        'jobs_active': len([j for j in jobs.values() if j.get('status') not in ['completed', 'failed']])
+        'llm': {
+            'backend': LLM_BACKEND,
+            'metrics': llm_metrics.stats(),
+            'prompt_cache': prompt_cache.stats(),
+            'open_circuits': sum(client.breaker.state != 'closed' for client in list(llm_clients.values()))
+        },
+        'jobs_active': len([j for j in jobs.values() if j.get('status') not in ['completed', 'failed']]),
+        'job_store': type(jobs).__name__,
+        'cache': {name: layer.stats() for name, layer in CACHE_LAYERS.items()},
+        'search_index': search_index.stats(),
+        'queue': scheduler.stats(),
+        'stage_limits': {name: limiter.stats() for name, limiter in stage_limits.items()}
     })
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition: pipeline histograms plus live gauges"""
+    lines = []
+    for metric in METRICS.values():
+        lines += metric.render()
+
+    gauges = {
+        'lecture_jobs_active': ('Jobs not yet finished', len([j for j in jobs.values() if j.get('status') not in FINAL_STATUSES])),
+        'lecture_queue_depth': ('Jobs waiting for a worker', scheduler.stats()['queue_depth']),
+        'lecture_busy_workers': ('Workers running a job', scheduler.stats()['busy_workers']),
+        'lecture_llm_open_circuits': ('LLM keys with an open circuit breaker',
+                                      sum(client.breaker.state != 'closed' for client in list(llm_clients.values()))),
+    }
+    for name, (help_text, value) in gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+    lines += ["# HELP lecture_cache_lookups_total Cache lookups by layer and result",
+              "# TYPE lecture_cache_lookups_total counter"]
+    for layer_name, layer in CACHE_LAYERS.items():
+        lines.append(f'lecture_cache_lookups_total{{layer="{layer_name}",result="hit"}} {layer.hits}')
+        lines.append(f'lecture_cache_lookups_total{{layer="{layer_name}",result="miss"}} {layer.misses}')
+
+    llm = llm_metrics.stats()
+    lines += ["# HELP lecture_llm_events_total LLM calls, failures, retries and rejections",
+              "# TYPE lecture_llm_events_total counter"]
+    for event in ('calls', 'failures', 'retries', 'rate_limited', 'circuit_rejected'):
+        lines.append(f'lecture_llm_events_total{{event="{event}"}} {llm.get(event, 0)}')
+
+    return Response("\n".join(lines) + "\n", mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/process-lecture', methods=['POST', 'OPTIONS'])
 def process_lecture():
     if request.method == 'OPTIONS':
@@ -379,37 +3596,174 @@ def process_lecture():
 
     try:
         data = request.json
+        mode = data.get('generation_mode', 'parallel')
+        if mode not in GENERATION_MODES:
+            return jsonify({'error': f"generation_mode must be one of {', '.join(GENERATION_MODES)}"}), 400
+        transcription = data.get('transcription_mode', 'auto')
+        if transcription not in TRANSCRIPTION_MODES:
+            return jsonify({'error': f"transcription_mode must be one of {', '.join(TRANSCRIPTION_MODES)}"}), 400
+        whisper_model_name = data.get('whisper_model', WHISPER_MODEL_NAME)
+        if whisper_model_name not in WHISPER_CHOICES:
+            return jsonify({'error': f"whisper_model must be one of {', '.join(WHISPER_CHOICES)}"}), 400
+
+        params = {
+            'youtube_url': data['youtube_url'],
+            'api_key': data['gemini_api_key'],
+            'num_q': data.get('num_questions', 10),
+            'num_c': data.get('num_flashcards', 15),
+            'mode': mode,
+            'transcription': transcription,
+            'vad': bool(data.get('skip_silence', False)),
+            'whisper_model': whisper_model_name,
+            'preview_notes': bool(data.get('preview_notes', False))
+        }
         job_id = str(uuid.uuid4())
 
-        jobs[job_id] = {
+        jobs[job_id] = JobRecord({
             'job_id': job_id,
             'status': 'queued',
-            'progress': 0
-        }
+            'progress': 0,
+            'generation_mode': mode,
+            'transcription_mode': transcription
+        })
+        jobs.save_params(job_id, params)
 
-        thread = threading.Thread(
-            target=process_lecture_job,
-            args=(
-                job_id,
-                data['youtube_url'],
-                data['gemini_api_key'],
-                data.get('num_questions', 10),
-                data.get('num_flashcards', 15)
-            ),
-            daemon=True
-        )
-        thread.start()
+        try:
+            position = submit_lecture_job(job_id, params)
+        except QueueFullError as e:
+            jobs.pop(job_id, None)
+            return jsonify({
+                'error': 'Server busy, try again later',
+                'queue_position': e.position,
+                'estimated_wait': e.eta
+            }), 429, {'Retry-After': str(e.eta)}
+
+        return jsonify({'job_id': job_id, 'queue_position': position, 'estimated_time': scheduler.eta(position)})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/process-batch', methods=['POST', 'OPTIONS'])
+def process_batch():
+    """Queue many lectures at once: `youtube_urls` and/or a `playlist_url`"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        data = request.json
+        mode = data.get('generation_mode', 'parallel')
+        if mode not in GENERATION_MODES:
+            return jsonify({'error': f"generation_mode must be one of {', '.join(GENERATION_MODES)}"}), 400
+        transcription = data.get('transcription_mode', 'auto')
+        if transcription not in TRANSCRIPTION_MODES:
+            return jsonify({'error': f"transcription_mode must be one of {', '.join(TRANSCRIPTION_MODES)}"}), 400
+        whisper_model_name = data.get('whisper_model', WHISPER_MODEL_NAME)
+        if whisper_model_name not in WHISPER_CHOICES:
+            return jsonify({'error': f"whisper_model must be one of {', '.join(WHISPER_CHOICES)}"}), 400
+
+        urls = list(data.get('youtube_urls') or [])
+        if data.get('playlist_url'):
+            urls.append(data['playlist_url'])
+        if not urls:
+            return jsonify({'error': 'Provide youtube_urls and/or playlist_url'}), 400
+
+        params = {
+            'api_key': data['gemini_api_key'],
+            'num_q': data.get('num_questions', 10),
+            'num_c': data.get('num_flashcards', 15),
+            'mode': mode,
+            'transcription': transcription,
+            'vad': bool(data.get('skip_silence', False)),
+            'whisper_model': whisper_model_name,
+            'preview_notes': bool(data.get('preview_notes', False))
+        }
+        batch_id = str(uuid.uuid4())
+        jobs[batch_id] = JobRecord({
+            'job_id': batch_id,
+            'type': 'batch',
+            'status': 'expanding',
+            'progress': 0,
+            'total': None,
+            'items': []
+        })
+        threading.Thread(
+            target=expand_and_feed_batch, args=(batch_id, urls, params), name=f"batch-{batch_id[:8]}", daemon=True
+        ).start()
 
-        return jsonify({'job_id': job_id, 'estimated_time': 120})
+        return jsonify({'batch_id': batch_id, 'status': 'expanding'})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+MAX_LONG_POLL_SECONDS = 60
+SSE_HEARTBEAT_SECONDS = 15
+
+def job_status_payload(job_id):
+    job = jobs[job_id]
+    status = dict(job, version=getattr(job, 'version', 0))
+    position = scheduler.position(job_id) if status.get('status') == 'queued' else None
+    if position:
+        status.update({'queue_position': position, 'estimated_wait': scheduler.eta(position)})
+    if status.get('spans'):
+        status['breakdown'] = timing_breakdown(status)
+    return status
+
 @app.route('/api/job-status/<job_id>')
 def job_status(job_id):
-    if job_id in jobs:
-        return jsonify(jobs[job_id])
-    return jsonify({'error': 'Job not found'}), 404
+    """Job status; with ?since=<version>&wait=<s> it long-polls for a change"""
+    if job_id not in jobs:
+        return jsonify({'error': 'Job not found'}), 404
+
+    since = request.args.get('since', type=int)
+    if since is not None and jobs.version_of(job_id) == since:
+        wait = min(request.args.get('wait', 25, type=float), MAX_LONG_POLL_SECONDS)
+        wait_for_job_change(job_id, since, wait)
+        if job_id not in jobs:
+            return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(job_status_payload(job_id))
+
+@app.route('/api/job-events/<job_id>')
+def job_events(job_id):
+    """Server-Sent Events: one `data:` event per job change until it finishes"""
+    if job_id not in jobs:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def stream():
+        while job_id in jobs:
+            payload = job_status_payload(job_id)
+            yield f"data: {json.dumps(payload)}\n\n"
+            if payload.get('status') in ['completed', 'failed']:
+                return
+            while not wait_for_job_change(job_id, payload['version'], SSE_HEARTBEAT_SECONDS):
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/resume-job/<job_id>', methods=['POST', 'OPTIONS'])
+def resume_interrupted_job(job_id):
+    """Resend the Gemini API key for a job cut off by a server restart"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    data = request.json or {}
+    if not data.get('gemini_api_key'):
+        return jsonify({'error': 'gemini_api_key is required'}), 400
+    try:
+        position = resume_job(job_id, data['gemini_api_key'])
+    except QueueFullError as e:
+        return jsonify({
+            'error': 'Server busy, try again later',
+            'queue_position': e.position,
+            'estimated_wait': e.eta
+        }), 429, {'Retry-After': str(e.eta)}
+    if position is None:
+        return jsonify({'error': 'Job is not waiting to resume'}), 404
+
+    return jsonify({'job_id': job_id, 'queue_position': position, 'estimated_time': scheduler.eta(position)})
 
 @app.route('/api/lecture/<job_id>')
 def get_lecture(job_id):
@@ -417,41 +3771,204 @@ def get_lecture(job_id):
         return jsonify(jobs[job_id]['result'])
     return jsonify({'error': 'Not ready or not found'}), 404
 
+@app.route('/api/lecture/<job_id>/ask', methods=['POST', 'OPTIONS'])
+def ask_about_lecture(job_id):
+    """Answer a question about one lecture from its most relevant transcript chunks
+
+    Body: `question`, `gemini_api_key` and optionally `k` (chunks to use).
+    The answer comes back with the passages it was grounded on.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        data = request.json or {}
+        question = (data.get('question') or '').strip()
+        api_key = data.get('gemini_api_key')
+        if not question or not api_key:
+            return jsonify({'error': 'question and gemini_api_key are required'}), 400
+        k = data.get('k', RETRIEVAL_TOP_K * 2)
+        if not isinstance(k, int) or not 1 <= k <= 20:
+            return jsonify({'error': 'k must be an integer between 1 and 20'}), 400
+        if job_id not in jobs or jobs[job_id].get('status') != 'completed' or 'transcript' not in jobs[job_id]['result']:
+            return jsonify({'error': 'Not ready or not found'}), 404
+
+        answer, passages, retrieval_ms = ask_lecture(jobs[job_id]['result'], question, api_key, k)
+        return jsonify({
+            'question': question,
+            'answer': answer,
+            'passages': passages,
+            'retrieval_ms': retrieval_ms
+        })
+
+    except Exception as e:
+        print(f"❌ Ask error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/course-deck', methods=['POST', 'OPTIONS'])
+def build_course_deck():
+    """De-duplicated flashcards and quiz across lectures
+
+    Body: `job_ids` (in course order) and/or a `batch_id`, plus optional
+    `merge` (default true; false only flags repeats) and `threshold`
+    (shingle Jaccard similarity, 0.3-0.95). Unfinished lectures are skipped.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    try:
+        data = request.json or {}
+        job_ids = list(data.get('job_ids') or [])
+        batch_id = data.get('batch_id')
+        if batch_id:
+            if batch_id not in jobs or jobs[batch_id].get('type') != 'batch':
+                return jsonify({'error': 'Batch not found'}), 404
+            job_ids += [item['job_id'] for item in jobs[batch_id]['items']]
+        if not job_ids:
+            return jsonify({'error': 'Provide job_ids and/or batch_id'}), 400
+        job_ids = list(dict.fromkeys(job_ids))
+        if len(job_ids) > DECK_MAX_LECTURES:
+            return jsonify({'error': f"Deck has {len(job_ids)} lectures, the limit is {DECK_MAX_LECTURES}"}), 400
+        threshold = data.get('threshold', DEDUP_SIMILARITY)
+        if not isinstance(threshold, (int, float)) or not 0.3 <= threshold <= 0.95:
+            return jsonify({'error': 'threshold must be between 0.3 and 0.95'}), 400
+
+        lectures, skipped = [], []
+        for job_id in job_ids:
+            job = jobs.get(job_id)
+            if job is None or job.get('status') != 'completed' or 'transcript' not in job.get('result', {}):
+                skipped.append(job_id)
+            else:
+                lectures.append((job_id, job['result']))
+
+        t0 = time.perf_counter()
+        deck = course_deck(lectures, bool(data.get('merge', True)), threshold)
+        deck['stats'].update({'lectures': len(lectures), 'seconds': round(time.perf_counter() - t0, 3)})
+        return jsonify(dict(deck, skipped=skipped))
+
+    except Exception as e:
+        print(f"❌ Course deck error: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search')
+def search_lectures():
+    """Ranked transcript passages matching ?q=, as (lecture, timestamp, snippet) hits"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), SEARCH_MAX_HITS))
+
+    t0 = time.perf_counter()
+    hits = search_index.search(query, limit)
+    return jsonify({
+        'query': query,
+        'hits': hits,
+        'took_ms': round((time.perf_counter() - t0) * 1000, 2)
+    })
+
+@app.route('/api/lecture/<job_id>/regenerate/<artifact>', methods=['POST', 'OPTIONS'])
+def regenerate_lecture_artifact(job_id, artifact):
+    """Queue new notes, quiz or flashcards for a completed lecture
+
+    Body: `gemini_api_key`, for quiz/flashcards `num` (defaults to the
+    current count), and `fresh` (default true; false allows cached output).
+    Returns a job to follow like any other; on completion
+    /api/lecture/<job_id> serves the new artifact.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+    if artifact not in REGENERABLE_ARTIFACTS:
+        return jsonify({'error': f"artifact must be one of {', '.join(REGENERABLE_ARTIFACTS)}"}), 400
+    if job_id not in jobs or jobs[job_id].get('status') != 'completed' or 'transcript' not in jobs[job_id].get('result', {}):
+        return jsonify({'error': 'Not ready or not found'}), 404
+
+    try:
+        data = request.json or {}
+        num = None
+        if artifact != 'notes':
+            num = int(data.get('num') or len(jobs[job_id]['result'][artifact]) or 10)
+            if not 1 <= num <= 50:
+                return jsonify({'error': 'num must be between 1 and 50'}), 400
+        params = {
+            'source_job': job_id,
+            'artifact': artifact,
+            'num': num,
+            'api_key': data['gemini_api_key'],
+            'fresh': bool(data.get('fresh', True))
+        }
+        regen_id = str(uuid.uuid4())
+
+        jobs[regen_id] = JobRecord({
+            'job_id': regen_id,
+            'type': 'regenerate',
+            'status': 'queued',
+            'progress': 0,
+            'source_job': job_id,
+            'artifact': artifact
+        })
+        jobs.save_params(regen_id, params)
+
+        try:
+            position = submit_regeneration(regen_id, params)
+        except QueueFullError as e:
+            jobs.pop(regen_id, None)
+            return jsonify({
+                'error': 'Server busy, try again later',
+                'queue_position': e.position,
+                'estimated_wait': e.eta
+            }), 429, {'Retry-After': str(e.eta)}
+
+        return jsonify({'job_id': regen_id, 'queue_position': position, 'estimated_time': scheduler.eta(position)})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
 # ============================================================================
 # START SERVER
 # ============================================================================
 
-print("="*70)
-print("🚀 LECTURE INTELLIGENCE BACKEND v3.1")
-print("✨ Improvements: Fixed empty items, better parsing")
-print("="*70)
-
-print("\n🔑 Ngrok Token Setup")
-print("Get FREE token: https://dashboard.ngrok.com/get-started/your-authtoken\n")
-token = input("Paste token: ").strip()
-
-if not token:
-    print("❌ No token provided")
-    exit()
-
-try:
-    ngrok.set_auth_token(token)
-    public_url = ngrok.connect(5000)
-    print(f"\n✅ PUBLIC URL: {public_url}")
-    print(f"📋 Copy this URL for your frontend")
-    print(f"🩺 Health: {public_url}/health")
-except Exception as e:
-    print(f"❌ Ngrok error: {e}")
-    exit()
-
-print("\n" + "="*70)
-print("✨ BACKEND LIVE - v3.1 with Fixed Parsing")
-print("="*70 + "\n")
-
-try:
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
-except KeyboardInterrupt:
-    print("\n🛑 Backend stopped")
-except Exception as e:
-    print(f"\n❌ Server error: {e}")
-    traceback.print_exc()
+def main():
+    print("="*70)
+    print("🚀 LECTURE INTELLIGENCE BACKEND v3.1")
+    print("✨ Improvements: Fixed empty items, better parsing")
+    print("="*70)
+
+    tune_cpu_threads()
+    resume_interrupted_jobs()
+    threading.Thread(target=evict_expired_jobs_forever, name='job-janitor', daemon=True).start()
+    threading.Thread(target=index_completed_jobs, name='search-backfill', daemon=True).start()
+
+    print("\n🔑 Ngrok Token Setup")
+    print("Get FREE token: https://dashboard.ngrok.com/get-started/your-authtoken\n")
+    token = input("Paste token: ").strip()
+
+    if not token:
+        print("❌ No token provided")
+        return
+
+    try:
+        ngrok.set_auth_token(token)
+        public_url = ngrok.connect(5000)
+        print(f"\n✅ PUBLIC URL: {public_url}")
+        print(f"📋 Copy this URL for your frontend")
+        print(f"🩺 Health: {public_url}/health")
+    except Exception as e:
+        print(f"❌ Ngrok error: {e}")
+        return
+
+    print("\n" + "="*70)
+    print("✨ BACKEND LIVE - v3.1 with Fixed Parsing")
+    print("="*70 + "\n")
+
+    try:
+        app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    except KeyboardInterrupt:
+        print("\n🛑 Backend stopped")
+    except Exception as e:
+        print(f"\n❌ Server error: {e}")
+        traceback.print_exc()
+
+if __name__ == '__main__':
+    main()
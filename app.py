@@ -173,6 +173,129 @@ BACK: {card['back']}
     zip_buffer.seek(0)
     return zip_buffer
 
+# A backend restart parks jobs as 'interrupted' until the API key is sent again
+STOP_STATUSES = ['completed', 'failed', 'interrupted']
+
+def follow_job_events(backend_url, job_id, on_status):
+    """Follow the backend's Server-Sent Events stream until the job stops
+
+    Returns the final status, or None if the stream is unavailable or drops
+    (older backend, proxy timeout) so the caller can fall back to polling.
+    """
+    try:
+        with requests.get(
+            f"{backend_url}/api/job-events/{job_id}",
+            stream=True,
+            timeout=(10, 60),
+            headers={'Accept': 'text/event-stream'}
+        ) as events:
+            if events.status_code != 200:
+                return None
+            for line in events.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                status = json.loads(line[len('data:'):])
+                on_status(status)
+                if status.get('status') in STOP_STATUSES:
+                    return status
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    return None
+
+def resume_job(backend_url, job_id, gemini_key):
+    """Send the API key again for a job the backend restart interrupted; True if it was requeued"""
+    response = requests.post(
+        f"{backend_url}/api/resume-job/{job_id}",
+        json={"gemini_api_key": gemini_key},
+        timeout=30
+    )
+    return response.status_code == 200
+
+def regenerate_artifact(backend_url, gemini_key, lecture, artifact, num=None):
+    """Ask the backend for a fresh notes/quiz/flashcards set and reload the lecture"""
+    if not backend_url or not gemini_key:
+        st.error("❌ Backend URL and Gemini API key are needed to regenerate")
+        return
+    backend_url = backend_url.rstrip('/')
+    try:
+        response = requests.post(
+            f"{backend_url}/api/lecture/{lecture['id']}/regenerate/{artifact}",
+            json={"gemini_api_key": gemini_key, "num": num},
+            timeout=30
+        )
+        if response.status_code != 200:
+            st.error(f"❌ {response.json().get('error', 'Regeneration failed')}")
+            return
+
+        job_id = response.json()['job_id']
+        with st.spinner(f"🔄 Regenerating {artifact}..."):
+            status = follow_job_events(backend_url, job_id, lambda status: None)
+            while status is None or status.get('status') not in ['completed', 'failed']:
+                if status and status.get('status') == 'interrupted' and not resume_job(backend_url, job_id, gemini_key):
+                    break
+                time.sleep(2)
+                status = requests.get(f"{backend_url}/api/job-status/{job_id}", timeout=30).json()
+
+        if status['status'] != 'completed':
+            st.error(f"❌ Regeneration failed: {status.get('error', 'Interrupted by a backend restart')}")
+            return
+        st.session_state.lecture_data = requests.get(f"{backend_url}/api/lecture/{lecture['id']}", timeout=30).json()
+        st.rerun()
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Error: {str(e)}")
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+def timestamped_transcript(lecture):
+    """Transcript as one `[m:ss] text` line per Whisper segment, when timings are available"""
+    transcript = lecture.get('transcript', 'Not available')
+    segments = lecture.get('segments')
+    if not segments or not segments.get('start'):
+        return transcript
+    bounds = segments['offset'] + [len(transcript)]
+    return "\n".join(
+        f"[{format_timestamp(start)}] {transcript[a:b].strip()}"
+        for start, a, b in zip(segments['start'], bounds, bounds[1:])
+    )
+
+def search_lectures(backend_url, query):
+    """Ranked transcript hits across every processed lecture"""
+    try:
+        response = requests.get(
+            f"{backend_url.rstrip('/')}/api/search",
+            params={"q": query, "limit": 10},
+            timeout=30
+        )
+        if response.status_code != 200:
+            st.error(f"❌ {response.json().get('error', 'Search failed')}")
+            return []
+        return response.json()['hits']
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Error: {str(e)}")
+        return []
+
+def ask_lecture(backend_url, gemini_key, lecture, question):
+    """Answer from the lecture's most relevant passages, or None on error"""
+    if not backend_url or not gemini_key:
+        st.error("❌ Backend URL and Gemini API key are needed to ask questions")
+        return None
+    try:
+        response = requests.post(
+            f"{backend_url.rstrip('/')}/api/lecture/{lecture['id']}/ask",
+            json={"question": question, "gemini_api_key": gemini_key},
+            timeout=120
+        )
+        if response.status_code != 200:
+            st.error(f"❌ {response.json().get('error', 'Question failed')}")
+            return None
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"❌ Error: {str(e)}")
+        return None
+
 # ============================================================================
 # HEADER
 # ============================================================================
@@ -204,6 +327,33 @@ with st.sidebar:
     st.subheader("📊 Options")
     num_questions = st.slider("Quiz Questions", 3, 20, 10)
     num_flashcards = st.slider("Flashcards", 5, 30, 15)
+    generation_mode = st.selectbox(
+        "Generation Mode",
+        ["parallel", "combined", "grounded"],
+        help="combined: one Gemini call for notes, quiz and flashcards (uploads the transcript once); "
+             "grounded: notes first, then quiz and flashcards from the passages on each key concept"
+    )
+    whisper_model = st.selectbox(
+        "Whisper Model",
+        ["tiny", "base", "small", "auto"],
+        help="Larger models are more accurate but slower; auto picks by lecture length and server load"
+    )
+    stream_transcript = st.checkbox(
+        "Stream Transcript",
+        value=True,
+        help="Show the transcript as Whisper produces it"
+    )
+    preview_notes = st.checkbox(
+        "Preview Notes",
+        value=False,
+        disabled=not stream_transcript,
+        help="Draft notes from the first minutes while the rest transcribes (one extra Gemini call)"
+    )
+    skip_silence = st.checkbox(
+        "Skip Silence",
+        value=False,
+        help="Detect speech first and only transcribe those parts (faster for lectures with long pauses)"
+    )
     
     st.divider()
     
@@ -213,6 +363,37 @@ with st.sidebar:
         st.session_state.job_id = None
         st.rerun()
     
+    st.divider()
+    
+    st.subheader("🔎 Search Lectures")
+    search_query = st.text_input(
+        "Search",
+        placeholder="e.g. gradient descent",
+        help="Find the moment a concept is discussed in any processed lecture",
+        label_visibility="collapsed"
+    )
+    if search_query and backend_url:
+        hits = search_lectures(backend_url, search_query)
+        if not hits:
+            st.caption("No matches")
+        for i, hit in enumerate(hits):
+            when = hit['timestamp'] or '–'
+            if hit.get('video_id'):
+                link = f"https://youtu.be/{hit['video_id']}?t={int(hit['start'] or 0)}"
+                st.markdown(f"**{hit['title']}** · [{when}]({link})")
+            else:
+                st.markdown(f"**{hit['title']}** · {when}")
+            st.caption(hit['snippet'])
+            if st.button("Open", key=f"open_hit_{i}"):
+                response = requests.get(f"{backend_url.rstrip('/')}/api/lecture/{hit['job_id']}", timeout=30)
+                if response.status_code == 200:
+                    st.session_state.lecture_data = response.json()
+                    st.session_state.job_id = hit['job_id']
+                    st.rerun()
+                st.error("❌ That lecture is no longer available")
+    
+    st.divider()
+    
     st.info("💡 **Tip:** Keep your Colab notebook running!")
 
 # ============================================================================
@@ -276,11 +457,21 @@ if not st.session_state.lecture_data:
                         "youtube_url": youtube_url,
                         "gemini_api_key": gemini_key,
                         "num_questions": num_questions,
-                        "num_flashcards": num_flashcards
+                        "num_flashcards": num_flashcards,
+                        "generation_mode": generation_mode,
+                        "transcription_mode": "streaming" if stream_transcript else "auto",
+                        "skip_silence": skip_silence,
+                        "whisper_model": whisper_model,
+                        "preview_notes": stream_transcript and preview_notes
                     },
                     timeout=30
                 )
                 
+                if response.status_code == 429:
+                    busy = response.json()
+                    st.warning(f"⏳ Backend is busy - try again in ~{busy.get('estimated_wait', 60)}s")
+                    st.stop()
+
                 if response.status_code != 200:
                     st.error(f"❌ Backend error: {response.text}")
                     st.stop()
@@ -294,32 +485,81 @@ if not st.session_state.lecture_data:
             # Progress tracking
             progress_bar = st.progress(0)
             status_text = st.empty()
+            partial_box = st.empty()
+            preview_box = st.empty()
             
-            # Poll for completion
-            max_attempts = 120
-            for attempt in range(max_attempts):
-                time.sleep(5)
-                
-                status_response = requests.get(f"{backend_url}/api/job-status/{job_id}")
-                status = status_response.json()
-                
-                current_status = status.get('status', 'unknown')
+            def show_status(status):
                 progress = status.get('progress', 0)
-                
                 progress_bar.progress(progress / 100)
-                status_text.text(f"📊 Status: {current_status} | Progress: {progress}%")
+                if status.get('queue_position'):
+                    status_text.text(f"⏳ Queued: position {status['queue_position']} | ~{status.get('estimated_wait', '?')}s")
+                else:
+                    status_text.text(f"📊 Status: {status.get('status', 'unknown')} | Progress: {progress}%")
+
+                partial = status.get('partial') or {}
+                if status.get('partial_transcript'):
+                    partial_box.caption(f"🎙️ ...{status['partial_transcript'][-400:]}")
+                elif partial.get('quiz'):
+                    first = partial['quiz'][0]
+                    partial_box.caption(f"❓ {len(partial['quiz'])} questions ready, e.g. Q1: {first['question']}"
+                                        f" | 🗂️ {len(partial.get('flashcards', []))} flashcards")
+                elif partial.get('flashcards'):
+                    partial_box.caption(f"🗂️ {len(partial['flashcards'])} flashcards ready")
+                else:
+                    partial_box.empty()
+
+                preview = status.get('preview_notes')
+                if preview and preview.get('summary'):
+                    with preview_box.container():
+                        st.markdown("**👀 Preview notes** (from the first minutes, final notes follow)")
+                        st.caption(preview['summary'][:600])
+                        for concept in preview.get('key_concepts', [])[:5]:
+                            st.caption(f"• {concept}")
+
+            # Follow the job's event stream; fall back to polling if it drops.
+            # A backend restart interrupts the job until the key is sent again.
+            while True:
+                status = follow_job_events(backend_url, job_id, show_status)
                 
-                if current_status == 'completed':
-                    st.balloons()
-                    
-                    # Get and store results
-                    lecture_response = requests.get(f"{backend_url}/api/lecture/{job_id}")
-                    st.session_state.lecture_data = lecture_response.json()
-                    st.rerun()
+                if status is None:
+                    max_attempts = 120
+                    for attempt in range(max_attempts):
+                        # Long-poll when the backend reports versions, plain polling otherwise
+                        version = status.get('version') if status else None
+                        if version is None:
+                            time.sleep(5)
+                        
+                        status_response = requests.get(
+                            f"{backend_url}/api/job-status/{job_id}",
+                            params={'since': version, 'wait': 25} if version is not None else None,
+                            timeout=40
+                        )
+                        status = status_response.json()
+                        show_status(status)
+                        
+                        if status.get('status') in STOP_STATUSES:
+                            break
                 
-                elif current_status == 'failed':
-                    st.error(f"❌ Processing failed: {status.get('error', 'Unknown error')}")
-                    break
+                if status and status.get('status') == 'interrupted' and resume_job(backend_url, job_id, gemini_key):
+                    st.info("♻️ Backend restarted - resuming the job")
+                    continue
+                break
+            
+            current_status = status.get('status', 'unknown') if status else 'unknown'
+            
+            if current_status == 'completed':
+                st.balloons()
+                
+                # Get and store results
+                lecture_response = requests.get(f"{backend_url}/api/lecture/{job_id}")
+                st.session_state.lecture_data = lecture_response.json()
+                st.rerun()
+            
+            elif current_status == 'failed':
+                st.error(f"❌ Processing failed: {status.get('error', 'Unknown error')}")
+            
+            elif current_status == 'interrupted':
+                st.error("❌ The backend restarted and the job could not be resumed")
         
         except requests.exceptions.ConnectionError:
             st.error("❌ Cannot connect to backend. Make sure Colab is running!")
@@ -334,7 +574,7 @@ if st.session_state.lecture_data:
     lecture = st.session_state.lecture_data
     
     # Tabs
-    tab1, tab2, tab3, tab4 = st.tabs(["📝 Notes", "❓ Quiz", "📇 Flashcards", "📄 Transcript"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📝 Notes", "❓ Quiz", "📇 Flashcards", "📄 Transcript", "💬 Ask"])
     
     # ========================================================================
     # TAB 1: NOTES
@@ -362,6 +602,10 @@ if st.session_state.lecture_data:
             st.subheader("📚 Study Tips")
             for i, tip in enumerate(notes['study_tips'], 1):
                 st.markdown(f"**{i}.** {tip}")
+        
+        st.divider()
+        if st.button("🔄 Regenerate Notes"):
+            regenerate_artifact(backend_url, gemini_key, lecture, 'notes')
     
     # ========================================================================
     # TAB 2: QUIZ
@@ -369,6 +613,11 @@ if st.session_state.lecture_data:
     with tab2:
         st.subheader(f"❓ Quiz ({len(lecture['quiz'])} Questions)")
         
+        with st.expander("🔄 Regenerate Quiz"):
+            new_num_questions = st.slider("Questions", 3, 30, max(len(lecture['quiz']), 3), key="regen_quiz_num")
+            if st.button("Regenerate", key="regen_quiz"):
+                regenerate_artifact(backend_url, gemini_key, lecture, 'quiz', new_num_questions)
+        
         for q in lecture['quiz']:
             st.markdown('<div class="quiz-box">', unsafe_allow_html=True)
             st.markdown(f"### Question {q['num']}")
@@ -392,6 +641,11 @@ if st.session_state.lecture_data:
     with tab3:
         st.subheader(f"📇 Flashcards ({len(lecture['flashcards'])} Cards)")
         
+        with st.expander("🔄 Regenerate Flashcards"):
+            new_num_cards = st.slider("Cards", 5, 40, max(len(lecture['flashcards']), 5), key="regen_cards_num")
+            if st.button("Regenerate", key="regen_cards"):
+                regenerate_artifact(backend_url, gemini_key, lecture, 'flashcards', new_num_cards)
+        
         # Sort flashcards by number
         sorted_cards = sorted(lecture['flashcards'], key=lambda x: x['num'])
         
@@ -416,10 +670,26 @@ if st.session_state.lecture_data:
         st.subheader("📄 Full Transcript")
         st.text_area(
             "Transcript",
-            lecture.get('transcript', 'Not available'),
+            timestamped_transcript(lecture),
             height=500,
             label_visibility="collapsed"
         )
+    
+    # ========================================================================
+    # TAB 5: ASK
+    # ========================================================================
+    with tab5:
+        st.subheader("💬 Ask About This Lecture")
+        question = st.text_input("Question", placeholder="e.g. How was backpropagation explained?")
+        if st.button("Ask", key="ask_lecture") and question:
+            with st.spinner("🔎 Searching the lecture..."):
+                reply = ask_lecture(backend_url, gemini_key, lecture, question)
+            if reply:
+                st.markdown(reply['answer'])
+                st.caption(f"Grounded on {len(reply['passages'])} passages (retrieved in {reply['retrieval_ms']} ms)")
+                for passage in reply['passages']:
+                    with st.expander(f"🕒 {passage['timestamp'] or 'Passage'}"):
+                        st.write(passage['text'])
 
 # ============================================================================
 # FOOTER
@@ -0,0 +1,20 @@
+"""Offline benchmarks for the lecture backend
+
+Run from the repository root with `python -m benchmarks <name>[,<name>...]`
+(or `all`). Each benchmark imports the backend as a module and drives its
+functions directly against local stubs - no YouTube, Gemini or ngrok.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'Backend'))
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Register a benchmark under `name` for the command line"""
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
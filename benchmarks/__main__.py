@@ -0,0 +1,24 @@
+import os
+import sys
+
+from benchmarks import BENCHMARKS
+from benchmarks import audio, llm, load_test, parsing, search  # noqa: F401 - register benchmarks
+
+def main(argv):
+    names = ','.join(argv) or os.environ.get('LECTURE_BENCHMARK', '')
+    if not names:
+        print("Usage: python -m benchmarks <name>[,<name>...] | all")
+        print("Benchmarks: " + ', '.join(BENCHMARKS))
+        return 2
+    selected = list(BENCHMARKS) if names == 'all' else [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        print(f"❌ Unknown benchmark(s): {', '.join(unknown)}")
+        return 2
+    for name in selected:
+        print(f"\n📊 Benchmark: {name}")
+        BENCHMARKS[name]()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,138 @@
+"""Audio benchmarks: chunked transcription, transcription engines and audio ingest"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+import whisper
+
+from benchmarks import benchmark
+from benchmarks.stubs import write_synthetic_lecture
+from backend import (
+    SAMPLE_RATE, TORCH_THREADS, TRANSCRIBE_ENGINES, WHISPER_MODEL_NAME, decode_to_pcm, load_engine, load_pcm,
+    transcribe_chunked, tune_cpu_threads, whisper_models
+)
+
+@benchmark('chunked_transcription')
+def benchmark_chunked_transcription(minutes=20):
+    """Whole-file Whisper vs chunked transcription at increasing replica counts"""
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        path = workdir / 'synthetic_lecture.wav'
+        duration = write_synthetic_lecture(path, minutes)
+        tune_cpu_threads()  # as main() does: each decode gets its replica's share of the cores
+
+        t0 = time.perf_counter()
+        whisper_models.get(WHISPER_MODEL_NAME).transcribe(str(path), verbose=None)
+        baseline = time.perf_counter() - t0
+        print(f"{'replicas':>9} | {'seconds':>8} | {'speed-up':>8} | {'RTF':>6}")
+        print(f"{'whole':>9} | {baseline:>8.1f} | {1.0:>7.2f}x | {baseline / duration:>6.3f}")
+
+        for replicas in sorted({r for r in (1, 2, 4, 8) if r <= whisper_models.max_replicas} | {whisper_models.max_replicas}):
+            t0 = time.perf_counter()
+            transcribe_chunked(path, duration, replicas=replicas)
+            elapsed = time.perf_counter() - t0
+            print(f"{replicas:>9} | {elapsed:>8.1f} | {baseline / elapsed:>7.2f}x | {elapsed / duration:>6.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def word_error_rate(reference, hypothesis):
+    """Word-level edit distance over the reference length, ignoring case and punctuation"""
+    ref = re.findall(r"[\w']+", reference.lower())
+    hyp = re.findall(r"[\w']+", hypothesis.lower())
+    row = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (ref_word != hyp_word))
+    return row[-1] / max(len(ref), 1)
+
+@benchmark('transcription_engines')
+def benchmark_transcription_engines(minutes=2):
+    """Real-time factor and WER of each transcription engine on one clip
+
+    Uses LECTURE_BENCHMARK_AUDIO if set (a short spoken clip), scored against
+    LECTURE_BENCHMARK_REFERENCE (a text file) when given, otherwise against
+    the plain PyTorch engine's output so WER is the quantization delta.
+    Falls back to synthetic audio, which only makes the timings meaningful.
+    """
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        source = os.environ.get('LECTURE_BENCHMARK_AUDIO')
+        if not source:
+            print("⚠️ No LECTURE_BENCHMARK_AUDIO - synthetic audio, WER not meaningful")
+            source = workdir / 'synthetic.wav'
+            write_synthetic_lecture(source, minutes)
+        audio = load_pcm(decode_to_pcm(source, workdir / 'clip.pcm'))
+        duration = len(audio) / SAMPLE_RATE
+        reference_path = os.environ.get('LECTURE_BENCHMARK_REFERENCE')
+        reference = Path(reference_path).read_text() if reference_path else None
+
+        tune_cpu_threads(TORCH_THREADS)  # one whole-file decode at a time, so each engine gets every thread
+        print(f"Clip: {duration:.0f}s, model {WHISPER_MODEL_NAME}, {TORCH_THREADS} threads")
+        print(f"{'engine':>9} | {'load s':>6} | {'MB':>6} | {'seconds':>7} | {'RTF':>6} | {'speed-up':>8} | {'WER':>6}")
+        baseline = None
+        for name in TRANSCRIBE_ENGINES:
+            t0 = time.perf_counter()
+            engine = load_engine(WHISPER_MODEL_NAME, name)
+            loaded = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            text = engine.transcribe(audio, verbose=None)['text']
+            elapsed = time.perf_counter() - t0
+            if baseline is None:
+                baseline = elapsed
+                reference = reference if reference is not None else text
+            print(f"{name:>9} | {loaded:>6.1f} | {engine.memory_bytes() / 1e6:>6.0f} | {elapsed:>7.1f} | "
+                  f"{elapsed / duration:>6.3f} | {baseline / elapsed:>7.2f}x | {word_error_rate(reference, text):>6.3f}")
+            del engine
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+@benchmark('audio_ingest')
+def benchmark_audio_ingest(minutes=30):
+    """Old MP3 round-trip vs single decode to PCM, from a local compressed file
+
+    Uses LECTURE_BENCHMARK_AUDIO if set, otherwise synthetic audio encoded
+    to Opus to stand in for a YouTube audio stream.
+    """
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        source = os.environ.get('LECTURE_BENCHMARK_AUDIO')
+        if not source:
+            wav = workdir / 'synthetic.wav'
+            write_synthetic_lecture(wav, minutes)
+            source = workdir / 'source.webm'
+            subprocess.run(["ffmpeg", "-nostdin", "-y", "-i", str(wav), "-c:a", "libopus", str(source)],
+                           capture_output=True, check=True)
+            wav.unlink()
+
+        # Current path: FFmpegExtractAudio to MP3, then Whisper decodes the MP3 again
+        t0 = time.perf_counter()
+        mp3 = workdir / 'audio.mp3'
+        subprocess.run(["ffmpeg", "-nostdin", "-y", "-i", str(source), "-vn", "-acodec", "libmp3lame", "-q:a", "5", str(mp3)],
+                       capture_output=True, check=True)
+        encoded = time.perf_counter() - t0
+        audio = whisper.load_audio(str(mp3))
+        old_total = time.perf_counter() - t0
+        old_samples = len(audio)
+        del audio
+
+        # New path: one decode to PCM, memory-mapped read
+        t0 = time.perf_counter()
+        pcm = decode_to_pcm(source, workdir / 'audio.pcm')
+        decoded = time.perf_counter() - t0
+        audio = load_pcm(pcm)
+        new_total = time.perf_counter() - t0
+
+        print(f"{'path':>10} | {'prepare s':>9} | {'to float32 s':>12} | {'total s':>7} | {'file MB':>7} | samples")
+        print(f"{'mp3':>10} | {encoded:>9.2f} | {old_total - encoded:>12.2f} | {old_total:>7.2f} | "
+              f"{mp3.stat().st_size / 1e6:>7.1f} | {old_samples}")
+        print(f"{'pcm':>10} | {decoded:>9.2f} | {new_total - decoded:>12.2f} | {new_total:>7.2f} | "
+              f"{pcm.stat().st_size / 1e6:>7.1f} | {len(audio)}")
+        print(f"Speed-up: {old_total / new_total:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,205 @@
+"""LLM layer benchmarks: client, generation modes, streaming, top-up, prompt cache, map-reduce"""
+
+import re
+import time
+import uuid
+
+from benchmarks import benchmark
+from benchmarks.parsing import count_parsed
+from benchmarks.stubs import StubGeminiModel, scratch_prompt_cache, serve_stub_llm, synthetic_transcript
+import backend
+from backend import (
+    BREAKER_FAILURES, LLM_BACKENDS, LLM_MAX_ATTEMPTS, MAP_CHUNK_TOKENS, MAP_REDUCE_MIN_TOKENS,
+    FlashcardParser, HTTPGenerativeModel, JobRecord, LLMClient, NotesParser, QuizParser,
+    chunk_transcript, condense_transcript, estimate_tokens, generate_all_combined, generate_flashcards_real,
+    generate_notes_real, generate_quiz_real, jobs, llm_metrics, parse_reply, run_generation_stages
+)
+
+@benchmark('llm_client_layer')
+def benchmark_llm_client_layer(calls=40, failure_rate=0.3):
+    """Flaky local HTTP stub: bare model vs LLMClient (retries, bucket, breaker)
+
+    Managed models skip the prompt cache, so every call reaches the stub
+    and nothing is written to the real cache.
+    """
+    server, backend.LLM_URL = serve_stub_llm(failure_rate, StubGeminiModel(latency=0.05))
+    prompt = f"Create 5 flashcards for this lecture:\n{synthetic_transcript(5)}"
+    try:
+        print(f"{'client':>10} | {'ok':>5} | {'seconds':>7} | metrics")
+        managed = LLMClient('bench', backend='http', requests_per_minute=600).model(cache=False)
+        for label, model in (('bare', HTTPGenerativeModel(backend.LLM_URL)), ('managed', managed)):
+            before = llm_metrics.stats()
+            t0 = time.perf_counter()
+            ok = 0
+            for _ in range(calls):
+                try:
+                    if parse_reply(FlashcardParser(), model.generate_content(prompt).text):
+                        ok += 1
+                except Exception:
+                    pass
+            after = llm_metrics.stats()
+            delta = {k: after[k] - before[k] for k in ('calls', 'failures', 'retries', 'rate_limited')}
+            print(f"{label:>10} | {ok:>2}/{calls} | {time.perf_counter() - t0:>7.2f} | {delta}")
+
+        # A dead backend trips the breaker: later calls fail fast instead of waiting out retries
+        server.shutdown()
+        server.server_close()
+        server, backend.LLM_URL = serve_stub_llm(1.0)
+        client = LLMClient('bench-down', backend='http')
+        for i in range(BREAKER_FAILURES // LLM_MAX_ATTEMPTS + 2):
+            t0 = time.perf_counter()
+            try:
+                client.model(cache=False).generate_content(prompt)
+            except Exception as e:
+                print(f"  call {i + 1}: {type(e).__name__} after {time.perf_counter() - t0:.2f}s, breaker {client.breaker.state}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+@benchmark('generation_modes')
+def benchmark_generation_modes(minutes=(10, 60, 120), num_q=10, num_c=15, latency=0.4):
+    """Bytes sent and latency: three parallel calls vs one combined call"""
+    print(f"{'lecture':>8} | {'mode':>8} | {'calls':>5} | {'KB sent':>9} | {'seconds':>7} | items")
+    for m in minutes:
+        transcript = synthetic_transcript(m)
+        title = f"Synthetic {m} min lecture"
+
+        stub = StubGeminiModel(latency=latency)
+        job_id = f"bench-{uuid.uuid4()}"
+        jobs[job_id] = JobRecord({'job_id': job_id, 'progress': 50})
+        t0 = time.perf_counter()
+        generated = run_generation_stages(job_id, {
+            'notes': (lambda: generate_notes_real(transcript, title, None, model=stub), None),
+            'quiz': (lambda: generate_quiz_real(transcript, title, num_q, None, model=stub), []),
+            'flashcards': (lambda: generate_flashcards_real(transcript, title, num_c, None, model=stub), []),
+        })
+        parallel_s = time.perf_counter() - t0
+        jobs.pop(job_id, None)
+        print(f"{m:>6}m | {'parallel':>8} | {stub.calls:>5} | {stub.bytes_sent / 1024:>9.1f} | {parallel_s:>7.2f} | "
+              f"{len(generated['quiz'])}q {len(generated['flashcards'])}c")
+
+        stub = StubGeminiModel(generation_config={'response_mime_type': 'application/json'}, latency=latency)
+        t0 = time.perf_counter()
+        generated = generate_all_combined(transcript, title, num_q, num_c, None, model=stub)
+        combined_s = time.perf_counter() - t0
+        print(f"{m:>6}m | {'combined':>8} | {stub.calls:>5} | {stub.bytes_sent / 1024:>9.1f} | {combined_s:>7.2f} | "
+              f"{len(generated['quiz'])}q {len(generated['flashcards'])}c")
+
+@benchmark('streaming_generation')
+def benchmark_streaming_generation(minutes=30, counts=(5, 10, 20)):
+    """Time to first quiz question / flashcard vs the whole reply, against the streaming stub"""
+    transcript = synthetic_transcript(minutes)
+    print(f"{'artifact':>10} | {'items':>5} | {'first s':>7} | {'total s':>7} | {'first/total':>11}")
+    for name, generate in (('quiz', generate_quiz_real), ('flashcards', generate_flashcards_real)):
+        for num in counts:
+            arrivals = []
+            t0 = time.perf_counter()
+            items = generate(transcript, 'Synthetic lecture', num, None, model=StubGeminiModel(),
+                             on_item=lambda record: arrivals.append(time.perf_counter() - t0))
+            total = time.perf_counter() - t0
+            print(f"{name:>10} | {len(items):>5} | {arrivals[0]:>7.2f} | {total:>7.2f} | {arrivals[0] / total:>11.0%}")
+
+@benchmark('top_up')
+def benchmark_top_up(num=20, malformed_rates=(0.0, 0.3, 0.5)):
+    """Items delivered and calls made with and without top-up, when some blocks don't parse"""
+    transcript = synthetic_transcript(10)
+    attempts = backend.TOP_UP_ATTEMPTS
+    print(f"{'artifact':>10} | {'malformed':>9} | {'top-up':>6} | {'items':>5} | {'calls':>5} | {'KB sent':>7} | {'seconds':>7}")
+    try:
+        for name, generate in (('quiz', generate_quiz_real), ('flashcards', generate_flashcards_real)):
+            for rate in malformed_rates:
+                for backend.TOP_UP_ATTEMPTS in (0, attempts):
+                    stub = StubGeminiModel(latency=0.1, malformed_rate=rate)
+                    t0 = time.perf_counter()
+                    items = generate(transcript, 'Synthetic lecture', num, None, model=stub)
+                    print(f"{name:>10} | {rate:>9.0%} | {backend.TOP_UP_ATTEMPTS:>6} | {len(items):>2}/{num} | {stub.calls:>5} | "
+                          f"{stub.bytes_sent / 1024:>7.1f} | {time.perf_counter() - t0:>7.2f}")
+    finally:
+        backend.TOP_UP_ATTEMPTS = attempts
+REPLAY_PARSERS = [
+    (re.compile(r'^Create (\d+) multiple choice'), 'quiz', QuizParser),
+    (re.compile(r'^Create (\d+) flashcards'), 'flashcards', FlashcardParser),
+    (re.compile(r'^Analyze this lecture:'), 'notes', NotesParser)
+]
+
+def replay_prompt_cache(cache=None):
+    """Re-parse every cached text reply with today's parsers: items parsed vs requested per kind"""
+    totals = {}
+    for entry in (cache or backend.prompt_cache).entries():
+        for pattern, kind, parser in REPLAY_PARSERS:
+            match = pattern.match(entry.get('prompt_head', ''))
+            if not match:
+                continue
+            parsed = parse_reply(parser(), entry['text'])
+            row = totals.setdefault(kind, {'replies': 0, 'requested': 0, 'parsed': 0})
+            row['replies'] += 1
+            row['parsed'] += count_parsed(kind, parsed)
+            row['requested'] += int(match.group(1)) if match.groups() else count_parsed(kind, parsed)
+    return totals
+
+@benchmark('prompt_cache')
+def benchmark_prompt_cache(runs=3, num_q=10, num_c=15):
+    """The same lecture generated repeatedly through the LLM layer: cold vs warm prompt cache, then a parser replay
+
+    Runs against a scratch prompt cache, never the real one.
+    """
+    stubs = []
+    LLM_BACKENDS['stub'] = lambda api_key: lambda config: stubs.append(StubGeminiModel(config, latency=0.2)) or stubs[-1]
+    try:
+        with scratch_prompt_cache():
+            transcript = synthetic_transcript(20)
+            client = LLMClient('bench', backend='stub', requests_per_minute=6000)
+            print(f"{'run':>4} | {'seconds':>7} | {'API calls':>9} | cache")
+            for run in range(1, runs + 1):
+                before = sum(stub.calls for stub in stubs)
+                t0 = time.perf_counter()
+                generate_notes_real(transcript, 'Synthetic lecture', None, model=client.model())
+                generate_quiz_real(transcript, 'Synthetic lecture', num_q, None, model=client.model())
+                generate_flashcards_real(transcript, 'Synthetic lecture', num_c, None, model=client.model())
+                elapsed = time.perf_counter() - t0
+                print(f"{run:>4} | {elapsed:>7.2f} | {sum(stub.calls for stub in stubs) - before:>9} | {backend.prompt_cache.stats()}")
+
+            t0 = time.perf_counter()
+            client.model(cache=False).generate_content(f"Create {num_q} multiple choice questions based on this lecture:")
+            print(f"bypass | {time.perf_counter() - t0:>7.2f} | bypassed={backend.prompt_cache.stats()['bypassed']}")
+            print(f"Replay over cached replies: {replay_prompt_cache()}")
+    finally:
+        LLM_BACKENDS.pop('stub', None)
+
+@benchmark('prompt_cache_replay')
+def benchmark_prompt_cache_replay():
+    """Replay the current parsers over the real prompt cache (no API calls)"""
+    for kind, row in replay_prompt_cache().items():
+        print(f"{kind:>10}: {row['replies']} replies, {row['parsed']}/{row['requested']} items parsed")
+@benchmark('map_reduce')
+def benchmark_map_reduce(minutes=(60, 180, 360), latency=0.05):
+    """Map-reduce condensing against the deterministic stub: sizes, levels and sanity checks"""
+    print(f"{'lecture':>8} | {'tokens':>7} | {'chunks':>6} | {'condensed':>9} | {'max prompt':>10} | {'seconds':>7} | checks")
+    for m in minutes:
+        transcript = synthetic_transcript(m)
+        title = f"Synthetic {m} min lecture"
+        stub = StubGeminiModel(latency=latency)
+        largest = []
+        original_generate = stub.generate_content
+
+        def generate_content(prompt, **kwargs):
+            largest.append(estimate_tokens(prompt))
+            return original_generate(prompt, **kwargs)
+
+        stub.generate_content = generate_content
+        t0 = time.perf_counter()
+        context, failed = condense_transcript(transcript, title, None, model=stub)
+        notes = generate_notes_real(context, title, None, model=stub)
+        elapsed = time.perf_counter() - t0
+
+        # Same input must give the same condensed context, every chunk within budget
+        checks = [
+            condense_transcript(transcript, title, None, model=StubGeminiModel(latency=0)) == (context, 0),
+            failed == 0,
+            all(estimate_tokens(c) <= MAP_CHUNK_TOKENS for c in chunk_transcript(transcript)),
+            estimate_tokens(context) <= MAP_REDUCE_MIN_TOKENS,
+            bool(notes['summary'] and notes['key_concepts'] and notes['study_tips'])
+        ]
+        print(f"{m:>6}m | {estimate_tokens(transcript):>7} | {len(chunk_transcript(transcript)):>6} | "
+              f"{estimate_tokens(context):>9} | {max(largest):>10} | {elapsed:>7.2f} | "
+              f"{'✅' if all(checks) else '❌ ' + str(checks)}")
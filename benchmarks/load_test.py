@@ -0,0 +1,201 @@
+"""End-to-end load test: concurrent clients against the real Flask API, fully offline"""
+
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter, deque
+from pathlib import Path
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from benchmarks import benchmark
+from benchmarks.stubs import StubGeminiModel, serve_stub_llm, write_synthetic_lecture
+import backend
+from backend import (
+    FINAL_STATUSES, WHISPER_MODEL_NAME, DiskLRUCache, LLMClient, PromptCache, TranscriptIndex, app, jobs, llm_clients
+)
+
+LOAD_TEST_CLIENTS = int(os.environ.get('LECTURE_LOAD_CLIENTS', 4))
+LOAD_TEST_JOBS = int(os.environ.get('LECTURE_LOAD_JOBS', 16))
+LOAD_TEST_MINUTES = float(os.environ.get('LECTURE_LOAD_MINUTES', 2))
+LOAD_TEST_LLM_LATENCY = float(os.environ.get('LECTURE_LOAD_LLM_LATENCY', 0.5))
+LOAD_TEST_MAX_P95 = os.environ.get('LECTURE_LOAD_MAX_P95')
+FIXTURE_SCHEME = 'fixture://'
+AUDIO_FIXTURE_DIR = Path(os.environ.get('LECTURE_AUDIO_FIXTURES', 'lecture_fixtures'))
+# Backend globals the load test swaps out: fresh caches so every run is cold,
+# the LLM stub's URL, and fixture-aware audio fetching
+ISOLATED_STATE = ('audio_cache', 'metadata_cache', 'transcript_cache', 'artifact_cache', 'vector_cache',
+                  'prompt_cache', 'search_index', 'LLM_URL', 'resolve_video_id', 'download_audio')
+
+def ensure_audio_fixture(minutes, seed=0):
+    """A synthetic lecture WAV in AUDIO_FIXTURE_DIR (written once); returns its fixture:// URL"""
+    name = f"lecture-{minutes:g}m-{seed}.wav"
+    path = AUDIO_FIXTURE_DIR / name
+    if not path.exists():
+        AUDIO_FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        write_synthetic_lecture(tmp, minutes, seed)
+        tmp.replace(path)
+    return f"{FIXTURE_SCHEME}{name}"
+
+def resolve_fixture_id(url, resolve_video_id=backend.resolve_video_id):
+    """fixture://<file> URLs are their own video ID; anything else resolves as usual"""
+    if url.startswith(FIXTURE_SCHEME):
+        return f"fixture-{Path(url[len(FIXTURE_SCHEME):]).stem}"
+    return resolve_video_id(url)
+
+def download_fixture(url, workdir, download_audio=backend.download_audio):
+    """Read fixture://<file> from AUDIO_FIXTURE_DIR in place of YouTube"""
+    if url.startswith(FIXTURE_SCHEME):
+        path = AUDIO_FIXTURE_DIR / Path(url[len(FIXTURE_SCHEME):]).name
+        return str(path), {'title': path.stem, 'duration': 0}
+    return download_audio(url, workdir)
+
+def api_request(url, body=None, timeout=60):
+    """(status, json) for a GET, or a POST when `body` is given"""
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as reply:
+            return reply.status, json.load(reply)
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@benchmark('load_test')
+def benchmark_load_test(clients=LOAD_TEST_CLIENTS, total_jobs=LOAD_TEST_JOBS, minutes=LOAD_TEST_MINUTES,
+                        llm_latency=LOAD_TEST_LLM_LATENCY, max_p95=LOAD_TEST_MAX_P95):
+    """Concurrent clients driving the real Flask API end to end, fully offline
+
+    Audio comes from local WAV fixtures instead of YouTube, Gemini from the
+    local HTTP stub, and Whisper from LECTURE_TRANSCRIBE_ENGINE - 'fake' for
+    the deterministic stand-in, or the real engine with `tiny`. Every cache
+    layer and the search index are swapped for empty ones so each run is
+    cold. With LECTURE_LOAD_MAX_P95 set, a slower p95 exits non-zero.
+    Returns the status counts, latency percentiles, throughput and peak RSS.
+    """
+    workdir = Path(tempfile.mkdtemp(prefix='load-test-'))
+    saved = {name: getattr(backend, name) for name in ISOLATED_STATE}
+    for name in ('audio', 'metadata', 'transcript', 'artifact', 'vector'):
+        setattr(backend, f"{name}_cache", DiskLRUCache(name, 4 * 1024**3, root=workdir))
+    backend.prompt_cache = PromptCache(DiskLRUCache('prompts', 1024**3, root=workdir), ttl_seconds=3600)
+    backend.search_index = TranscriptIndex(':memory:')
+    backend.resolve_video_id, backend.download_audio = resolve_fixture_id, download_fixture
+
+    llm_server, backend.LLM_URL = serve_stub_llm(stub=StubGeminiModel(latency=llm_latency))
+    api_key = f"load-test-{uuid.uuid4().hex[:8]}"
+    llm_clients[api_key] = LLMClient(api_key, backend='http', requests_per_minute=6000)
+    urls = deque(ensure_audio_fixture(minutes, seed) for seed in range(total_jobs))
+    api_server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=api_server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{api_server.server_port}"
+
+    lock = threading.Lock()
+    results, job_ids = [], []
+    rejected = [0]
+    peak_rss = [current_rss_bytes()]
+    running = threading.Event()
+    running.set()
+
+    def sample_rss():
+        while running.is_set():
+            peak_rss[0] = max(peak_rss[0], current_rss_bytes())
+            time.sleep(0.2)
+
+    def client():
+        while True:
+            with lock:
+                if not urls:
+                    return
+                url = urls.popleft()
+            t0 = time.perf_counter()
+            while True:
+                status, body = api_request(f"{base}/api/process-lecture", {
+                    'youtube_url': url, 'gemini_api_key': api_key, 'whisper_model': WHISPER_MODEL_NAME
+                })
+                if status != 429:
+                    break
+                with lock:
+                    rejected[0] += 1
+                time.sleep(min(body.get('estimated_wait') or 1, 2))
+            if status != 200:
+                with lock:
+                    results.append((time.perf_counter() - t0, 'rejected', None))
+                continue
+            job_id, version = body['job_id'], None
+            with lock:
+                job_ids.append(job_id)
+            while True:
+                query = f"?since={version}&wait=25" if version is not None else ''
+                _, payload = api_request(f"{base}/api/job-status/{job_id}{query}")
+                version = payload.get('version')
+                if payload.get('status') in FINAL_STATUSES:
+                    break
+            with lock:
+                results.append((time.perf_counter() - t0, payload['status'], payload.get('breakdown')))
+
+    try:
+        print(f"{total_jobs} jobs of {minutes:g} min audio, {clients} clients, engine {backend.TRANSCRIBE_ENGINE}, "
+              f"LLM stub latency {llm_latency}s")
+        threading.Thread(target=sample_rss, daemon=True).start()
+        t0 = time.perf_counter()
+        workers = [threading.Thread(target=client) for _ in range(clients)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - t0
+        running.clear()
+
+        latencies = sorted(seconds for seconds, status, _ in results if status == 'completed')
+        counts = Counter(status for _, status, _ in results)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else float('nan')
+        print(f"Completed {counts['completed']}, failed {counts['failed']}, rejected {counts['rejected']} "
+              f"(429 retries: {rejected[0]}) in {elapsed:.1f}s")
+        print(f"Job latency p50 {percentile(0.5):.2f}s | p95 {percentile(0.95):.2f}s | p99 {percentile(0.99):.2f}s")
+        print(f"Throughput {counts['completed'] / elapsed * 60:.1f} jobs/min | "
+              f"peak RSS {peak_rss[0] / 1e6:.0f} MB (process max {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3:.0f} MB)")
+
+        stage_seconds = {}
+        for _, _, breakdown in results:
+            for stage, row in ((breakdown or {}).get('stages') or {}).items():
+                stage_seconds.setdefault(stage, []).append(row['seconds'])
+        for stage, values in stage_seconds.items():
+            print(f"  {stage:>12}: mean {sum(values) / len(values):.2f}s, max {max(values):.2f}s")
+
+        if max_p95 is not None and (not latencies or percentile(0.95) > float(max_p95)):
+            print(f"❌ p95 {percentile(0.95):.2f}s is over the {float(max_p95):.2f}s budget")
+            raise SystemExit(1)
+        return {'counts': dict(counts), 'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                'jobs_per_minute': counts['completed'] / elapsed * 60, 'peak_rss': peak_rss[0]}
+    finally:
+        running.clear()
+        api_server.shutdown()
+        llm_server.shutdown()
+        llm_server.server_close()
+        llm_clients.pop(api_key, None)
+        for job_id in job_ids:
+            jobs.pop(job_id, None)
+        for name, value in saved.items():
+            setattr(backend, name, value)
+        shutil.rmtree(workdir, ignore_errors=True)
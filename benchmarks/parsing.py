@@ -0,0 +1,197 @@
+"""Reply parser benchmarks: the line parsers against the split() parsers they replaced"""
+
+import time
+
+from benchmarks import benchmark
+from backend import FlashcardParser, NotesParser, QuizParser, parse_reply
+
+# Replies recorded from Gemini (trimmed), as (kind, items expected, text)
+PARSER_CORPUS = [
+    ('quiz', 2, """Q1: What does QED stand for in Quantum physics?
+A) Quantum Electrodynamics
+B) Quick Energy Decay
+C) Quantized Electron Density
+D) Quasi Elastic Diffusion
+CORRECT: A
+EXPLANATION: QED is the Quantum theory of light and matter. It was developed by Feynman, Schwinger and Tomonaga.
+
+Q2: Which Quantity is conserved in an elastic collision?
+A) Heat
+B) Kinetic energy
+C) Friction
+D) Pressure
+CORRECT: B
+EXPLANATION: Elastic collisions conserve kinetic energy as well as momentum."""),
+    ('quiz', 2, """Here are the questions:
+
+**Q1:** What is the time complexity of binary search?
+**A)** O(n)
+**B)** O(log n)
+**C)** O(n log n)
+**D)** O(1)
+**CORRECT:** B
+**EXPLANATION:** Each comparison halves the remaining range,
+so at most log2(n) steps are needed.
+
+**Q2:** Which structure gives O(1) average lookup?
+**A)** Linked list
+**B)** Binary tree
+**C)** Hash table
+**D)** Queue
+**CORRECT:** C
+**EXPLANATION:** Hashing maps keys straight to buckets."""),
+    ('quiz', 3, """Question 1. Who proposed the theory of natural selection?
+(a) Lamarck
+(b) Darwin
+(c) Mendel
+(d) Pasteur
+Correct answer: B
+Explanation: Darwin published On the Origin of Species in 1859.
+
+2) What carries genetic information in most organisms?
+A. Proteins
+B. Lipids
+C. DNA
+D. Carbohydrates
+Answer: C
+Explanation: DNA encodes genes as sequences of nucleotides.
+
+### Q3: Mutations are best described as
+A) changes in the DNA sequence that may
+   be inherited
+B) changes in diet
+C) learned behaviours
+D) seasonal adaptations
+CORRECT: A) changes in the DNA sequence
+EXPLANATION: Mutations alter the genetic code itself."""),
+    ('flashcards', 3, """CARD 1
+FRONT: What is a Queue?
+BACK: A first-in, first-out collection. Items are added at the back and removed from the front.
+
+CARD 2
+FRONT: What is a stack?
+BACK: A last-in, first-out collection.
+
+CARD 3
+FRONT: What does CARD stand for in this course?
+BACK: Nothing - it is just the header word."""),
+    ('flashcards', 3, """**CARD 1**
+**FRONT:** Define entropy.
+**BACK:** A measure of disorder, or of the number of microstates
+consistent with a macrostate.
+
+**Card 2:**
+**Front:** State the second law of thermodynamics.
+**Back:** The total entropy of an isolated system never decreases.
+
+FRONT: What is absolute zero?
+BACK: 0 K, the lowest possible temperature, where motion is minimal."""),
+    ('notes', 5, """SUMMARY:
+The lecture introduces supply and demand.
+
+It then covers market equilibrium and price controls.
+
+KEY_CONCEPTS:
+• Supply: the quantity producers are willing to sell at each price
+• Demand: the quantity consumers want to buy at each price
+• Equilibrium: the price where supply equals demand
+
+EXAMPLES:
+• Rent control in large cities
+
+STUDY_TIPS:
+• Draw the curves by hand"""),
+    ('notes', 6, """## Summary
+Neural networks learn functions from data by adjusting weights.
+
+## Key Concepts
+1. **Perceptron** - a single linear unit followed by a threshold,
+   the simplest neural network.
+2. **Backpropagation** - computes gradients layer by layer using the chain rule.
+3. **Overfitting** - memorising training data instead of generalising.
+
+## Examples
+- Digit recognition on MNIST
+- Spam filtering
+
+## Study Tips
+- Derive backpropagation for a two-layer network yourself."""),
+]
+
+def legacy_parse_quiz(text):
+    """The split('Q') parser this replaced, kept for comparison"""
+    questions = []
+    for block in text.split('Q')[1:]:
+        lines = [l.strip() for l in block.strip().split('\n') if l.strip()]
+        if len(lines) < 6:
+            continue
+        question = lines[0].split(':', 1)[1].strip() if ':' in lines[0] else lines[0].strip()
+        opts, correct = {}, None
+        for line in lines[1:]:
+            if line[:2] in ('A)', 'B)', 'C)', 'D)'):
+                opts[line[0]] = line[2:].strip()
+            elif line.startswith('CORRECT:'):
+                correct = line.split(':')[1].strip().upper()
+        if len(opts) == 4 and correct in ['A', 'B', 'C', 'D'] and question:
+            questions.append(question)
+    return questions
+
+def legacy_parse_flashcards(text):
+    cards = []
+    for block in text.split('CARD ')[1:]:
+        front = back = ""
+        for line in block.split('\n'):
+            line = line.strip()
+            if line.startswith('FRONT:'):
+                front = line.split(':', 1)[1].strip()
+            elif line.startswith('BACK:'):
+                back = line.split(':', 1)[1].strip()
+        if front and back:
+            cards.append(front)
+    return cards
+
+def legacy_parse_notes(text):
+    kc_section = text.split("KEY_CONCEPTS:")[1].split("EXAMPLES:")[0] if "KEY_CONCEPTS:" in text else ""
+    ex_section = text.split("EXAMPLES:")[1].split("STUDY_TIPS:")[0] if "EXAMPLES:" in text else ""
+    st_section = text.split("STUDY_TIPS:")[1] if "STUDY_TIPS:" in text else ""
+    return [l for section in (kc_section, ex_section, st_section)
+            for l in section.split('\n') if l.strip().lstrip('•-*').strip()]
+
+RESPONSE_PARSERS = {
+    'quiz': (QuizParser, legacy_parse_quiz),
+    'flashcards': (FlashcardParser, legacy_parse_flashcards),
+    'notes': (NotesParser, legacy_parse_notes)
+}
+
+def count_parsed(kind, parsed):
+    if kind == 'notes':
+        return len(parsed.key_concepts) + len(parsed.examples) + len(parsed.study_tips)
+    return len(parsed)
+
+def scan_reply(parser, text):
+    parser.feed(text)
+    return parser.close()
+
+@benchmark('response_parsing')
+def benchmark_response_parsing(rounds=500):
+    """Parse rate and throughput of the line parsers vs the split() parsers on PARSER_CORPUS
+
+    `scanner` feeds every reply through the line scanner; `new` is parse_reply,
+    which matches exactly formatted replies whole first
+    """
+    print(f"{'kind':>10} | {'expected':>8} | {'legacy':>6} | {'new':>4}")
+    for kind, expected, text in PARSER_CORPUS:
+        parser, legacy = RESPONSE_PARSERS[kind]
+        print(f"{kind:>10} | {expected:>8} | {len(legacy(text)):>6} | {count_parsed(kind, parse_reply(parser(), text)):>4}")
+
+    corpus_bytes = sum(len(text.encode()) for _, _, text in PARSER_CORPUS) * rounds
+    for label, run in (('legacy', lambda kind, text: RESPONSE_PARSERS[kind][1](text)),
+                       ('scanner', lambda kind, text: scan_reply(RESPONSE_PARSERS[kind][0](), text)),
+                       ('new', lambda kind, text: parse_reply(RESPONSE_PARSERS[kind][0](), text))):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for kind, _, text in PARSER_CORPUS:
+                run(kind, text)
+        elapsed = time.perf_counter() - t0
+        print(f"{label:>7}: {corpus_bytes / elapsed / 1e6:.1f} MB/s, "
+              f"{rounds * len(PARSER_CORPUS) / elapsed:,.0f} replies/s")
@@ -0,0 +1,157 @@
+"""Search benchmarks: full-text transcript index, retrieval and course-deck de-duplication"""
+
+import itertools
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import benchmark
+from backend import (
+    DEDUP_SIMILARITY, LectureVectors, TranscriptIndex, get_embedder, grounded_context, near_duplicate_groups,
+    retrieval_chunks, segment_columns, shingles
+)
+
+def zipf_vocabulary(rng, size):
+    """Pseudo-words with Zipf-like frequencies: (words, cumulative weights) for rng.choices"""
+    syllables = 'ba ce di fo gu ka le mi no pu ra se ti vo zu tra ple qui ster mon'.split()
+    vocab = sorted({''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(size * 2)})[:size]
+    rng.shuffle(vocab)
+    return vocab, list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocab))))
+
+def synthetic_lecture_segments(rng, vocab, cum_weights, minutes, segment_seconds=4, words=10):
+    """Zipf-distributed filler text with Whisper-like segment timings"""
+    segments = []
+    for i in range(minutes * 60 // segment_seconds):
+        text = ' ' + ' '.join(rng.choices(vocab, cum_weights=cum_weights, k=words))
+        segments.append({'start': i * segment_seconds, 'end': (i + 1) * segment_seconds, 'text': text})
+    return segments
+
+@benchmark('transcript_search')
+def benchmark_transcript_search(lectures=10_000, minutes=10, queries=200, vocab_size=20_000):
+    """Index synthetic lectures and time rare, common and two-word queries"""
+    rng = random.Random(0)
+    vocab, cum_weights = zipf_vocabulary(rng, vocab_size)
+
+    workdir = tempfile.mkdtemp(prefix='search-bench-')
+    try:
+        index = TranscriptIndex(Path(workdir) / 'search.db')
+        t0 = time.perf_counter()
+        for i in range(lectures):
+            segments = synthetic_lecture_segments(rng, vocab, cum_weights, minutes)
+            transcript = ''.join(seg['text'] for seg in segments)
+            index.add(f"video{i:06d}", f"job{i:06d}", f"Lecture {i}", transcript,
+                      segment_columns(segments, transcript), commit=False)
+            if i % 500 == 499:
+                index.commit()
+        index.commit()
+        elapsed = time.perf_counter() - t0
+        size = sum(path.stat().st_size for path in Path(workdir).iterdir())
+        print(f"Indexed {lectures} lectures ({minutes} min each) in {elapsed:.1f}s "
+              f"- {lectures / elapsed:.0f} lectures/s, {size / 1e6:.0f} MB, {index.stats()['passages']} passages")
+
+        kinds = {
+            'rare': lambda: rng.choice(vocab[2000:]),
+            'common': lambda: rng.choice(vocab[10:100]),
+            'two-word': lambda: f"{rng.choice(vocab[100:2000])} {rng.choice(vocab[100:2000])}",
+        }
+        print(f"{'query':>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'p99 ms':>7} | {'hits':>5}")
+        for kind, make_query in kinds.items():
+            times, found = [], 0
+            for _ in range(queries):
+                t0 = time.perf_counter()
+                found += bool(index.search(make_query(), limit=10))
+                times.append((time.perf_counter() - t0) * 1000)
+            times.sort()
+            p50, p95, p99 = (times[min(int(q * len(times)), len(times) - 1)] for q in (0.5, 0.95, 0.99))
+            print(f"{kind:>9} | {p50:>7.2f} | {p95:>7.2f} | {p99:>7.2f} | {found:>5}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+@benchmark('retrieval')
+def benchmark_retrieval(minutes=(30, 90, 180), concepts=12, queries=200):
+    """Index build time, query latency, recall of planted passages and prompt size vs the full transcript"""
+    rng = random.Random(0)
+    vocab, cum_weights = zipf_vocabulary(rng, 20_000)
+    print(f"{'minutes':>7} | {'chunks':>6} | {'build s':>7} | {'p50 ms':>6} | {'p99 ms':>6} | {'recall@3':>8} | {'prompt':>6}")
+    for m in minutes:
+        segments = synthetic_lecture_segments(rng, vocab, cum_weights, m)
+        # Plant one distinctive passage per concept; retrieval should find it
+        topics = [' '.join(rng.sample(vocab[3000:], 3)) for _ in range(concepts)]
+        planted = rng.sample(range(len(segments)), concepts)
+        for topic, i in zip(topics, planted):
+            segments[i]['text'] += f" {topic} {topic}"
+        transcript = ''.join(seg['text'] for seg in segments)
+        columns = segment_columns(segments, transcript)
+
+        t0 = time.perf_counter()
+        embedder = get_embedder()
+        chunks = retrieval_chunks(transcript, columns)
+        state = embedder.fit([text for _, text in chunks])
+        vectors = LectureVectors(chunks, embedder.embed([text for _, text in chunks], state), state, embedder)
+        build = time.perf_counter() - t0
+
+        times = []
+        for _ in range(queries):
+            query = ' '.join(rng.choices(vocab[:3000], k=3))
+            t0 = time.perf_counter()
+            vectors.search(query)
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+
+        found = 0
+        for topic, i in zip(topics, planted):
+            found += any(topic in vectors.chunks[j][1] for _, j in vectors.search(topic))
+        context = grounded_context(vectors, topics)
+        print(f"{m:>7} | {len(chunks):>6} | {build:>7.2f} | {times[len(times) // 2]:>6.2f} | "
+              f"{times[int(len(times) * 0.99)]:>6.2f} | {found / concepts:>8.0%} | {len(context) / len(transcript):>6.0%}")
+
+def synthetic_card_fronts(rng, n, duplicate_rate=0.2):
+    """Card fronts where about `duplicate_rate` are reworded repeats; returns (texts, original index per text)"""
+    vocab, _ = zipf_vocabulary(rng, 5000)
+    templates = ["What is {}?", "Define {}.", "How does {} relate to {}?", "Why is {} important in {}?",
+                 "Explain the role of {} in {}.", "What is the difference between {} and {}?"]
+    variants = [lambda t: t.lower(), lambda t: t.rstrip('?.') + '??', lambda t: 'Q: ' + t,
+                lambda t: t.replace(' the ', ' a '), lambda t: t.upper()]
+    texts, origin = [], []
+    for i in range(n):
+        if texts and rng.random() < duplicate_rate:
+            j = rng.randrange(len(texts))
+            texts.append(rng.choice(variants)(texts[j]))
+            origin.append(origin[j])
+        else:
+            template = rng.choice(templates)
+            terms = [' '.join(rng.sample(vocab, 2)) for _ in range(template.count('{}'))]
+            texts.append(template.format(*terms))
+            origin.append(i)
+    return texts, origin
+
+@benchmark('course_deck')
+def benchmark_course_deck(sizes=(5_000, 10_000, 20_000, 40_000), brute_force=2_000):
+    """MinHash/LSH de-duplication time and accuracy on planted repeats, against all-pairs Jaccard"""
+    rng = random.Random(0)
+    print(f"{'cards':>6} | {'seconds':>7} | {'us/card':>7} | {'unique':>6} | {'precision':>9} | {'recall':>6}")
+    for n in sizes:
+        texts, origin = synthetic_card_fronts(rng, n)
+        t0 = time.perf_counter()
+        groups = near_duplicate_groups(texts)
+        elapsed = time.perf_counter() - t0
+
+        # A pair counts when both texts share a group; truth is a shared origin
+        flagged = [(i, root) for i, root in enumerate(groups) if root != i]
+        correct = sum(origin[i] == origin[root] for i, root in flagged)
+        planted = sum(origin[i] != i for i in range(n))
+        print(f"{n:>6} | {elapsed:>7.2f} | {elapsed / n * 1e6:>7.0f} | {len(set(groups)):>6} | "
+              f"{correct / max(len(flagged), 1):>9.1%} | {correct / max(planted, 1):>6.1%}")
+
+    texts, _ = synthetic_card_fronts(rng, brute_force)
+    sets = [shingles(text) for text in texts]
+    t0 = time.perf_counter()
+    for i in range(len(sets)):
+        for j in range(i):
+            if sets[i] and len(sets[i] & sets[j]) / len(sets[i] | sets[j]) >= DEDUP_SIMILARITY:
+                break
+    elapsed = time.perf_counter() - t0
+    print(f"All-pairs Jaccard on {brute_force} cards: {elapsed:.2f}s "
+          f"(~{elapsed * (sizes[-1] / brute_force) ** 2:.0f}s at {sizes[-1]})")
@@ -0,0 +1,242 @@
+"""Local stand-ins for the backend's external services, and synthetic inputs
+
+StubGeminiModel replaces Gemini (in-process, or over HTTP through
+serve_stub_llm), FakeTranscriptionEngine replaces Whisper, and the
+synthetic_* / write_synthetic_lecture helpers make lecture-sized text and
+audio.
+"""
+
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import wave
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+import backend
+from backend import SAMPLE_RATE, WHISPER_LANGUAGE, DiskLRUCache, PromptCache, TextResponse, TranscriptionEngine, estimate_tokens
+
+class StubGeminiModel:
+    """Local stand-in for genai.GenerativeModel used by the offline benchmarks
+
+    Replies in the formats the real prompts ask for, counts the bytes it is
+    sent and sleeps for a simulated round-trip: fixed latency, upload time for
+    the prompt and decode time for the reply.
+    """
+
+    def __init__(self, generation_config=None, latency=0.4, upload_bytes_per_s=2_000_000, tokens_per_s=400,
+                 malformed_rate=0.0, seed=0):
+        self.json_mode = (generation_config or {}).get('response_mime_type') == 'application/json'
+        self.latency = latency
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.upload_bytes_per_s = upload_bytes_per_s
+        self.tokens_per_s = tokens_per_s
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        text = self.reply(prompt)
+        sent = len(prompt.encode('utf-8'))
+        with self.lock:
+            self.calls += 1
+            self.bytes_sent += sent
+            self.bytes_received += len(text.encode('utf-8'))
+        if stream:
+            return self.stream(text, sent)
+        time.sleep(self.latency + sent / self.upload_bytes_per_s + len(text) / 4 / self.tokens_per_s)
+        return TextResponse(text)
+
+    def stream(self, text, sent, chunk_chars=120):
+        """Chunks arrive as they decode, like Gemini's stream=True iterator"""
+        time.sleep(self.latency + sent / self.upload_bytes_per_s)
+        for start in range(0, len(text), chunk_chars):
+            chunk = text[start:start + chunk_chars]
+            time.sleep(len(chunk) / 4 / self.tokens_per_s)
+            yield TextResponse(chunk)
+        yield TextResponse('')  # finish-reason-only chunk
+
+    def reply(self, prompt):
+        if self.json_mode:
+            num_q = int(re.search(r'exactly (\d+) multiple choice', prompt).group(1))
+            num_c = int(re.search(r'exactly (\d+) cards', prompt).group(1))
+            return json.dumps({
+                "notes": {
+                    "summary": "This lecture covers the topic in depth. " * 20,
+                    "key_concepts": [f"Concept {i}: a detailed explanation of the idea" for i in range(1, 13)],
+                    "examples": [f"Example {i} from the real world" for i in range(1, 5)],
+                    "study_tips": [f"Study tip {i}" for i in range(1, 4)]
+                },
+                "quiz": [{
+                    "question": f"Which statement about concept {i} is true?",
+                    "options": {k: f"Option {k} for concept {i}" for k in 'ABCD'},
+                    "correct": "ABCD"[i % 4],
+                    "explanation": "Because the lecture explains it that way. It is a key point."
+                } for i in range(1, num_q + 1)],
+                "flashcards": [{
+                    "front": f"What is concept {i}?",
+                    "back": f"Concept {i} is explained in the lecture with an example and a definition."
+                } for i in range(1, num_c + 1)]
+            })
+
+        part = re.match(r'Summarise part (\d+) of (\d+)', prompt)
+        if part:
+            chunk = prompt.split("TRANSCRIPT PART: ", 1)[1].split("\n\nWrite dense study notes", 1)[0]
+            words = chunk.split()
+            return (f"SUMMARY:\nPart {part.group(1)} covers {len(words)} words starting with "
+                    f"\"{' '.join(words[:8])}\".\n\nKEY_POINTS:\n"
+                    + "\n".join(f"• {' '.join(words[i:i + 6])}" for i in range(0, min(len(words), 60), 12)))
+
+        # Top-up requests list what already exists; carry on numbering after it
+        existing = prompt.split('already exist', 1)[1] if 'already exist' in prompt else ''
+        done = max(map(int, re.findall(r'^- .*?(\d+)', existing, re.M)), default=0)
+        with self.lock:
+            # A malformed block is missing its answer line, so the parser drops it
+            malformed = [self.rng.random() < self.malformed_rate for _ in range(200)]
+
+        quiz = re.match(r'Create (\d+) multiple choice', prompt)
+        if quiz:
+            return "\n\n".join(
+                f"Q{i}: Which statement about concept {i} is true?\n"
+                + "\n".join(f"{k}) Option {k} for concept {i}" for k in 'ABCD')
+                + ("" if malformed[i % 200] else f"\nCORRECT: {'ABCD'[i % 4]}")
+                + "\nEXPLANATION: Because the lecture explains it that way."
+                for i in range(done + 1, done + int(quiz.group(1)) + 1)
+            )
+
+        cards = re.match(r'Create (\d+) flashcards', prompt)
+        if cards:
+            return "\n\n".join(
+                f"CARD {i}\nFRONT: What is concept {i}?\n"
+                + ("" if malformed[i % 200] else
+                   f"BACK: Concept {i} is explained in the lecture with an example and a definition.")
+                for i in range(done + 1, done + int(cards.group(1)) + 1)
+            )
+
+        return ("SUMMARY:\n" + "This lecture covers the topic in depth. " * 20
+                + "\n\nKEY_CONCEPTS:\n" + "\n".join(f"• Concept {i}: a detailed explanation of the idea" for i in range(1, 13))
+                + "\n\nEXAMPLES:\n" + "\n".join(f"• Example {i} from the real world" for i in range(1, 5))
+                + "\n\nSTUDY_TIPS:\n" + "\n".join(f"• Study tip {i}" for i in range(1, 4)))
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """HTTP front for a StubGeminiModel, speaking HTTPGenerativeModel's protocol
+
+    Fails a `failure_rate` share of requests with 429 or 503 so clients'
+    retry paths get exercised.
+    """
+    stub = None
+    failure_rate = 0.0
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if random.random() < self.failure_rate:
+            self.send_error(random.choice([429, 503]))
+            return
+        stub = self.stub or StubGeminiModel(data.get('generation_config'))
+        usage = {'prompt_token_count': estimate_tokens(data['prompt'])}
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        if data.get('stream'):
+            for chunk in stub.generate_content(data['prompt'], stream=True):
+                self.wfile.write(json.dumps({'text': chunk.text, 'usage': usage}).encode('utf-8') + b'\n')
+                self.wfile.flush()
+        else:
+            self.wfile.write(json.dumps({'text': stub.generate_content(data['prompt']).text, 'usage': usage}).encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+def serve_stub_llm(failure_rate=0.0, stub=None):
+    """Start a local HTTP Gemini stand-in on a free port; returns (server, url)"""
+    handler = type('Handler', (StubLLMHandler,), {'failure_rate': failure_rate, 'stub': stub})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+@contextmanager
+def scratch_prompt_cache(max_bytes=64 * 1024**2):
+    """Point the backend's prompt cache at an empty temporary directory while active"""
+    workdir = Path(tempfile.mkdtemp(prefix='prompt-cache-'))
+    saved = backend.prompt_cache
+    backend.prompt_cache = PromptCache(DiskLRUCache('prompts', max_bytes, root=workdir), ttl_seconds=3600)
+    try:
+        yield backend.prompt_cache
+    finally:
+        backend.prompt_cache = saved
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def synthetic_transcript(minutes, words_per_minute=150, seed=0):
+    """Deterministic lecture-sized filler text (~150 spoken words per minute)"""
+    rng = random.Random(seed)
+    vocab = ("the model gradient data network learning function value energy system "
+             "equation example result theory process structure method analysis").split()
+    return " ".join(rng.choice(vocab) for _ in range(minutes * words_per_minute))
+
+def write_synthetic_lecture(path, minutes, seed=0):
+    """Speech-like test audio: harmonic "syllables" separated by short and long pauses"""
+    rng = np.random.default_rng(seed)
+    total = int(minutes * 60 * SAMPLE_RATE)
+    audio = np.zeros(total, np.float32)
+    pos = 0
+    while pos < total:
+        length = min(int(rng.uniform(0.15, 0.4) * SAMPLE_RATE), total - pos)
+        t = np.arange(length) / SAMPLE_RATE
+        f0 = rng.uniform(100, 220)
+        envelope = np.sin(np.pi * np.arange(length) / max(length, 1))
+        audio[pos:pos + length] = 0.3 * envelope * sum(np.sin(2 * np.pi * f0 * k * t) / k for k in (1, 2, 3))
+        pause = rng.uniform(0.8, 2.0) if rng.random() < 0.1 else rng.uniform(0.05, 0.3)
+        pos += length + int(pause * SAMPLE_RATE)
+
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+    return total / SAMPLE_RATE
+
+FAKE_REAL_TIME_FACTOR = float(os.environ.get('LECTURE_FAKE_RTF', 0.02))
+
+class FakeTranscriptionEngine(TranscriptionEngine):
+    """Deterministic stand-in for Whisper, for offline load tests
+
+    Emits one 4 s segment of filler words per 4 s of audio, seeded by the
+    samples so different fixtures give different transcripts, after
+    sleeping FAKE_REAL_TIME_FACTOR seconds per second of audio. No model
+    is loaded.
+    """
+    name = 'fake'
+    vocab = ("the model gradient data network learning function value energy system equation example "
+             "result theory process structure method analysis layer signal error vector matrix loss").split()
+
+    def transcribe(self, audio, **options):
+        audio = np.asarray(audio, dtype=np.float32)
+        seconds = len(audio) / SAMPLE_RATE
+        rng = random.Random(zlib.crc32(audio[:5 * SAMPLE_RATE].tobytes()) ^ len(audio))
+        time.sleep(seconds * FAKE_REAL_TIME_FACTOR)
+        segments = [
+            {'start': start, 'end': min(start + 4.0, seconds),
+             'text': ' ' + ' '.join(rng.choice(self.vocab) for _ in range(10)) + '.'}
+            for start in np.arange(0, seconds, 4.0).tolist()
+        ]
+        return {'text': ''.join(seg['text'] for seg in segments), 'segments': segments, 'language': WHISPER_LANGUAGE}
+
+    @classmethod
+    def load(cls, model_name):
+        return cls(None)
+
+    def memory_bytes(self):
+        return 0
+
+backend.TRANSCRIBE_ENGINES[FakeTranscriptionEngine.name] = FakeTranscriptionEngine
@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / 'Backend')]
+
+# Set before the backend is imported: in-memory jobs, throwaway caches and
+# the deterministic transcriber, so tests never touch real state or models
+SCRATCH = Path(tempfile.mkdtemp(prefix='lecture-tests-'))
+os.environ.setdefault('LECTURE_JOB_STORE', 'memory')
+os.environ.setdefault('LECTURE_CACHE_DIR', str(SCRATCH / 'cache'))
+os.environ.setdefault('LECTURE_AUDIO_FIXTURES', str(SCRATCH / 'fixtures'))
+os.environ.setdefault('LECTURE_TRANSCRIBE_ENGINE', 'fake')
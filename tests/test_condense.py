@@ -0,0 +1,16 @@
+from backend import chunk_transcript, condense_transcript
+from benchmarks.stubs import StubGeminiModel, synthetic_transcript
+
+class FailingPartModel(StubGeminiModel):
+    """Stub that errors on one part of the map step"""
+
+    def generate_content(self, prompt, **kwargs):
+        if prompt.startswith("Summarise part 2 of"):
+            raise RuntimeError("quota exceeded")
+        return super().generate_content(prompt, **kwargs)
+
+def test_failed_summary_keeps_the_part_verbatim():
+    transcript = synthetic_transcript(180)
+    context, failed = condense_transcript(transcript, "Lecture", None, model=FailingPartModel(latency=0))
+    assert failed == 1
+    assert chunk_transcript(transcript)[1] in context
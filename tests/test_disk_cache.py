@@ -0,0 +1,15 @@
+import numpy as np
+
+import backend
+from backend import DiskLRUCache, lecture_vectors
+
+def test_vectors_and_meta_survive_eviction_together(tmp_path, monkeypatch):
+    # Room for about one entry: writing the meta must not evict its own vectors
+    cache = DiskLRUCache('vectors', 1, root=tmp_path)
+    monkeypatch.setattr(backend, 'vector_cache', cache)
+    transcript = ' '.join(f"sentence {i} about entropy and energy." for i in range(200))
+
+    built = lecture_vectors(transcript)
+    assert len(cache.entries()) == 2
+    again = lecture_vectors(transcript)
+    assert cache.hits == 2 and np.array_equal(again.vectors, built.vectors)
@@ -0,0 +1,7 @@
+from benchmarks.llm import benchmark_generation_modes
+
+def test_generation_modes_benchmark_runs(capsys):
+    benchmark_generation_modes(minutes=(10,), num_q=3, num_c=3, latency=0)
+    rows = [line for line in capsys.readouterr().out.splitlines() if line.lstrip().startswith('10m')]
+    assert [row.split('|')[1].strip() for row in rows] == ['parallel', 'combined']
+    assert all(row.rstrip().endswith('3q 3c') for row in rows)
@@ -0,0 +1,27 @@
+import sqlite3
+
+import backend
+from backend import JobRecord, SQLiteJobStore
+
+def test_sqlite_store_batches_writes_and_never_stores_the_api_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, 'JOB_FLUSH_SECONDS', 3600)  # flush by hand only
+    store = SQLiteJobStore(tmp_path / 'jobs.db')
+    monkeypatch.setattr(backend, 'jobs', store)
+    db = sqlite3.connect(str(tmp_path / 'jobs.db'))
+
+    store['job'] = JobRecord({'job_id': 'job', 'status': 'queued', 'progress': 0})
+    store.save_params('job', {'youtube_url': 'https://youtu.be/abc', 'api_key': 'AIza-secret'})
+    for progress in range(1, 20):
+        store['job'].update({'status': 'transcribing', 'progress': progress})
+    store['job'].merge('stages', {'notes': {'status': 'running'}})
+    assert db.execute('SELECT status FROM jobs').fetchone() == ('queued',)
+
+    store.flush()
+    state, params = db.execute('SELECT state, params FROM jobs').fetchone()
+    assert '"progress": 19' in state and '"notes"' in state
+    assert 'AIza-secret' not in params
+    assert store.recover() == [('job', {'youtube_url': 'https://youtu.be/abc'})]
+
+    store['job'].update({'status': 'completed', 'result': {'transcript': 'hello'}})
+    assert db.execute('SELECT status, params FROM jobs').fetchone() == ('completed', None)
+    assert store['job']['result'] == {'transcript': 'hello'}
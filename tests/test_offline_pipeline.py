@@ -0,0 +1,5 @@
+from benchmarks.load_test import benchmark_load_test
+
+def test_lectures_complete_end_to_end_offline():
+    summary = benchmark_load_test(clients=2, total_jobs=3, minutes=0.5, llm_latency=0.0, max_p95=120)
+    assert summary['counts'] == {'completed': 3}
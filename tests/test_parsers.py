@@ -0,0 +1,166 @@
+import random
+
+import pytest
+
+from backend import Flashcard, FlashcardParser, LectureNotes, NotesParser, QuizParser, QuizQuestion, parse_reply
+from benchmarks.parsing import PARSER_CORPUS, count_parsed
+
+PARSERS = {'quiz': QuizParser, 'flashcards': FlashcardParser, 'notes': NotesParser}
+SEEDS = range(30)
+CASES_PER_SEED = 100
+
+FUZZ_WORDS = ['the', 'energy', 'Q', 'QED', 'Quantum', 'CARD', 'card', 'Answer', 'front', 'back',
+              'A', 'B', 'x:y', '(see', 'note)', '1', '•', 'O(n)', 'e.g.', 'résumé']
+
+# Lines that look like part of the format, spliced into canonical replies
+TRICKY_LINES = ['', '   ', 'Summary', 'SUMMARY:', 'EXAMPLES: rent', 'KEY_CONCEPTS:', '• ', '•x', '- item',
+                'Q3: why?', 'A) yes', 'CORRECT: E', 'CORRECT: b', 'CARD 2', 'CARD', 'FRONT:', 'BACK: it',
+                '**bold**', '# Title', '1. first', 'EXPLANATION:', 'trailing words']
+
+def fuzz_text(rng, words=(3, 12)):
+    return ' '.join(rng.choice(FUZZ_WORDS) for _ in range(rng.randint(*words)))
+
+def fuzz_wrap(rng, text):
+    """Break text over lines, only before plain lowercase words"""
+    words = text.split(' ')
+    lines = [words[0]]
+    for word in words[1:]:
+        if word.isalpha() and word.islower() and word not in ('card', 'front', 'back') and rng.random() < 0.2:
+            lines.append(word)
+        else:
+            lines[-1] += ' ' + word
+    return '\n'.join(lines)
+
+def random_records(rng, kind):
+    if kind == 'quiz':
+        return [QuizQuestion(fuzz_text(rng), {k: fuzz_text(rng, (1, 6)) for k in 'ABCD'},
+                             rng.choice('ABCD'), fuzz_text(rng))
+                for _ in range(rng.randint(0, 5))]
+    if kind == 'flashcards':
+        return [Flashcard(fuzz_text(rng), fuzz_text(rng)) for _ in range(rng.randint(0, 5))]
+    return LectureNotes(fuzz_text(rng, (5, 30)), *([fuzz_text(rng) for _ in range(rng.randint(0, 4))]
+                                                   for _ in range(3)))
+
+def render_fuzz_reply(rng, kind):
+    """A random well-formed reply in a random mix of styles, plus the records it holds"""
+    expected = random_records(rng, kind)
+    out = []
+    if kind == 'quiz':
+        for i, q in enumerate(expected, 1):
+            out.append(rng.choice([f"Q{i}: ", f"Q{i}. ", f"Question {i}: ", f"**Q{i}:** ", f"{i}. ", f"{i}) ",
+                                   f"### Q{i}: "]) + fuzz_wrap(rng, q.question))
+            for k, v in q.options.items():
+                out.append(rng.choice([f"{k}) ", f"({k}) ", f"{k.lower()}) ", f"{k}. ", f"**{k})** "]) + fuzz_wrap(rng, v))
+            out.append(rng.choice([f"CORRECT: {q.correct}", f"Correct answer: {q.correct}",
+                                   f"**CORRECT:** {q.correct}", f"Answer: ({q.correct})"]))
+            out.append(rng.choice(["EXPLANATION: ", "**Explanation:** "]) + fuzz_wrap(rng, q.explanation))
+            out.append('' if rng.random() < 0.7 else '\n')
+    elif kind == 'flashcards':
+        for i, card in enumerate(expected, 1):
+            header = rng.choice([f"CARD {i}", f"**CARD {i}**", f"Card {i}:", f"Flashcard {i}", None])
+            if header:
+                out.append(header)
+            out.append(rng.choice(["FRONT: ", "**Front:** ", "front: "]) + fuzz_wrap(rng, card.front))
+            out.append(rng.choice(["BACK: ", "**Back:** ", "back: "]) + fuzz_wrap(rng, card.back))
+            out.append('')
+    else:
+        out.append(rng.choice(["SUMMARY:", "## Summary", "**SUMMARY:**"]))
+        out.append(fuzz_wrap(rng, expected.summary))
+        for name, items in zip(('key_concepts', 'examples', 'study_tips'), expected[1:]):
+            label = name.upper()
+            out.append(rng.choice([f"{label}:", f"## {label.replace('_', ' ').title()}", f"**{label.replace('_', ' ')}:**"]))
+            bullet = rng.choice(['• ', '- ', '* ', None])
+            for n, item in enumerate(items, 1):
+                out.append((bullet or f"{n}. ") + fuzz_wrap(rng, item))
+    newline = '\r\n' if rng.random() < 0.2 else '\n'
+    return newline.join(out), expected
+
+def render_canonical_reply(rng, kind):
+    """A random reply in exactly the prompted format, plus the records it holds"""
+    expected = random_records(rng, kind)
+    if kind == 'quiz':
+        text = '\n\n'.join(f"Q{i}: {q.question}\n" + ''.join(f"{k}) {v}\n" for k, v in q.options.items())
+                           + f"CORRECT: {q.correct}\nEXPLANATION: {q.explanation}"
+                           for i, q in enumerate(expected, 1))
+    elif kind == 'flashcards':
+        text = '\n\n'.join(f"CARD {i}\nFRONT: {card.front}\nBACK: {card.back}" for i, card in enumerate(expected, 1))
+    else:
+        text = f"SUMMARY:\n{expected.summary}\n" + ''.join(
+            f"\n{label}:\n" + ''.join(f"• {item}\n" for item in items)
+            for label, items in zip(('KEY_CONCEPTS', 'EXAMPLES', 'STUDY_TIPS'), expected[1:]))
+    return text, expected
+
+def normalise_record(record):
+    """Compare records modulo line wrapping"""
+    if isinstance(record, LectureNotes):
+        return LectureNotes(' '.join(record.summary.split()), *record[1:])
+    return record
+
+def scan(parser, text):
+    """The line scanner alone, without the exact-format fast path"""
+    parser.feed(text)
+    return parser.close()
+
+def fuzz_cases(seed, render=render_fuzz_reply):
+    rng = random.Random(seed)
+    for _ in range(CASES_PER_SEED):
+        kind = rng.choice(list(PARSERS))
+        yield rng, kind, PARSERS[kind], *render(rng, kind)
+
+@pytest.mark.parametrize('kind, expected, text', PARSER_CORPUS)
+def test_recorded_replies(kind, expected, text):
+    assert count_parsed(kind, parse_reply(PARSERS[kind](), text)) == expected
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_well_formed_replies_roundtrip(seed):
+    for _, kind, parser, text, expected in fuzz_cases(seed):
+        parsed = parse_reply(parser(), text)
+        assert normalise_record(parsed) == normalise_record(expected), text
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_chunked_feed_matches_whole_reply(seed):
+    for rng, _, parser, text, _ in fuzz_cases(seed):
+        streamed = parser()
+        pos = 0
+        while pos < len(text):
+            step = rng.randint(1, 40)
+            streamed.feed(text[pos:pos + step])
+            pos += step
+        assert streamed.close() == scan(parser(), text), text
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_damaged_replies_yield_only_complete_records(seed):
+    for rng, kind, parser, text, _ in fuzz_cases(seed):
+        lines = text.splitlines()
+        if rng.random() < 0.5:
+            rng.shuffle(lines)
+        records = parse_reply(parser(), '\n'.join(lines)[:rng.randint(0, len(text))])
+        if kind == 'quiz':
+            assert all(q.question and len(q.options) == 4 and q.correct in q.options for q in records)
+        elif kind == 'flashcards':
+            assert all(c.front and c.back for c in records)
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_canonical_replies_take_the_exact_path(seed):
+    for _, _, parser, text, expected in fuzz_cases(seed, render_canonical_reply):
+        assert parser().exact(text) == expected, text
+        assert scan(parser(), text) == expected, text
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_exact_path_agrees_with_line_scanner(seed):
+    for rng, _, parser, text, _ in fuzz_cases(seed, render_canonical_reply):
+        lines = text.split('\n')
+        for _ in range(rng.randint(1, 3)):
+            at = rng.randrange(len(lines))
+            edit = rng.random()
+            if edit < 0.5:
+                lines.insert(at, rng.choice(TRICKY_LINES))
+            elif edit < 0.7 and len(lines) > 1:
+                del lines[at]
+            elif edit < 0.9:
+                lines.insert(at, lines[at])
+            else:
+                lines[at] += rng.choice(['  ', '\t', '\r', ' x', ':'])
+        mangled = '\n'.join(lines)
+        exact = parser().exact(mangled)
+        assert exact is None or exact == scan(parser(), mangled), mangled